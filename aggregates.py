@@ -0,0 +1,178 @@
+import math
+from bisect import bisect_left, insort
+
+# Sums are kept as exact fixed-point integers so repeated add/remove cycles
+# never drift; every read is a single correctly rounded division.
+_FX = 1 << 80
+_FX_MAX = 1e200  # value * _FX must stay a finite float
+
+
+def _fx(value):
+    if not math.isfinite(value) or abs(value) > _FX_MAX:
+        raise ValueError(f"value out of range for the running sums: {value!r}")
+    return int(value * _FX)
+
+
+class _Group:
+    """Running count/sum/export-ready tally plus a value-ordered ranking for a set of farms"""
+
+    __slots__ = ("count", "_sum", "export_ready", "ranked")
+
+    def __init__(self):
+        self.count = 0
+        self._sum = 0
+        self.export_ready = 0
+        self.ranked = []  # sorted (value, -id); ties resolve to the lowest id first; insort shifts O(n)
+
+    def add(self, fid, value, export_ready):
+        fx = _fx(value)  # raises before anything changes
+        self.count += 1
+        self._sum += fx
+        self.export_ready += export_ready
+        insort(self.ranked, (value, -fid))
+
+    def remove(self, fid, value, export_ready):
+        self.count -= 1
+        self._sum -= _fx(value)
+        self.export_ready -= export_ready
+        i = bisect_left(self.ranked, (value, -fid))
+        del self.ranked[i]
+
+    @property
+    def value_sum(self):
+        return self._sum / _FX
+
+    def mean(self):
+        return self._sum / (_FX * self.count) if self.count else None
+
+    def top_ids(self, n):
+        return [-key[1] for key in self.ranked[:-n - 1:-1]] if n else []
+
+
+class AggregateStore:
+    """
+    Dashboard aggregates kept current per write.
+    upsert() swaps a farm's previous contribution for its current one: the
+    sums are O(1), the rankings an O(log n) bisect plus an O(n) list shift
+    (a memmove, ~20 us at 100k farms). Reads never iterate over
+    the farm registry; the per-day timeseries comes from the rollups.
+    """
+
+    def __init__(self, zone_ids, fda_limit_bq):
+        self.zone_ids = list(zone_ids)
+        self.fda_limit_bq = fda_limit_bq
+        self.reset()
+
+    def reset(self):
+        self.all = _Group()
+        self.zones = {zid: _Group() for zid in self.zone_ids}
+        self.status_counts = {}
+        self.fda_compliant = 0
+        self._state = {}    # farm id -> contribution currently counted
+        self._farms = {}    # farm id -> farm record
+
+    @property
+    def total(self):
+        return self.all.count
+
+    def upsert(self, farm):
+        """Replace the contribution of one farm with its current fields"""
+        fid = farm.id
+        _fx(farm.value)  # reject before the previous contribution is dropped
+        self.discard(fid)
+        state = (
+            farm.value,
+            farm.status,
+            farm.zone,
+            int(farm.export_ready),
+            int(farm.value_bq < self.fda_limit_bq)
+        )
+        value, status, zid, ready, fda_ok = state
+        self.all.add(fid, value, ready)
+        if zid in self.zones:
+            self.zones[zid].add(fid, value, ready)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        self.fda_compliant += fda_ok
+        self._state[fid] = state
+        self._farms[fid] = farm
+
+    def upsert_many(self, farms):
+        """
+        upsert() for many farms. Past a quarter of the store the running sums
+        and rankings are rebuilt once from every farm's contribution (one sort
+        overall, split by zone in order) instead of an O(n) insort per farm.
+        Every value is checked before anything changes.
+        """
+        if len(farms) * 4 < len(self._state):
+            for farm in farms:
+                self.upsert(farm)
+            return
+        if not all(math.isfinite(f.value) and abs(f.value) <= _FX_MAX for f in farms):
+            for farm in farms:
+                _fx(farm.value)  # raises for the first bad one
+        limit = self.fda_limit_bq
+        for farm in farms:
+            self._state[farm.id] = (farm.value, farm.status, farm.zone, int(farm.export_ready),
+                                    int(farm.value_bq < limit))
+            self._farms[farm.id] = farm
+        self._rebuild()
+
+    def _rebuild(self):
+        """Recount every group from self._state"""
+        everyone = _Group()
+        zones = {zid: _Group() for zid in self.zone_ids}
+        status_counts = {}
+        fda_compliant = 0
+        for value, status, zid, ready, fda_ok in self._state.values():
+            fx = int(value * _FX)
+            everyone._sum += fx
+            everyone.export_ready += ready
+            group = zones.get(zid)
+            if group is not None:
+                group.count += 1
+                group._sum += fx
+                group.export_ready += ready
+            status_counts[status] = status_counts.get(status, 0) + 1
+            fda_compliant += fda_ok
+        everyone.count = len(self._state)
+        everyone.ranked = sorted([(st[0], -fid) for fid, st in self._state.items()])
+        state = self._state
+        for key in everyone.ranked:
+            group = zones.get(state[-key[1]][2])
+            if group is not None:
+                group.ranked.append(key)
+        self.all, self.zones = everyone, zones
+        self.status_counts = status_counts
+        self.fda_compliant = fda_compliant
+
+    def discard(self, fid):
+        state = self._state.pop(fid, None)
+        if state is None:
+            return
+        value, status, zid, ready, fda_ok = state
+        self.all.remove(fid, value, ready)
+        if zid in self.zones:
+            self.zones[zid].remove(fid, value, ready)
+        self.status_counts[status] -= 1
+        self.fda_compliant -= fda_ok
+        del self._farms[fid]
+
+    def count(self, status):
+        return self.status_counts.get(status, 0)
+
+    def min_value(self):
+        return self.all.ranked[0][0] if self.all.ranked else 0
+
+    def max_value(self):
+        return self.all.ranked[-1][0] if self.all.ranked else 0
+
+    def top(self, n, zone=None):
+        """The n farms with the highest current value, overall or within one zone"""
+        group = self.zones[zone] if zone is not None else self.all
+        return [self._farms[fid] for fid in group.top_ids(n)]
+
+    def zone_mean(self, zid, default=None):
+        group = self.zones.get(zid)
+        if not group or not group.count:
+            return default
+        return group.mean()
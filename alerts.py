@@ -0,0 +1,218 @@
+"""
+Incremental alert engine.
+
+Alerts are evaluated only for the farms a write touched, so the cost of a
+write is O(changed farms) and reads never scan the registry. A farm has at
+most one open alert:
+
+  level  Critical at >= critical, warning at >= high; hysteresis keeps an
+         alert at its severity until the value falls `band` ppb below the
+         threshold, so a farm hovering at a threshold does not flap.
+  rate   a warning for a reading that jumped by >= rate_jump ppb while the
+         farm was below the level bands; cleared once the value is back at
+         or below the reading before the jump, or promoted to a level alert.
+
+Every open, change, ack and clear takes the next sequence number; the
+changes index is ordered by it, so since(cursor) walks back only over what
+changed after the cursor. Cleared alerts are kept for `keep_cleared`
+changes; a cursor older than that gets a full resync instead.
+"""
+from collections import OrderedDict, deque
+
+import numpy as np
+
+CRITICAL, WARNING = "critical", "warning"
+LEVEL, RATE = "level", "rate"
+OPEN, CLEARED = "open", "cleared"
+
+
+class Alert:
+    __slots__ = ("id", "farm_id", "severity", "trigger", "value", "baseline", "status",
+                 "opened_at", "updated_at", "acked_by", "acked_at", "seq")
+
+    FIELDS = __slots__
+
+    def __init__(self, alert_id, farm_id, severity, trigger, value, baseline, time_iso):
+        self.id = alert_id
+        self.farm_id = farm_id
+        self.severity = severity
+        self.trigger = trigger
+        self.value = value
+        self.baseline = baseline
+        self.status = OPEN
+        self.opened_at = time_iso
+        self.updated_at = time_iso
+        self.acked_by = None
+        self.acked_at = None
+        self.seq = 0
+
+    def to_state(self):
+        return [getattr(self, name) for name in self.FIELDS]
+
+    @classmethod
+    def from_state(cls, row):
+        alert = cls.__new__(cls)
+        for name, value in zip(cls.FIELDS, row):
+            setattr(alert, name, value)
+        return alert
+
+
+class AlertEngine:
+    def __init__(self, critical, high, band=5.0, rate_jump=15.0, keep_cleared=1000):
+        self.critical = critical
+        self.high = high
+        self.band = band
+        self.rate_jump = rate_jump
+        self.keep_cleared = keep_cleared
+        self.reset()
+
+    def reset(self):
+        self.seq = 0
+        self.floor = 0             # cursors below this may have missed an evicted clear
+        self._next_id = 1
+        self.open = {}             # farm id -> open Alert
+        self.by_id = {}            # alert id -> Alert, open or recently cleared
+        self._changes = OrderedDict()  # alert id -> Alert, oldest change first
+        self._cleared = deque()
+
+    def _level(self, value, current):
+        """Severity a level alert should have, given the severity it has now"""
+        if value >= self.critical or (current == CRITICAL and value >= self.critical - self.band):
+            return CRITICAL
+        if value >= self.high or (current is not None and value >= self.high - self.band):
+            return WARNING
+        return None
+
+    def _touch(self, alert, time_iso):
+        self.seq += 1
+        alert.seq = self.seq
+        alert.updated_at = time_iso
+        self._changes[alert.id] = alert
+        self._changes.move_to_end(alert.id)
+
+    def _open(self, farm_id, severity, trigger, value, baseline, time_iso):
+        alert = Alert(self._next_id, farm_id, severity, trigger, value, baseline, time_iso)
+        self._next_id += 1
+        self.open[farm_id] = alert
+        self.by_id[alert.id] = alert
+        self._touch(alert, time_iso)
+        return alert
+
+    def _clear(self, alert, time_iso):
+        alert.status = CLEARED
+        del self.open[alert.farm_id]
+        self._touch(alert, time_iso)
+        self._cleared.append(alert.id)
+        while len(self._cleared) > self.keep_cleared:
+            old = self.by_id.pop(self._cleared.popleft())
+            self._changes.pop(old.id, None)
+            self.floor = max(self.floor, old.seq)
+
+    def evaluate(self, farm_id, value, prev_value, time_iso):
+        """
+        Re-evaluate one farm after a write.
+        Returns (alert, change) with change in opened/escalated/deescalated/updated/cleared,
+        or (None, None) when nothing changed.
+        """
+        alert = self.open.get(farm_id)
+        current = alert.severity if alert is not None and alert.trigger == LEVEL else None
+        level = self._level(value, current)
+
+        if level is not None:
+            if alert is None:
+                return self._open(farm_id, level, LEVEL, value, None, time_iso), "opened"
+            if alert.trigger == RATE or level != alert.severity:
+                escalated = alert.trigger == RATE or level == CRITICAL
+                alert.trigger = LEVEL
+                alert.severity = level
+                alert.value = value
+                if escalated:
+                    alert.acked_by = alert.acked_at = None
+                self._touch(alert, time_iso)
+                return alert, "escalated" if escalated else "deescalated"
+            if value == alert.value:
+                return None, None
+            alert.value = value
+            self._touch(alert, time_iso)
+            return alert, "updated"
+
+        rising = prev_value is not None and value - prev_value >= self.rate_jump
+        if alert is None:
+            if rising:
+                return self._open(farm_id, WARNING, RATE, value, prev_value, time_iso), "opened"
+            return None, None
+        if alert.trigger == LEVEL or value <= alert.baseline:
+            self._clear(alert, time_iso)
+            return alert, "cleared"
+        if value == alert.value:
+            return None, None
+        alert.value = value
+        self._touch(alert, time_iso)
+        return alert, "updated"
+
+    def evaluate_many(self, farm_ids, values, prev_values, time_iso):
+        """
+        evaluate() for many farms at once, in order; returns the (alert, change) pairs that changed.
+        Only farms with an open alert or a reading that could open one (at or over `high`,
+        or a rate jump) are visited; for the rest evaluate() would return (None, None).
+        """
+        value = np.asarray(values, np.float64)
+        maybe = (value >= self.high) | (value - np.asarray(prev_values, np.float64) >= self.rate_jump)
+        if self.open:
+            maybe |= np.isin(np.asarray(farm_ids), np.fromiter(self.open, np.int64, len(self.open)))
+        out = []
+        for i in np.flatnonzero(maybe).tolist():
+            alert, change = self.evaluate(farm_ids[i], values[i], prev_values[i], time_iso)
+            if alert:
+                out.append((alert, change))
+        return out
+
+    def discard(self, farm_id, time_iso):
+        """Clear the open alert of a farm that left the registry"""
+        alert = self.open.get(farm_id)
+        if alert is not None:
+            self._clear(alert, time_iso)
+
+    def ack(self, alert_id, user, time_iso):
+        """Acknowledge an open alert; None if it is not open or already acknowledged"""
+        alert = self.by_id.get(alert_id)
+        if alert is None or alert.status != OPEN or alert.acked_by is not None:
+            return None
+        alert.acked_by = user
+        alert.acked_at = time_iso
+        self._touch(alert, time_iso)
+        return alert
+
+    def since(self, cursor):
+        """Alerts changed after cursor in change order, or None if cursor predates the retained history"""
+        if cursor < self.floor:
+            return None
+        out = []
+        for alert in reversed(self._changes.values()):
+            if alert.seq <= cursor:
+                break
+            out.append(alert)
+        out.reverse()
+        return out
+
+    def to_state(self):
+        return {
+            "seq": self.seq,
+            "floor": self.floor,
+            "next_id": self._next_id,
+            "alerts": [a.to_state() for a in self._changes.values()]
+        }
+
+    def load_state(self, state):
+        self.reset()
+        self.seq = state["seq"]
+        self.floor = state["floor"]
+        self._next_id = state["next_id"]
+        for row in state["alerts"]:
+            alert = Alert.from_state(row)
+            self.by_id[alert.id] = alert
+            self._changes[alert.id] = alert
+            if alert.status == OPEN:
+                self.open[alert.farm_id] = alert
+            else:
+                self._cleared.append(alert.id)
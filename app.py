@@ -1,17 +1,38 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_file, send_from_directory
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request as WSGIRequest
 from datetime import datetime, timedelta
-import random, statistics, math, os
+import asyncio, base64, hashlib, json, random, secrets, math, os, sys, threading, time
 from uuid import uuid4
-from functools import wraps
+from functools import lru_cache, wraps
+from itertools import islice
+import numpy as np
+from geo import GridIndex
+from heatgrid import HeatGrid
+from rollups import RollupStore, RESOLUTIONS, DAY
+from forecast import ForecastEngine, normal_cdf, Z_95
+from dispatch import Dispatcher
+from alerts import AlertEngine, CRITICAL, WARNING, LEVEL, RATE, OPEN
+from aggregates import AggregateStore
+from cache import ResponseCache
+from metrics import Metrics, Profiler
+from serialization import FragmentCache, JSONProvider, dumps, join_array
+from broker import EventBroker, sse_frame
+from samplestore import SampleStore, iso_to_us, us_to_iso
+from registry import FarmRecord, FarmRegistry, SORT_KEYS, STATUS_CODES, status_code
+from shared_state import RWLock, SharedState
+from sessions import SessionManager, check_password
+import export
+import simulation
+from jobs import JobQueue, QueueFull, StreamResult, SUCCEEDED, FAILED, CANCELLED
+from ingest import BulkFormatError, MAX_VALUE, ROW_ERRORS, RecentIds, iter_rows, validate_batch
 
 app = Flask(__name__)
+app.json = JSONProvider(app)  # orjson-backed jsonify when orjson is installed
 CORS(app)
 app.config["JSONIFY_PRETTYPRINT_REGULAR"] = False  # Production best practice
 
-print(">>> Current working dir:", os.getcwd())
-print(">>> Files:", os.listdir(os.getcwd()))
-
 # -----------------------
 # CONFIGURATION
 # -----------------------
@@ -28,6 +49,16 @@ def bq_to_ppb(bq):
 def ppb_to_bq(ppb):
     return round(ppb / 0.027, 2)
 
+def get_status(value):
+    """Determine contamination status based on ppb value"""
+    if value >= THRESHOLD_CRITICAL:
+        return "Critical"
+    elif value >= THRESHOLD_HIGH:
+        return "High"
+    elif value >= THRESHOLD_MEDIUM:
+        return "Medium"
+    return "Safe"
+
 # -----------------------
 # ZONES (island centers used for circle placement)
 # -----------------------
@@ -47,13 +78,43 @@ ZONES_META = {
     "papua_north": {"name": "Pantai Utara Papua", "center": [-1.5, 139.8], "display_center": [-1.2, 140.3]}
 }
 
+# Spatial index over zone centers (2-degree cells, great-circle distance)
+ZONE_INDEX = GridIndex(cell_deg=2.0)
+for _zid, _meta in ZONES_META.items():
+    ZONE_INDEX.insert(_zid, *_meta["center"])
+
+def closest_zone_id(lat, lng):
+    """Find closest zone center to a coordinate"""
+    return ZONE_INDEX.nearest(lat, lng)[0]
+
 # -----------------------
-# Preloaded farms (demo) distributed across islands
+# PERSISTENCE
 # -----------------------
-now = datetime.utcnow()
+# Full sample history goes to an append-only store when CESIUM_DATA_DIR is set
+# (opened by start()); farms keep only the most recent HISTORY_WINDOW samples in memory.
+HISTORY_WINDOW = 30
+TIMESERIES_DAYS = 14
+ANALYTICS_DAYS = 30        # /api/farm/<id> analytics: the farm's last 30 days of samples
+ROLLUP_RESTORE_DAYS = 90   # stored samples replayed into the rollups when farms are restored
+MAX_BULK_ROWS = 50000
+FARMS_PAGE_DEFAULT = 100
+FARMS_PAGE_MAX = 1000
+NEAR_MAX_RADIUS_KM = 1000
+DATA_DIR = os.getenv("CESIUM_DATA_DIR")
+SAMPLE_STORE = None
+
+# Background jobs (simulation, export) run off the request threads
+JOB_WORKERS = int(os.getenv("CESIUM_JOB_WORKERS", 2))
+JOB_QUEUE_DEPTH = 16
+LEGACY_JOB_WAIT_SECONDS = 25  # /api/simulate and /api/export answer inline if done by then
+SIMULATION_COMMIT_ATTEMPTS = 3  # lock-free runs a committing simulation may lose to other writes
 
-def make_history(base, days=7):
+# -----------------------
+# Preloaded farms (demo) distributed across islands
+# -----------------------
+def make_history(base, days=7, now=None):
     """Create synthetic history points for last N days with realistic variation"""
+    now = now or datetime.utcnow()
     arr = []
     for d in range(days):
         t = (now - timedelta(days=(days-d-1))).isoformat()
@@ -69,7 +130,7 @@ def make_history(base, days=7):
     return arr
 
 # More realistic farm data
-FARMS = [
+SEED_FARMS = [
     {"id": 1, "name": "Aceh Lhokseumawe Aqua", "location": "Lhokseumawe, Aceh", "lat": 5.188, "lng": 97.115, "operator": "PT Samudra Aceh", "capacity": "14 ha"},
     {"id": 2, "name": "Batam Strait Mariculture", "location": "Batam, Riau Islands", "lat": 1.104, "lng": 104.019, "operator": "PT Barelang Farms", "capacity": "9 ha"},
     {"id": 3, "name": "Bintan Deepwater Shrimp", "location": "Bintan, Riau Islands", "lat": 1.005, "lng": 104.566, "operator": "CV Segara Timur", "capacity": "7 ha"},
@@ -99,182 +160,518 @@ FARMS = [
     {"id": 27, "name": "Kupang Nusantara Aqua", "location": "Kupang, NTT", "lat": -10.18, "lng": 123.6, "operator": "PT Timur Biru", "capacity": "5 ha"}
 ]
 
-# Initialize farms with realistic base values
-for f in FARMS:
-    # Some farms have higher base contamination (near industrial areas)
-    if "Jakarta" in f["location"] or "Lampung" in f["location"]:
-        base = round(random.uniform(40, 75), 2)  # Higher risk areas
-    else:
-        base = round(random.uniform(12, 45), 2)  # Normal risk
-    
-    f["history"] = make_history(base, days=14)  # 2 weeks history
-    f["value"] = f["history"][-1]["value"]
-    f["value_bq"] = ppb_to_bq(f["value"])
-    
-    # Status classification
-    if f["value"] >= THRESHOLD_CRITICAL:
-        f["status"] = "Critical"
-    elif f["value"] >= THRESHOLD_HIGH:
-        f["status"] = "High"
-    elif f["value"] >= THRESHOLD_MEDIUM:
-        f["status"] = "Medium"
+# Live farm records, indexed by id, status and zone
+FARMS = FarmRegistry()
+
+# Readers take STATE_LOCK.read(); writers go through SHARED.writing(), which
+# holds STATE_LOCK.write() together with the cross-process log lock. Long
+# passes over every farm (simulation, export) read FARMS.snapshot() instead.
+STATE_LOCK = RWLock()
+
+# Running aggregates behind /api/stats, /api/zones and /api/intel
+AGGREGATES = AggregateStore(ZONES_META.keys(), FDA_INTERVENTION_LEVEL)
+
+# Per-zoom heatmap cells behind /api/heatmap?bbox=&zoom= and the heatmap tiles
+HEAT_GRID = HeatGrid()
+
+# Hour/day/week rollups per farm and zone behind the history range queries
+ROLLUPS = RollupStore()
+
+# Holt/AR models per farm, updated per sample, behind /api/forecast and ai_projection
+FORECASTS = ForecastEngine()
+FORECAST_MAX_HORIZON = 30
+
+# Overdue farms ranked for field sampling (/api/dispatch, intel sampling_queue)
+SAMPLING_SLA_HOURS = 36
+DISPATCH = Dispatcher(sla_hours=SAMPLING_SLA_HOURS)
+
+# Open alerts, re-evaluated only for the farms each write touches
+ALERT_HYSTERESIS_PPB = 5    # an alert holds until the value is this far below its threshold
+ALERT_RATE_JUMP_PPB = 15    # a rise this large between samples raises a warning on its own
+ALERTS = AlertEngine(THRESHOLD_CRITICAL, THRESHOLD_HIGH, band=ALERT_HYSTERESIS_PPB, rate_jump=ALERT_RATE_JUMP_PPB)
+
+# Serialized GET bodies, invalidated by bump_data_version() on every write
+RESPONSE_CACHE = ResponseCache()
+
+# Encoded JSON per farm, invalidated per farm by record_readings/relocation
+FRAGMENTS = FragmentCache()
+
+def bump_data_version():
+    return RESPONSE_CACHE.bump()
+
+# Per-process request latency/size histograms and hot-path spans (/metrics),
+# plus the opt-in profiler behind /api/profile
+METRICS = Metrics()
+PROFILER = Profiler()
+PROFILE_MAX_REQUESTS = 1000
+
+# Live feed for /api/stream subscribers; event ids are scoped to this process
+BROKER = EventBroker(instance=uuid4().hex[:8])
+STREAM_FARM_FIELDS = ("id", "lat", "lng", "zone", "value", "value_bq", "status", "lastUpdate", "export_ready")
+
+# Client sample ids already applied, so retried bulk uploads are not double-inserted
+APPLIED_SAMPLE_IDS = RecentIds(maxlen=1_000_000)
+
+def refresh_current(farm):
+    """Set current value, status and last update from the newest sample"""
+    value = farm.history.values[-1]
+    farm.value = value
+    farm.value_bq = ppb_to_bq(value)
+    farm.status_code = STATUS_CODES[get_status(value)]
+    farm.updated_us = farm.history.times[-1]
+
+def init_farm(f):
+    """Derive current reading, status and zone for a farm from its history"""
+    refresh_current(f)
+    f.zone = closest_zone_id(f.lat, f.lng)
+
+def record_reading(farm, value, inspector, notes, time_iso=None):
+    """Append a reading to a farm's history and refresh its current fields and aggregates"""
+    return record_readings(farm, [(value, inspector, notes)], time_iso)
+
+def record_readings(farm, readings, time_iso=None, trim=None):
+    """
+    Append (value, inspector, notes) readings in order; current fields and the
+    farm's aggregate contribution are refreshed once, from the last reading.
+    farm is a copy() not yet installed; FARMS.index() installs it.
+    trim: keep only the newest `trim` samples in the farm's history.
+    """
+    time_iso = time_iso or datetime.utcnow().isoformat()
+    t_us = iso_to_us(time_iso)
+    history = farm.history
+    for value, inspector, notes in readings:
+        history.append(t_us, value, inspector, notes)
+        ROLLUPS.add(farm.id, farm.zone, t_us, value)
+        FORECASTS.add(farm.id, value)
+    if trim:
+        history.trim(trim)
+    refresh_current(farm)
+    AGGREGATES.upsert(farm)
+    HEAT_GRID.upsert(farm)
+    FARMS.index(farm)
+    sync_dispatch(farm)
+    FRAGMENTS.invalidate(farm.id)
+    return history
+
+def sync_dispatch(farm, zones=()):
+    """Re-rank a farm in DISPATCH after refreshing the severity of its zone (and any zones it left)"""
+    sync_zone_levels((farm.zone, *zones))
+    DISPATCH.upsert(farm.id, farm.value, farm.updated_us, farm.zone, farm.history.inspectors[-1],
+                    farm.lat, farm.lng)
+
+def sync_zone_levels(zones):
+    """Hand DISPATCH the current severity of each zone"""
+    for zid in zones:
+        group = AGGREGATES.zones[zid]
+        avg_val = round(group.mean(), 2) if group.count else 0
+        DISPATCH.set_zone_level(zid, STATUS_CODES[get_status(avg_val)])
+
+def record_batch(farms, values, time_iso, inspector, notes, trim=None):
+    """
+    One reading per farm, applied as a single bulk update: new records are
+    built in one pass and every store takes the whole set at once (see the
+    *_many methods). farms: the current records, distinct; returns the new
+    records, not yet installed (FARMS.index_many() installs them).
+    """
+    t_us = iso_to_us(time_iso)
+    out = []
+    for old, value in zip(farms, values):
+        farm = old.copy(history=old.history.appended(t_us, value, inspector, notes, trim))
+        farm.value = value
+        farm.value_bq = ppb_to_bq(value)
+        farm.status_code = STATUS_CODES[get_status(value)]
+        farm.updated_us = t_us
+        out.append(farm)
+    ids = [f.id for f in out]
+    AGGREGATES.upsert_many(out)  # rejects a non-finite value before any store changes
+    HEAT_GRID.upsert_many(out)
+    ROLLUPS.add_many(ids, [f.zone for f in out], t_us, values)
+    FORECASTS.add_many(ids, values)
+    FARMS.index_many(out)
+    sync_zone_levels({f.zone for f in out})
+    inspector = out[0].history.inspectors[-1] if out else inspector  # interned
+    DISPATCH.upsert_many([(f.id, f.value, t_us, f.zone, inspector, f.lat, f.lng) for f in out])
+    for fid in ids:
+        FRAGMENTS.invalidate(fid)
+    return out
+
+# -----------------------
+# SHARED STATE (all worker processes)
+# -----------------------
+# Every write is an event in SHARED's log; each process applies the log to its
+# own FARMS/AGGREGATES/caches, so gunicorn can run several workers.
+#   load      {farms, samples}               replace the farm set
+#   readings  {time, farms: [[id, [[value, inspector, notes], ...]], ...], trim, sample_ids}
+#   batch     {time, farm_ids, values, inspector, notes, trim}   one reading per (distinct) farm
+#   location  {farm_id, lat, lng}
+#   ack       {alert_id, user, time}
+#   revoke    {jti, exp}                     a logged-out session token
+STATE_DB = os.getenv("CESIUM_STATE_DB") or (os.path.join(DATA_DIR, "state.db") if DATA_DIR else None)
+
+# Pickled replica next to a persistent log, so a new worker restores it instead of replaying
+REPLICA_CHECKPOINT = STATE_DB + ".replica" if STATE_DB else None
+REPLICA_STORES = ("FARMS", "AGGREGATES", "HEAT_GRID", "ROLLUPS", "FORECASTS", "DISPATCH", "ALERTS",
+                  "APPLIED_SAMPLE_IDS")
+
+def load_farms(records, samples=None):
+    """
+    Replace the farm registry with the given records, in every worker process.
+    records: FarmRecord objects or farm dicts in the API shape.
+    samples: [[farm_id, [[time_iso, value], ...]], ...] for the rollups; farms not
+    listed (by default every farm) are rolled up from their history.
+    """
+    start()
+    farms = [f.to_dict() if isinstance(f, FarmRecord) else f for f in records]
+    with SHARED.writing() as events:
+        events.append(("load", {"farms": farms, "samples": samples}))
+
+def readings_event(batches, time_iso=None, trim=None, sample_ids=()):
+    """A "readings" event from (farm_id, [(value, inspector, notes), ...]) batches"""
+    return ("readings", {
+        "time": time_iso or datetime.utcnow().isoformat(),
+        "farms": [[fid, [list(r) for r in readings]] for fid, readings in batches],
+        "trim": trim,
+        "sample_ids": list(sample_ids)
+    })
+
+def batch_event(farm_ids, values, inspector, notes, time_iso=None, trim=None):
+    """A "batch" event: one reading per farm as columns, applied with record_batch()"""
+    return ("batch", {
+        "time": time_iso or datetime.utcnow().isoformat(),
+        "farm_ids": list(farm_ids),
+        "values": list(values),
+        "inspector": inspector,
+        "notes": notes,
+        "trim": trim
+    })
+
+def apply_event(kind, payload):
+    """Apply one shared-state event to this process's replica"""
+    if SAMPLE_STORE and not SHARED.replaying:
+        SAMPLE_STORE.refresh()  # samples another worker appended for this event
+    if kind == "load":
+        with FARMS.writing(publish=not SHARED.replaying):
+            apply_load(payload["farms"], payload.get("samples"), payload.get("alerts"),
+                       payload.get("rollups"), payload.get("forecasts"))
+        if "revocations" in payload:
+            SESSIONS.load_revocations(payload["revocations"])
+        return
+    if kind == "revoke":
+        SESSIONS.revoke(payload["jti"], payload["exp"])
+        return
+    if kind == "ack":
+        if ALERTS.ack(payload["alert_id"], payload["user"], payload["time"]):
+            bump_data_version()
+        return
+    if kind not in ("readings", "batch", "location"):
+        return
+    alert_changes = []
+    extra_zones = ()
+    # Farms are copy-on-write: change a copy, then install it (see registry)
+    with FARMS.writing(publish=not SHARED.replaying):
+        if kind == "batch":
+            pairs = [(f, v) for f, v in zip(map(FARMS.get, payload["farm_ids"]), payload["values"]) if f is not None]
+            old = [f for f, _ in pairs]
+            values = [v for _, v in pairs]
+            changed = record_batch(old, values, payload["time"], payload["inspector"], payload["notes"],
+                                   trim=payload.get("trim"))
+            alert_changes = ALERTS.evaluate_many([f.id for f in old], values, [f.value for f in old],
+                                                 payload["time"])
+        elif kind == "readings":
+            changed = []
+            for fid, readings in payload["farms"]:
+                farm = FARMS.get(fid)
+                if farm is None:
+                    continue
+                farm = farm.copy()
+                changed.append(farm)
+                prev_value = farm.value
+                record_readings(farm, readings, payload["time"], trim=payload.get("trim"))
+                alert, change = ALERTS.evaluate(fid, farm.value, prev_value, payload["time"])
+                if alert:
+                    alert_changes.append((alert, change))
+            for sid in payload.get("sample_ids", ()):
+                APPLIED_SAMPLE_IDS.add(sid)
+        else:
+            farm = FARMS.get(payload["farm_id"])
+            if farm is None:
+                return
+            farm = farm.copy()
+            extra_zones = [farm.zone]
+            farm.lat = payload["lat"]
+            farm.lng = payload["lng"]
+            farm.zone = closest_zone_id(farm.lat, farm.lng)
+            AGGREGATES.upsert(farm)
+            HEAT_GRID.upsert(farm)
+            FARMS.index(farm)
+            sync_dispatch(farm, extra_zones)
+            FRAGMENTS.invalidate(farm.id)
+            changed = [farm]
+    bump_data_version()
+    if changed and not SHARED.replaying:
+        publish_changes(changed, extra_zones=extra_zones, alert_changes=alert_changes)
+
+def apply_load(farms, samples=None, alerts=None, rollups=None, forecasts=None):
+    """
+    Rebuild registry, aggregates, rollups, forecasts and alerts.
+    samples: per-farm (time_iso, value) pairs to roll up instead of that farm's history.
+    alerts, rollups and forecasts (from a snapshot) restore them exactly instead of from the histories.
+    """
+    records = [FarmRecord.from_dict(f) for f in farms]
+    samples = dict(samples or ())
+    AGGREGATES.reset()
+    HEAT_GRID.reset()
+    ALERTS.reset()
+    ROLLUPS.reset()
+    DISPATCH.reset()
+    FRAGMENTS.clear()
+    for f in records:
+        init_farm(f)
+        AGGREGATES.upsert(f)
+        HEAT_GRID.upsert(f)
+        if rollups is None:
+            if f.id in samples:
+                for t, v in samples[f.id]:
+                    ROLLUPS.add(f.id, f.zone, iso_to_us(t), v)
+            else:
+                for t_us, v in zip(f.history.times, f.history.values):
+                    ROLLUPS.add(f.id, f.zone, t_us, v)
+        if alerts is None:
+            ALERTS.evaluate(f.id, f.value, None, f.last_update)
+    if alerts is not None:
+        ALERTS.load_state(alerts)
+    if rollups is not None:
+        ROLLUPS.load_state(rollups)
+    if forecasts is not None:
+        FORECASTS.load_state(forecasts)
     else:
-        f["status"] = "Safe"
-    
-    f["lastUpdate"] = f["history"][-1]["time"]
-    f["certifications"] = random.choice([
-        ["HACCP", "BAP"],
-        ["HACCP"],
-        ["BAP", "CBIB"],
-        ["HACCP", "BAP", "CBIB"]
-    ])
-    f["export_ready"] = f["status"] in ["Safe", "Medium"]
+        FORECASTS.load({f.id: f.history.values for f in records})
+    for f in records:
+        sync_dispatch(f)
+    FARMS.load(records)
+    bump_data_version()
+    BROKER.publish("resync", {})
+
+def persist_event(kind, payload):
+    """Durable side effects, run once by the writing process after the event applied, before it commits"""
+    if kind == "readings" and SAMPLE_STORE:
+        SAMPLE_STORE.refresh()
+        for fid, readings in payload["farms"]:
+            for value, inspector, notes in readings:
+                SAMPLE_STORE.append(fid, payload["time"], value, inspector, notes)
+        SAMPLE_STORE.commit()
+    elif kind == "batch" and SAMPLE_STORE:
+        SAMPLE_STORE.refresh()
+        SAMPLE_STORE.append_many(payload["farm_ids"], payload["time"], payload["values"], payload["inspector"],
+                                 payload["notes"])
+        SAMPLE_STORE.commit()
+
+def snapshot_state():
+    """A "load" payload reproducing the current replica, for log compaction"""
+    return {
+        "farms": [f.to_dict() for f in FARMS],
+        "alerts": ALERTS.to_state(),
+        "rollups": ROLLUPS.to_state(),
+        "forecasts": FORECASTS.to_state(),
+        "revocations": SESSIONS.revocations()
+    }
+
+@lru_cache(maxsize=None)
+def replica_version():
+    """Hash of the code behind the replica stores; a checkpoint from other code is not restored"""
+    digest = hashlib.blake2b(digest_size=12)
+    paths = {sys.modules[type(globals()[name]).__module__].__file__ for name in REPLICA_STORES}
+    paths.add(sys.modules[GridIndex.__module__].__file__)  # FARMS holds a GridIndex
+    for path in sorted(paths | {__file__}):
+        with open(path, "rb") as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+def replica_image():
+    """This process's replica as one picklable object, for SHARED's checkpoint file"""
+    return {
+        "version": replica_version(),
+        "stores": {name: globals()[name] for name in REPLICA_STORES},
+        "revocations": SESSIONS.revocations()
+    }
+
+def restore_replica(image):
+    """Install a replica_image() in place (the store objects keep their identity)"""
+    if image["version"] != replica_version():
+        raise ValueError("checkpoint was written by different code")
+    for name, store in image["stores"].items():
+        vars(globals()[name]).update(vars(store))
+    SESSIONS.load_revocations(image["revocations"])
+    FRAGMENTS.clear()
+    bump_data_version()
+
+SHARED = SharedState(STATE_DB, apply_event, persist=persist_event, snapshot=snapshot_state, lock=STATE_LOCK,
+                     image=replica_image, restore=restore_replica, checkpoint=REPLICA_CHECKPOINT)
+
+JOBS = JobQueue(
+    os.path.join(DATA_DIR, "jobs") if DATA_DIR else None,
+    workers=JOB_WORKERS,
+    max_queued=JOB_QUEUE_DEPTH,
+    store=SHARED
+)
+
+def seed_farms():
+    """First-run farm set: restored from the sample store when it has data, else generated"""
+    restored = []
+    window_start = (datetime.utcnow().date() - timedelta(days=ROLLUP_RESTORE_DAYS - 1)).isoformat()
+    for f in SEED_FARMS:
+        stored = SAMPLE_STORE.rows(f["id"], limit=HISTORY_WINDOW) if SAMPLE_STORE else []
+        if stored:
+            f["history"] = stored
+            rows = SAMPLE_STORE.rows(f["id"], since=window_start)
+            if rows:
+                restored.append([f["id"], [[h["time"], h["value"]] for h in rows]])
+        else:
+            # Some farms have higher base contamination (near industrial areas)
+            if "Jakarta" in f["location"] or "Lampung" in f["location"]:
+                base = round(random.uniform(40, 75), 2)  # Higher risk areas
+            else:
+                base = round(random.uniform(12, 45), 2)  # Normal risk
+
+            f["history"] = make_history(base, days=14)  # 2 weeks history
+            if SAMPLE_STORE:
+                for h in f["history"]:
+                    SAMPLE_STORE.append(f["id"], h["time"], h["value"], h["inspector"], h["notes"])
+        # Seeded per farm id so certifications survive restarts
+        f["certifications"] = random.Random(f["id"]).choice([
+            ["HACCP", "BAP"],
+            ["HACCP"],
+            ["BAP", "CBIB"],
+            ["HACCP", "BAP", "CBIB"]
+        ])
+    if SAMPLE_STORE:
+        SAMPLE_STORE.commit()
+    return {"farms": SEED_FARMS, "samples": restored}
 
 # -----------------------
 # AUTH + HELPER FUNCTIONS
 # -----------------------
+# Demo accounts; passwords are bcrypt hashes (admin/secureadmin, inspector/fieldops)
 USERS = {
     "admin": {
-        "password": "secureadmin",
+        "password_hash": "$2b$12$cO.huY7tTG5jqOZQnnvFKOzQ6caAgZW37yjV2Lw3StxkY1RQV3Vc6",
         "role": "admin",
         "name": "National Control Center",
         "team": "Cesium Guard Core"
     },
     "inspector": {
-        "password": "fieldops",
+        "password_hash": "$2b$12$Sh234QTKE8dKxte1Ax9QX.FSLDpdH7HHwvHP.EuJf2HcO84HwX3iS",
         "role": "field",
         "name": "Field Inspector",
         "team": "Mobile Rapid Response"
     }
 }
 
-TOKENS = {}
+# Signed session tokens: any worker verifies them without a lookup; the key is
+# shared through SHARED unless CESIUM_JWT_SECRET is set, logouts replicate as "revoke"
+SESSION_TTL_HOURS = float(os.getenv("CESIUM_SESSION_HOURS", 12))
+SESSIONS = SessionManager(
+    lambda: os.getenv("CESIUM_JWT_SECRET") or SHARED.setting("session_secret", lambda: secrets.token_hex(32)),
+    ttl=int(SESSION_TTL_HOURS * 3600)
+)
 
-def closest_zone_id(lat, lng):
-    """Find closest zone center to a coordinate"""
-    best = None
-    bestd = float("inf")
-    for zid, meta in ZONES_META.items():
-        cy, cx = meta["center"]
-        d = (cy - lat)**2 + (cx - lng)**2
-        if d < bestd:
-            bestd = d
-            best = zid
-    return best
+# Simulation request bounds; work = steps x paths x farms array cells
+MAX_SIM_STEPS = 10000
+MAX_SIM_PATHS = 10000
+MAX_SIM_WORK = 200_000_000
 
-def get_status(value):
-    """Determine contamination status based on ppb value"""
-    if value >= THRESHOLD_CRITICAL:
-        return "Critical"
-    elif value >= THRESHOLD_HIGH:
-        return "High"
-    elif value >= THRESHOLD_MEDIUM:
-        return "Medium"
-    return "Safe"
+RADIUS_MAP = {"Critical": 140000, "High": 80000, "Medium": 50000, "Safe": 30000}
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_SUMMARY_SECONDS = 2  # at most one stats/intel "summary" stream event per interval
+STREAM_DELTA_MAX_FARMS = 256  # larger writes tell streams to resync instead of carrying every farm
+# Streams a WSGI server iterates each hold one of its threads; past this many per process
+# /api/stream answers 503 and the dashboard polls instead (asgi.py streams are not capped)
+STREAM_WSGI_MAX = int(os.getenv("CESIUM_STREAM_WSGI_MAX", 8))
+STREAM_WSGI_SLOTS = threading.BoundedSemaphore(STREAM_WSGI_MAX)
 
+@METRICS.timed()
 def compute_zone_aggregation():
-    zone_values = {k: [] for k in ZONES_META.keys()}
-    zone_farms = {k: [] for k in ZONES_META.keys()}
-    for f in FARMS:
-        zid = closest_zone_id(f["lat"], f["lng"])
-        if not zid:
-            continue
-        zone_values[zid].append(f["value"])
-        zone_farms[zid].append(f)
-    zones_out = []
-    for zid, meta in ZONES_META.items():
-        vals = zone_values[zid]
-        avg_val = round(sum(vals)/len(vals), 2) if vals else 0
-        severity = get_status(avg_val)
-        radius_map = {"Critical": 140000, "High": 80000, "Medium": 50000, "Safe": 30000}
-        radius = radius_map.get(severity, 30000)
-        top_farm = None
-        export_ready_count = 0
-        if zone_farms[zid]:
-            top_farm = max(zone_farms[zid], key=lambda x: x["value"])
-            export_ready_count = sum(1 for f in zone_farms[zid] if f["export_ready"])
-        zones_out.append({
-            "id": zid,
-            "name": meta["name"],
-            "center": meta.get("display_center", meta["center"]),
-            "avg": avg_val,
-            "avg_bq": ppb_to_bq(avg_val),
-            "severity": severity,
-            "radius_m": radius,
-            "top_farm": {
-                "id": top_farm["id"],
-                "name": top_farm["name"],
-                "value": top_farm["value"],
-                "value_bq": top_farm["value_bq"]
-            } if top_farm else None,
-            "count_farms": len(zone_farms[zid]),
-            "export_ready": export_ready_count
-        })
-    return sorted(zones_out, key=lambda x: x["avg"], reverse=True)
+    return sorted((zone_entry(zid) for zid in ZONES_META), key=lambda x: x["avg"], reverse=True)
 
+def zone_entry(zid):
+    """One zone's dashboard entry, from its running aggregates"""
+    meta = ZONES_META[zid]
+    group = AGGREGATES.zones[zid]
+    avg_val = round(group.mean(), 2) if group.count else 0
+    severity = get_status(avg_val)
+    radius = RADIUS_MAP.get(severity, 30000)
+    top = AGGREGATES.top(1, zone=zid)
+    top_farm = top[0] if top else None
+    return {
+        "id": zid,
+        "name": meta["name"],
+        "center": meta.get("display_center", meta["center"]),
+        "avg": avg_val,
+        "avg_bq": ppb_to_bq(avg_val),
+        "severity": severity,
+        "radius_m": radius,
+        "top_farm": {
+            "id": top_farm.id,
+            "name": top_farm.name,
+            "value": top_farm.value,
+            "value_bq": top_farm.value_bq
+        } if top_farm else None,
+        "count_farms": group.count,
+        "export_ready": group.export_ready
+    }
+
+@METRICS.timed()
 def agg_stats():
-    vals = [f["value"] for f in FARMS]
-    if not vals:
+    total = AGGREGATES.total
+    if not total:
         return {"total": 0, "avg": 0, "max": 0, "min": 0}
-    total = len(FARMS)
-    avgv = round(sum(vals) / len(vals), 2)
-    critical = sum(1 for v in vals if v >= THRESHOLD_CRITICAL)
-    high = sum(1 for v in vals if THRESHOLD_HIGH <= v < THRESHOLD_CRITICAL)
-    medium = sum(1 for v in vals if THRESHOLD_MEDIUM <= v < THRESHOLD_HIGH)
-    safe = sum(1 for v in vals if v < THRESHOLD_MEDIUM)
-    top_hotspots = sorted([
+    avgv = round(AGGREGATES.all.mean(), 2)
+    top_hotspots = [
         {
-            "id": f["id"],
-            "name": f["name"],
-            "location": f["location"],
-            "value": f["value"],
-            "value_bq": f["value_bq"],
-            "status": f["status"]
-        } for f in FARMS
-    ], key=lambda x: x["value"], reverse=True)[:5]
-    days = len(FARMS[0]["history"]) if FARMS else 0
+            "id": f.id,
+            "name": f.name,
+            "location": f.location,
+            "value": f.value,
+            "value_bq": f.value_bq,
+            "status": f.status
+        } for f in AGGREGATES.top(5)
+    ]
+    # Daily mean of every sample over the last TIMESERIES_DAYS, from the zones' day rollups
+    today_us = iso_to_us(datetime.utcnow().date().isoformat())
     timeseries = []
-    for i in range(days):
-        vals_day = [f["history"][i]["value"] if i < len(f["history"]) else f["value"] for f in FARMS]
-        date_obj = now - timedelta(days=days-i-1)
+    for start, _, _, _, mean, _ in ROLLUPS.merged("zone", ZONES_META, "day", today_us - (TIMESERIES_DAYS - 1) * DAY,
+                                                  today_us):
+        date_obj = datetime.fromisoformat(us_to_iso(start))
         timeseries.append({
             "t": date_obj.date().isoformat(),
-            "v": round(sum(vals_day)/len(vals_day), 2),
+            "v": round(mean, 2),
             "label": date_obj.strftime("%d %b")
         })
-    export_ready = sum(1 for f in FARMS if f["export_ready"])
-    fda_compliant = sum(1 for f in FARMS if f["value_bq"] < FDA_INTERVENTION_LEVEL)
     return {
         "total": total,
         "avg": avgv,
         "avg_bq": ppb_to_bq(avgv),
-        "max": max(vals),
-        "min": min(vals),
-        "critical": critical,
-        "high": high,
-        "medium": medium,
-        "safe": safe,
-        "export_ready": export_ready,
-        "fda_compliant": fda_compliant,
+        "max": AGGREGATES.max_value(),
+        "min": AGGREGATES.min_value(),
+        "critical": AGGREGATES.count("Critical"),
+        "high": AGGREGATES.count("High"),
+        "medium": AGGREGATES.count("Medium"),
+        "safe": AGGREGATES.count("Safe"),
+        "export_ready": AGGREGATES.all.export_ready,
+        "fda_compliant": AGGREGATES.fda_compliant,
         "top_hotspots": top_hotspots,
         "timeseries": timeseries
     }
 
+@METRICS.timed()
 def compute_intel():
     """Generate higher-level insights for the dashboard action center"""
     now_utc = datetime.utcnow()
     stats = agg_stats()
     zones = compute_zone_aggregation()
 
-    overdue = 0
-    for f in FARMS:
-        last = f.get("lastUpdate")
-        try:
-            last_dt = datetime.fromisoformat(last) if last else now_utc
-        except ValueError:
-            last_dt = now_utc
-        if now_utc - last_dt > timedelta(hours=36):
-            overdue += 1
+    # Farms past the sampling SLA, highest dispatch priority first
+    overdue, queue = DISPATCH.page(iso_to_us(now_utc.isoformat()), limit=6)
 
     high_alert_zones = [z for z in zones if z["severity"] in ("High", "Critical")]
     priority_zones = []
@@ -288,22 +685,28 @@ def compute_intel():
             "action": action
         })
 
-    timeseries = stats.get("timeseries", [])
-    if len(timeseries) >= 2:
-        delta = round(timeseries[-1]["v"] - timeseries[-2]["v"], 2)
-        projection = round(timeseries[-1]["v"] + delta, 2)
-    elif timeseries:
-        delta = 0
-        projection = timeseries[-1]["v"]
+    # Average of every farm's next-reading forecast against today's average
+    projected = FORECASTS.next_mean()
+    if projected:
+        mean, lower, upper = projected
     else:
-        delta = 0
-        projection = stats["avg"]
+        mean = lower = upper = stats["avg"]
+    projection = round(mean, 2)
+    delta = round(mean - stats["avg"], 2)
+    se = (upper - lower) / (2 * Z_95)
 
     signal = "stable"
     if delta > 1.5:
         signal = "rising"
     elif delta < -1.5:
         signal = "falling"
+    # Probability that the projected average really is on the reported side of +-1.5 ppb
+    if se > 0:
+        above = 1 - normal_cdf((1.5 - delta) / se)
+        below = normal_cdf((-1.5 - delta) / se)
+        confidence = {"rising": above, "falling": below}.get(signal, 1 - above - below)
+    else:
+        confidence = 1.0
 
     export_gateways = [
         {
@@ -326,59 +729,110 @@ def compute_intel():
         }
     ]
 
-    sampling_queue = []
-    for f in FARMS:
-        zid = closest_zone_id(f["lat"], f["lng"])
-        last = f.get("lastUpdate")
-        try:
-            last_dt = datetime.fromisoformat(last) if last else now_utc
-        except ValueError:
-            last_dt = now_utc
-        overdue_hours = (now_utc - last_dt).total_seconds() / 3600
-        if overdue_hours > 36:
-            sampling_queue.append({
-                "id": f["id"],
-                "name": f["name"],
-                "zone": ZONES_META.get(zid, {}).get("name", zid),
-                "last_update": last_dt.strftime("%d %b %H:%M"),
-                "value": f["value"],
-                "severity": f["status"]
-            })
-    sampling_queue = sorted(sampling_queue, key=lambda x: x["value"], reverse=True)[:6]
+    sampling_queue = [dispatch_entry(e) for e in queue]
 
     return {
         "last_refresh": now_utc.isoformat(),
         "sampling_backlog": overdue,
         "pending_samples": stats["high"] + stats["critical"],
-        "sla_hours": 24,
+        "sla_hours": SAMPLING_SLA_HOURS,
         "sla_pressure": round((overdue / stats["total"]) * 100, 1) if stats["total"] else 0,
         "ai_projection": {
             "next_avg": projection,
             "delta": delta,
             "signal": signal,
-            "confidence": 0.74
+            "confidence": round(confidence, 2),
+            "interval": [round(lower, 2), round(upper, 2)]
         },
         "priority_zones": priority_zones,
         "export_gateways": export_gateways,
         "sampling_queue": sampling_queue
     }
 
+def publish_changes(changed, extra_zones=(), alert_changes=()):
+    """
+    Push a delta to /api/stream subscribers: the changed farms, their zones and new alerts.
+    changed: farms touched by the write; alert_changes: (alert, change) pairs from ALERTS.evaluate
+    Stats and intel follow in a throttled "summary" event, built outside the write lock.
+    A write touching more than STREAM_DELTA_MAX_FARMS farms publishes "resync" instead,
+    so streams fetch one snapshot rather than the write encoding every farm.
+    """
+    if len(changed) > STREAM_DELTA_MAX_FARMS:
+        BROKER.publish("resync", {})
+        schedule_summary()
+        return
+    zone_ids = sorted(({f.zone for f in changed} | set(extra_zones)) & ZONES_META.keys())
+    farms = []
+    for f in changed:
+        full = f.to_dict(include_history=False)
+        patch = {k: full[k] for k in STREAM_FARM_FIELDS}
+        if f.history:
+            patch["sample"] = f.history.sample(-1)
+        farms.append(patch)
+    alerts = [alert_dict(a) for a, change in alert_changes if change in ("opened", "escalated")]
+    BROKER.publish("delta", {
+        "version": RESPONSE_CACHE.version,
+        "farms": farms,
+        "zones": [zone_entry(zid) for zid in zone_ids],
+        "alerts": sorted(alerts, key=lambda x: x["value"], reverse=True)
+    })
+    schedule_summary()
+
+_SUMMARY_LOCK = threading.Lock()
+_summary_due = False
+
+def schedule_summary():
+    """Publish a "summary" stream event within STREAM_SUMMARY_SECONDS unless one is already due"""
+    global _summary_due
+    with _SUMMARY_LOCK:
+        if _summary_due:
+            return
+        _summary_due = True
+    timer = threading.Timer(STREAM_SUMMARY_SECONDS, publish_summary)
+    timer.daemon = True
+    timer.start()
+
+def publish_summary():
+    """Dashboard stats and intel for /api/stream subscribers, computed under the read lock"""
+    global _summary_due
+    with _SUMMARY_LOCK:
+        _summary_due = False  # writes from here on schedule the next one
+    with STATE_LOCK.read():
+        summary = {"version": RESPONSE_CACHE.version, "stats": dashboard_stats(), "intel": compute_intel()}
+    BROKER.publish("summary", summary)
+
+def stream_snapshot():
+    """Full dashboard state sent when a stream (re)connects"""
+    with STATE_LOCK.read():
+        return {
+            "version": RESPONSE_CACHE.version,
+            "farms": [f.to_dict() for f in FARMS],
+            "zones": compute_zone_aggregation(),
+            "stats": dashboard_stats(),
+            "intel": compute_intel()
+        }
+
 def generate_token(username):
-    token = str(uuid4())
-    TOKENS[token] = {
-        "username": username,
-        "issued_at": datetime.utcnow(),
-        "role": USERS[username]["role"],
-        "name": USERS[username]["name"],
-        "team": USERS[username]["team"]
-    }
-    return token
+    return SESSIONS.issue(username, USERS[username]["role"])
 
-def get_user_from_request():
+def request_session():
+    """Verified claims of the request's bearer token, or None"""
     auth = request.headers.get("Authorization", "")
     if (auth.startswith("Bearer ")):
-        token = auth.split(" ", 1)[1].strip()
-        return TOKENS.get(token)
+        return SESSIONS.verify(auth.split(" ", 1)[1].strip())
+    return None
+
+def get_user_from_request():
+    claims = request_session()
+    if claims and claims["sub"] in USERS:
+        username = claims["sub"]
+        return {
+            "username": username,
+            "issued_at": datetime.utcfromtimestamp(claims["iat"]),
+            "role": USERS[username]["role"],
+            "name": USERS[username]["name"],
+            "team": USERS[username]["team"]
+        }
     return None
 
 def require_role(allowed=None):
@@ -396,9 +850,113 @@ def require_role(allowed=None):
                 return jsonify({"error": "Forbidden"}), 403
             request.current_user = user
             return func(*args, **kwargs)
+        inner.requires_login = True
         return inner
     return wrapper
 
+def response_cache_key(path, args, ttl):
+    """(RESPONSE_CACHE key, data version) of a GET of path with query args"""
+    version = RESPONSE_CACHE.version
+    return (path, tuple(sorted(args.items(multi=True))), version, int(time.time() // ttl) if ttl else None), version
+
+def etag_matches(if_none_match, etag):
+    """
+    If-None-Match against a response's strong ETag: "*" or any listed tag equal to it,
+    W/ prefixes ignored (the header compares weakly, RFC 9110 13.1.2)
+    """
+    for tag in (if_none_match or "").split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+def cached_response(ttl=None):
+    """
+    Serve a GET endpoint from RESPONSE_CACHE with a strong ETag.
+    ttl: seconds, for responses that also depend on wall-clock time.
+    """
+    def wrapper(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            key, version = response_cache_key(request.path, request.args, ttl)
+            entry = RESPONSE_CACHE.get(key)
+            if entry is None:
+                with STATE_LOCK.read():
+                    rv = func(*args, **kwargs)
+                if isinstance(rv, tuple) or rv.status_code != 200:
+                    return rv
+                entry = RESPONSE_CACHE.put(key, rv.get_data(), version)
+            etag, body = entry
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if etag_matches(request.headers.get("If-None-Match"), etag):
+                return Response(status=304, headers=headers)
+            return Response(body, mimetype="application/json", headers=headers)
+        inner.cache_ttl = ttl
+        return inner
+    return wrapper
+
+def cached_hit(environ):
+    """
+    (status, headers, body) of a GET that RESPONSE_CACHE answers as is, else None.
+    asgi.py calls it on the event loop before handing a request to its pool, so it
+    runs no handler and takes no lock. Endpoints behind require_role, CORS requests
+    (flask-cors adds their headers), a replica behind the shared log and cache
+    misses all return None and take the normal path.
+    """
+    if not _started or environ["REQUEST_METHOD"] != "GET" or "HTTP_ORIGIN" in environ:
+        return None
+    started = time.perf_counter()
+    try:
+        rule, _ = app.url_map.bind_to_environ(environ).match(return_rule=True)
+    except HTTPException:
+        return None
+    view = app.view_functions[rule.endpoint]
+    if not hasattr(view, "cache_ttl") or getattr(view, "requires_login", False) or not SHARED.current():
+        return None
+    req = WSGIRequest(environ)
+    entry = RESPONSE_CACHE.get(response_cache_key(req.path, req.args, view.cache_ttl)[0])
+    if entry is None:
+        return None
+    etag, body = entry
+    headers = [("ETag", etag), ("Cache-Control", "no-cache")]
+    if etag_matches(req.headers.get("If-None-Match"), etag):
+        status, body = 304, b""
+    else:
+        status = 200
+        headers += [("Content-Type", "application/json"), ("Content-Length", str(len(body)))]
+    METRICS.observe_request(rule.rule, "GET", status, time.perf_counter() - started, len(body))
+    return status, headers, body
+
+@app.before_request
+def ensure_started():
+    """Serving `app:app` directly: bring the replica up on the first request"""
+    start()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.profile = PROFILER.start()
+
+@app.after_request
+def record_request_metrics(response):
+    """Latency to the first byte, status and (non-streamed) body size of every request"""
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    size = None if response.is_streamed else response.content_length
+    METRICS.observe_request(endpoint, request.method, response.status_code, seconds, size)
+    profile = g.pop("profile", None)
+    if profile:
+        PROFILER.stop(profile, (request.method, request.full_path.rstrip("?")), seconds)
+    return response
+
+@app.before_request
+def sync_shared_state():
+    """Apply writes committed by other worker processes before answering"""
+    SHARED.sync()
+
 # -----------------------
 # API ENDPOINTS
 # -----------------------
@@ -427,6 +985,7 @@ def root():
         "message": "System operational",
         "endpoints": [
             "/api/farms",
+            "/api/farms/near",
             "/api/zones",
             "/api/stats",
             "/api/heatmap",
@@ -434,7 +993,8 @@ def root():
             "/api/simulate",
             "/api/alerts",
             "/api/intel",
-            "/health"
+            "/health",
+            "/metrics"
         ]
     })
 
@@ -451,7 +1011,7 @@ def api_login():
     data = request.get_json() or {}
     username = data.get("username", "").lower()
     password = data.get("password", "")
-    if username not in USERS or USERS[username]["password"] != password:
+    if username not in USERS or not check_password(password, USERS[username]["password_hash"]):
         return jsonify({"success": False, "error": "Invalid credentials"}), 401
     token = generate_token(username)
     profile = {
@@ -464,10 +1024,10 @@ def api_login():
 
 @app.route("/api/logout", methods=["POST"])
 def api_logout():
-    auth = request.headers.get("Authorization", "")
-    if auth.startswith("Bearer "):
-        token = auth.split(" ", 1)[1].strip()
-        TOKENS.pop(token, None)
+    claims = request_session()
+    if claims:
+        with SHARED.writing() as events:
+            events.append(("revoke", {"jti": claims["jti"], "exp": claims["exp"]}))
     return jsonify({"success": True})
 
 @app.route("/api/me", methods=["GET"])
@@ -478,55 +1038,321 @@ def api_me():
     return jsonify({"authenticated": True, "profile": user})
 
 @app.route("/api/farms", methods=["GET"])
+@cached_response()
 def api_farms():
-    """Get all farms with current contamination data"""
+    """
+    Get all farms with current contamination data.
+    fields=a,b,... or include_history=false project each farm; bodies are joined from FRAGMENTS.
+    With limit=, sort=, after_id= or cursor= the response is a keyset page
+    {farms, count, total, next_cursor} instead of the full array.
+    """
     # Optional filtering
     status_filter = request.args.get('status')
     zone_filter = request.args.get('zone')
-    
-    farms_filtered = FARMS
-    
-    if (status_filter):
-        farms_filtered = [f for f in farms_filtered if f["status"].lower() == status_filter.lower()]
-
-    if (zone_filter):
-        zone = zone_filter.lower()
-        farms_filtered = [
-            f for f in farms_filtered
-            if closest_zone_id(f["lat"], f["lng"]) == zone
-        ]
-    
-    return jsonify(farms_filtered)
+    export_ready = request.args.get("export_ready")
+    fields = farm_projection()
+    if isinstance(fields, str):
+        return jsonify({"error": fields}), 400
+    if export_ready is not None:
+        export_ready = export_ready.lower() in ("true", "1", "yes")
+    filters = {
+        "status": status_filter or None,
+        "zone": zone_filter.lower() if zone_filter else None,
+        "certification": request.args.get("certification") or None,
+        "export_ready": export_ready
+    }
+
+    if not any(k in request.args for k in ("limit", "sort", "after_id", "cursor")):
+        farms_filtered = FARMS.select(**filters)
+        body = join_array([farm_fragment(f, fields) for f in farms_filtered])
+        return Response(body, mimetype="application/json")
+
+    sort = request.args.get("sort", "id")
+    descending = sort.startswith("-")
+    sort = sort.lstrip("-")
+    limit = request.args.get("limit", FARMS_PAGE_DEFAULT, type=int)
+    if sort not in SORT_KEYS:
+        return jsonify({"error": "sort must be one of: " + ", ".join(SORT_KEYS) + " (prefix - for descending)"}), 400
+    if not 1 <= limit <= FARMS_PAGE_MAX:
+        return jsonify({"error": f"limit must be between 1 and {FARMS_PAGE_MAX}"}), 400
+    after = None
+    if request.args.get("cursor"):
+        after = decode_cursor(request.args["cursor"], sort, descending)
+        if after is None:
+            return jsonify({"error": "Invalid cursor for this sort"}), 400
+    elif request.args.get("after_id"):
+        farm = FARMS.get(request.args.get("after_id", type=int))
+        if farm is None:
+            return jsonify({"error": "after_id is not a known farm"}), 400
+        after = (SORT_KEYS[sort](farm), farm.id)
+
+    farms, total = FARMS.page(sort, descending, after, limit, **filters)
+    next_cursor = None
+    if len(farms) == limit:
+        last = farms[-1]
+        next_cursor = encode_cursor(sort, descending, (SORT_KEYS[sort](last), last.id))
+    body = b'{"farms":' + join_array([farm_fragment(f, fields) for f in farms]) + b"," + dumps(
+        {"count": len(farms), "total": total, "next_cursor": next_cursor})[1:]
+    return Response(body, mimetype="application/json")
+
+def encode_cursor(sort, descending, position):
+    """Opaque next-page token: the sort and the (key, id) of the last farm served"""
+    raw = dumps([("-" if descending else "") + sort, position[0], position[1]])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token, sort, descending):
+    """(key, id) position of a cursor made for the same sort, None if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        cur_sort, key, fid = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if cur_sort != ("-" if descending else "") + sort or not isinstance(fid, int):
+        return None
+    if sort == "name":
+        return (key, fid) if isinstance(key, str) else None
+    if isinstance(key, bool) or not isinstance(key, (int, float)):
+        return None
+    return (float(key) if sort == "value" else int(key)), fid
+
+def farm_projection():
+    """Field tuple from fields= / include_history=, None for the full farm, or an error message"""
+    fields = request.args.get("fields")
+    if fields:
+        fields = tuple(dict.fromkeys(k.strip() for k in fields.split(",") if k.strip()))
+        unknown = [k for k in fields if k not in FarmRecord.DICT_FIELDS]
+        if unknown:
+            return "Unknown fields: " + ", ".join(unknown)
+        return fields
+    if request.args.get("include_history", "true").lower() in ("false", "0", "no"):
+        return FarmRecord.DICT_FIELDS[:-1]
+    return None
+
+def farm_fragment(farm, fields=None):
+    """Encoded JSON of one farm (or of the given fields), cached until the farm changes"""
+    if fields is None:
+        return FRAGMENTS.get(farm, None, farm.to_dict)
+
+    def build():
+        full = farm.to_dict(include_history="history" in fields)
+        return {k: full[k] for k in fields}
+    return FRAGMENTS.get(farm, fields, build)
+
+@app.route("/api/farms/near", methods=["GET"])
+@cached_response()
+def api_farms_near():
+    """
+    Farms by position, from the registry's spatial index:
+    lat=&lng=&radius_km= those within the radius, nearest first;
+    lat=&lng=&k= the k nearest; bbox=south,west,north,east those inside the box, by id.
+    Point queries add distance_km to each farm. fields= / include_history= project
+    as in /api/farms; limit= caps radius and bbox results ({farms, count, total}).
+    """
+    fields = farm_projection()
+    if isinstance(fields, str):
+        return jsonify({"error": fields}), 400
+    limit = request.args.get("limit", FARMS_PAGE_DEFAULT, type=int)
+    if not 1 <= limit <= FARMS_PAGE_MAX:
+        return jsonify({"error": f"limit must be between 1 and {FARMS_PAGE_MAX}"}), 400
+
+    if "bbox" in request.args:
+        try:
+            south, west, north, east = (float(v) for v in request.args["bbox"].split(","))
+        except ValueError:
+            return jsonify({"error": "bbox must be south,west,north,east"}), 400
+        if (not all(math.isfinite(v) for v in (south, west, north, east)) or not -90 <= south <= north <= 90
+                or not (-180 <= west <= 180 and -180 <= east <= 180)):
+            return jsonify({"error": "Invalid bbox"}), 400
+        farms, total = FARMS.in_bbox(south, west, north, east, limit)
+        body = join_array([farm_fragment(f, fields) for f in farms])
+        return Response(b'{"farms":' + body + b"," + dumps({"count": len(farms), "total": total})[1:],
+                        mimetype="application/json")
+
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"error": "lat and lng are required (degrees), or bbox=south,west,north,east"}), 400
+    if "k" in request.args:
+        k = request.args.get("k", type=int)
+        if k is None or not 1 <= k <= FARMS_PAGE_MAX:
+            return jsonify({"error": f"k must be between 1 and {FARMS_PAGE_MAX}"}), 400
+        hits = FARMS.nearest(lat, lng, k)
+        total = len(hits)
+    else:
+        radius = request.args.get("radius_km", type=float)
+        if radius is None or not 0 <= radius <= NEAR_MAX_RADIUS_KM:
+            return jsonify({"error": f"radius_km (0-{NEAR_MAX_RADIUS_KM}) or k is required"}), 400
+        hits, total = FARMS.near(lat, lng, radius, limit)
+    body = join_array([with_distance(farm_fragment(f, fields), d) for f, d in hits])
+    return Response(b'{"farms":' + body + b"," + dumps({"count": len(hits), "total": total})[1:],
+                    mimetype="application/json")
+
+def with_distance(fragment, km):
+    """Farm fragment with "distance_km" appended"""
+    return fragment[:-1] + (b"," if fragment != b"{}" else b"") + b'"distance_km":' + dumps(round(km, 3)) + b"}"
 
 @app.route("/api/farm/<int:farm_id>", methods=["GET"])
+@cached_response()
 def api_farm_detail(farm_id):
     """Get detailed info for specific farm"""
-    farm = next((f for f in FARMS if f["id"] == farm_id), None)
+    farm = FARMS.get(farm_id)
     if not farm:
         return jsonify({"error": "Farm not found"}), 404
     
-    # Add additional analytics
-    history_vals = [h["value"] for h in farm["history"]]
-    farm_detail = farm.copy()
+    # Analytics over one range, the farm's last ANALYTICS_DAYS days of samples, from its day rollups
+    last_us = farm.updated_us
+    first_us = last_us - (ANALYTICS_DAYS - 1) * DAY
+    days = ROLLUPS.query("farm", farm_id, "day", first_us, last_us)
+    _, _, stdev, lowest, peak = ROLLUPS.stats("farm", farm_id, "day", first_us, last_us)
+    _, week_mean, _, _, _ = ROLLUPS.stats("farm", farm_id, "day", last_us - 6 * DAY, last_us)
+    farm_detail = farm.to_dict()
     farm_detail["analytics"] = {
-        "trend": "increasing" if history_vals[-1] > history_vals[0] else "decreasing",
-        "volatility": round(statistics.stdev(history_vals), 2) if len(history_vals) > 1 else 0,
-        "avg_last_7days": round(statistics.mean(history_vals[-7:]), 2),
-        "peak": max(history_vals),
-        "lowest": min(history_vals)
+        "trend": "increasing" if days[-1][4] > days[0][4] else "decreasing",  # newest vs oldest daily mean
+        "volatility": round(stdev, 2),
+        "avg_last_7days": round(week_mean, 2),
+        "peak": peak,
+        "lowest": lowest
     }
     
     return jsonify(farm_detail)
 
+@app.route("/api/farm/<int:farm_id>/history", methods=["GET"])
+@cached_response()
+def api_farm_history(farm_id):
+    """
+    Sample history for a farm, from the durable store when configured.
+    With step=hour|day|week: rolled-up buckets between from= and to= instead of raw samples.
+    """
+    farm = FARMS.get(farm_id)
+    if not farm:
+        return jsonify({"error": "Farm not found"}), 404
+    if "step" in request.args:
+        return rollup_response("farm", farm_id)
+    since = request.args.get("since")
+    limit = request.args.get("limit", type=int)
+    if since and not valid_iso(since):
+        return jsonify({"error": "Invalid since timestamp"}), 400
+    rows = farm_history(farm, since=since, limit=limit)
+    return jsonify({"farm_id": farm_id, "count": len(rows), "history": rows})
+
+@app.route("/api/zones/<zone_id>/history", methods=["GET"])
+@cached_response()
+def api_zone_history(zone_id):
+    """Rolled-up samples of every farm in a zone (step=hour|day|week, from=, to=)"""
+    if zone_id not in ZONES_META:
+        return jsonify({"error": "Zone not found"}), 404
+    return rollup_response("zone", zone_id)
+
+def rollup_response(scope, key):
+    """Buckets of a farm or zone series for the step/from/to query args"""
+    step = request.args.get("step", "day")
+    if step not in RESOLUTIONS:
+        return jsonify({"error": "step must be one of: " + ", ".join(RESOLUTIONS)}), 400
+    bounds = {}
+    for arg in ("from", "to"):
+        value = request.args.get(arg)
+        if value and not valid_iso(value):
+            return jsonify({"error": f"Invalid {arg} timestamp"}), 400
+        bounds[arg] = iso_to_us(value) if value else None
+    with STATE_LOCK.read():
+        rows = ROLLUPS.query(scope, key, step, bounds["from"], bounds["to"])
+    buckets = [{
+        "t": us_to_iso(start),
+        "count": count,
+        "min": lo,
+        "max": hi,
+        "mean": round(mean, 2),
+        "last": last
+    } for start, count, lo, hi, mean, last in rows]
+    return jsonify({scope + "_id": key, "step": step, "count": len(buckets), "buckets": buckets})
+
+def valid_iso(value):
+    try:
+        datetime.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+def farm_history(farm, since=None, limit=None):
+    """Samples of one farm at or after since (ISO), from the durable store when configured"""
+    if SAMPLE_STORE:
+        return SAMPLE_STORE.rows(farm.id, since=since, limit=limit)
+    rows = farm.history.to_dicts()  # an installed record's history is never changed in place
+    rows = [h for h in rows if not since or h["time"] >= since]
+    return rows[-limit:] if limit else rows
+
+@app.route("/api/farm/<int:farm_id>", methods=["PATCH"])
+@require_role(allowed=["admin"])
+def api_farm_update(farm_id):
+    """Relocate a farm (admin); its zone assignment follows the new coordinates"""
+    farm = FARMS.get(farm_id)
+    if not farm:
+        return jsonify({"success": False, "error": "Farm not found"}), 404
+    data = request.get_json() or {}
+    try:
+        lat = float(data.get("lat", farm.lat))
+        lng = float(data.get("lng", farm.lng))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Invalid coordinates"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"success": False, "error": "Coordinates out of range"}), 400
+    with SHARED.writing() as events:
+        events.append(("location", {"farm_id": farm_id, "lat": lat, "lng": lng}))
+    return jsonify({"success": True, "farm": FARMS.get(farm_id).to_dict()})
+
 @app.route("/api/zones", methods=["GET"])
+@cached_response()
 def api_zones():
     """Get aggregated zone data"""
     return jsonify(compute_zone_aggregation())
 
+@app.route("/api/forecast", methods=["GET"])
+@cached_response()
+def api_forecast():
+    """
+    Forecast with 95% prediction intervals for the next `horizon` readings:
+    one farm (farm=<id>), one zone (zone=<id>) or, by default, every zone.
+    """
+    horizon = request.args.get("horizon", 3, type=int)
+    if not 1 <= horizon <= FORECAST_MAX_HORIZON:
+        return jsonify({"error": f"horizon must be between 1 and {FORECAST_MAX_HORIZON}"}), 400
+    result = FORECASTS.forecast(horizon)
+    farm_id = request.args.get("farm", type=int)
+    if farm_id is not None:
+        found = result.series(farm_id) if FARMS.get(farm_id) else None
+        if found is None:
+            return jsonify({"error": "Farm not found"}), 404
+        model, mean, lower, upper = found
+        return jsonify({"farm_id": farm_id, "model": model, "horizon": horizon, "level": 0.95,
+                        "forecast": forecast_steps(mean, lower, upper)})
+    zone_ids = list(ZONES_META)
+    if "zone" in request.args:
+        zone_ids = [request.args["zone"]]
+        if zone_ids[0] not in ZONES_META:
+            return jsonify({"error": "Zone not found"}), 404
+    zones = []
+    for zid in zone_ids:
+        found = result.group(sorted(FARMS.by_zone.get(zid, ())))
+        if found:
+            zones.append({"zone": zid, "name": ZONES_META[zid]["name"], "forecast": forecast_steps(*found)})
+    return jsonify({"horizon": horizon, "level": 0.95, "zones": zones})
+
+def forecast_steps(mean, lower, upper):
+    return [
+        {"step": h + 1, "mean": round(float(m), 2), "lower": round(float(lo), 2), "upper": round(float(hi), 2)}
+        for h, (m, lo, hi) in enumerate(zip(mean, lower, upper))
+    ]
+
 @app.route("/api/stats", methods=["GET"])
+@cached_response()
 def api_stats():
     """Get dashboard statistics"""
+    return jsonify(dashboard_stats())
+
+def dashboard_stats():
+    """agg_stats plus the activity, compliance and risk panels shown on the dashboard"""
     s = agg_stats()
+    now = datetime.utcnow()
     
     # Add recent field activities (demo)
     s["recent_activities"] = [
@@ -576,13 +1402,39 @@ def api_stats():
         ]
     }
 
-    return jsonify(s)
+    return s
+
+HEATMAP_MAX_ZOOM = 20
+HEATMAP_FIELDS = ["lat", "lng", "count", "mean", "max"]
 
 @app.route("/api/heatmap", methods=["GET"])
+@cached_response()
 def api_heatmap():
-    """Get heatmap data points"""
-    points = [[f["lat"], f["lng"], max(0.1, f["value"]/10)] for f in FARMS]
-    return jsonify({"points": points})
+    """Heatmap points per farm, or with bbox=south,west,north,east&zoom= the aggregated cells of that view"""
+    if "bbox" not in request.args and "zoom" not in request.args:
+        return jsonify({"points": heatmap_points()})
+    try:
+        south, west, north, east = (float(v) for v in request.args.get("bbox", "-90,-180,90,180").split(","))
+        zoom = int(request.args.get("zoom", 5))
+    except ValueError:
+        return jsonify({"error": "bbox must be south,west,north,east and zoom an integer"}), 400
+    if not all(math.isfinite(v) for v in (south, west, north, east)) or not -90 <= south <= north <= 90:
+        return jsonify({"error": "Invalid bbox"}), 400
+    if not 0 <= zoom <= HEATMAP_MAX_ZOOM:
+        return jsonify({"error": f"zoom must be 0-{HEATMAP_MAX_ZOOM}"}), 400
+    level, cells = HEAT_GRID.query(south, west, north, east, zoom)
+    return jsonify({"zoom": zoom, "level": level, "fields": HEATMAP_FIELDS, "cells": cells, "farms": len(HEAT_GRID)})
+
+@app.route("/api/heatmap/tiles/<int:z>/<int:x>/<int:y>", methods=["GET"])
+@cached_response()
+def api_heatmap_tile(z, x, y):
+    """Heatmap cells inside one slippy-map tile"""
+    if not (0 <= z <= HEATMAP_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Tile out of range"}), 404
+    return jsonify({"z": z, "x": x, "y": y, "fields": HEATMAP_FIELDS, "cells": HEAT_GRID.tile(z, x, y)})
+
+def heatmap_points():
+    return [[f.lat, f.lng, max(0.1, f.value/10)] for f in FARMS]
 
 @app.route("/api/samples", methods=["POST"])
 @require_role(allowed=["admin", "field"])
@@ -597,141 +1449,597 @@ def api_samples():
     if farm_id is None or value is None:
         return jsonify({"success": False, "error": "Missing required fields: farm_id and value"}), 400
     
-    farm = next((f for f in FARMS if f["id"] == farm_id), None)
+    farm = FARMS.get(farm_id)
     if not farm:
         return jsonify({"success": False, "error": "Farm not found"}), 404
     
     # Validate value
     try:
         value = float(value)
-        if value < 0:
-            return jsonify({"success": False, "error": "Value cannot be negative"}), 400
-    except ValueError:
+    except (TypeError, ValueError):
         return jsonify({"success": False, "error": "Invalid value format"}), 400
+    if not math.isfinite(value):
+        return jsonify({"success": False, "error": "Invalid value format"}), 400
+    if value < 0:
+        return jsonify({"success": False, "error": "Value cannot be negative"}), 400
+    if value > MAX_VALUE:
+        return jsonify({"success": False, "error": f"Value cannot exceed {MAX_VALUE:,.0f}"}), 400
     
-    # Add sample to history
-    nowiso = datetime.utcnow().isoformat()
-    farm.setdefault("history", []).append({
-        "time": nowiso,
-        "inspector": inspector,
-        "value": value,
-        "notes": notes
-    })
-    
-    # Update current values
-    farm["value"] = value
-    farm["value_bq"] = ppb_to_bq(value)
-    farm["status"] = get_status(value)
-    farm["lastUpdate"] = nowiso
-    farm["export_ready"] = farm["status"] in ["Safe", "Medium"]
-    
+    # Add sample to history and update current values (in every worker)
+    with SHARED.writing() as events:
+        events.append(readings_event([(farm.id, [(value, inspector, notes)])], trim=HISTORY_WINDOW))
+    farm = FARMS.get(farm.id)
+
     return jsonify({
         "success": True,
         "message": "Sample recorded successfully",
-        "farm": farm,
-        "alert": "⚠️ CRITICAL LEVEL DETECTED!" if farm["status"] == "Critical" else None
+        "farm": farm.to_dict(),
+        "alert": "⚠️ CRITICAL LEVEL DETECTED!" if farm.status == "Critical" else None
+    })
+
+@app.route("/api/samples/bulk", methods=["POST"])
+@require_role(allowed=["admin", "field"])
+def api_samples_bulk():
+    """Ingest a batch of samples streamed as JSON Lines, json-seq or CSV (idempotent per sample_id)"""
+    try:
+        rows = list(islice(iter_rows(request.stream, request.mimetype), MAX_BULK_ROWS + 1))
+    except BulkFormatError as e:
+        return jsonify({"success": False, "error": str(e)}), 415
+    except UnicodeDecodeError:
+        return jsonify({"success": False, "error": "Body must be UTF-8"}), 400
+    if len(rows) > MAX_BULK_ROWS:
+        return jsonify({"success": False, "error": f"Batch exceeds {MAX_BULK_ROWS} rows"}), 413
+
+    farm_by_id = FARMS.by_id
+    ids, vals, sample_ids, codes = validate_batch(rows, np.fromiter(farm_by_id, np.int64, len(farm_by_id)))
+    errors = [
+        {"row": i + 1, "sample_id": sample_ids[i], "error": ROW_ERRORS[codes[i]]}
+        for i in np.flatnonzero(codes).tolist()
+    ]
+
+    with SHARED.writing() as events:
+        duplicates = []
+        applied = {}  # sample ids new in this batch, in order
+        per_farm = {}
+        for i in np.flatnonzero(codes == 0).tolist():
+            sid = sample_ids[i]
+            if sid is not None:
+                if sid in APPLIED_SAMPLE_IDS or sid in applied:
+                    duplicates.append(sid)
+                    continue
+                applied[sid] = None
+            row = rows[i]
+            per_farm.setdefault(int(ids[i]), []).append(
+                (float(vals[i]), row.get("inspector") or "Unknown", row.get("notes") or "")
+            )
+        if per_farm:
+            events.append(readings_event(per_farm.items(), trim=HISTORY_WINDOW, sample_ids=applied))
+
+    accepted = sum(len(r) for r in per_farm.values())
+    return jsonify({
+        "success": True,
+        "received": len(rows),
+        "accepted": accepted,
+        "duplicates": len(duplicates),
+        "rejected": len(errors),
+        "farms_updated": len(per_farm),
+        "errors": errors,
+        "critical_farms": [fid for fid in per_farm if FARMS.get(fid).status == "Critical"]
     })
 
+def parse_simulate_params(args):
+    """Validated (params, None) or (None, error message) from query args or a JSON body"""
+    try:
+        steps = int(args.get("steps", 1))
+        paths = int(args.get("paths", 1))
+        seed = args.get("seed")
+        seed = int(seed) if seed is not None else None
+    except (TypeError, ValueError):
+        return None, "steps, paths and seed must be integers"
+    commit_arg = args.get("commit")
+    commit = (steps == 1 and paths == 1) if commit_arg is None else str(commit_arg).lower() in ("1", "true", "yes")
+    if not (1 <= steps <= MAX_SIM_STEPS and 1 <= paths <= MAX_SIM_PATHS):
+        return None, f"steps must be 1-{MAX_SIM_STEPS}, paths 1-{MAX_SIM_PATHS}"
+    if steps * paths * max(len(FARMS), 1) > MAX_SIM_WORK:
+        return None, "Simulation too large; reduce steps or paths"
+    if commit and paths != 1:
+        return None, "commit requires paths=1"
+    return {"steps": steps, "paths": paths, "seed": seed, "commit": commit}, None
+
+def run_simulation(job, steps, paths, seed, commit):
+    """
+    Job: run the contamination model for steps x paths seeded scenarios.
+    Without commit the live farms are untouched and only the distribution is returned;
+    commit records path 0's state after the last step as one new reading per farm
+    (a reading per step would put `steps` samples at one timestamp).
+    """
+    started = time.perf_counter()
+    zone_pos = {zid: i for i, zid in enumerate(ZONES_META)}
+
+    def simulate(farms):
+        values = np.fromiter((f.value for f in farms), np.float64, len(farms))
+        zones = np.fromiter((zone_pos[f.zone] for f in farms), np.intp, len(farms))
+        with METRICS.time("simulation.run"):
+            return simulation.run(values, zones, steps=steps, paths=paths, seed=seed,
+                                  critical=THRESHOLD_CRITICAL, progress=job.report)
+
+    def record(events, farms, result):
+        # One columnar event, applied to every store in bulk (record_batch). Keep the
+        # in-memory window manageable; the sample store keeps everything
+        events.append(batch_event([f.id for f in farms], result["final"][0].tolist(), "auto-sim",
+                                  "Simulated data", trim=HISTORY_WINDOW))
+
+    if commit:
+        # Writes are based on the state they were simulated from. Simulate a snapshot with no
+        # lock held and record it only if no write landed meanwhile; if other writes keep
+        # winning, simulate under the write lock (readers wait for that one run)
+        for _ in range(SIMULATION_COMMIT_ATTEMPTS):
+            view = FARMS.snapshot()
+            result = simulate(view.farms)
+            job.report(1.0, "Recording readings")
+            with SHARED.writing() as events:
+                if FARMS.version == view.version:
+                    record(events, view.farms, result)
+                    break
+        else:
+            with SHARED.writing() as events:
+                farms = list(FARMS)
+                result = simulate(farms)
+                record(events, farms, result)
+    else:
+        result = simulate(FARMS.snapshot().farms)
+
+    zone_ids = list(ZONES_META)
+    summary = simulation.summarize(result, critical=THRESHOLD_CRITICAL)
+    for z in summary["zones"]:
+        z["zone"] = zone_ids[z["zone"]]
+        z["name"] = ZONES_META[z["zone"]]["name"]
+    return {
+        "success": True,
+        "message": "Simulation completed",
+        "timestamp": datetime.utcnow().isoformat(),
+        "steps": steps,
+        "paths": paths,
+        "seed": seed,
+        "committed": commit,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        **summary
+    }
+
+def parse_export_params(args):
+    """Validated (params, None) or (None, error message) for an export"""
+    fmt = str(args.get("format") or "json").lower()
+    since = args.get("since") or None
+    zone = (args.get("zone") or "").lower() or None
+    status = args.get("status") or None
+    if fmt not in export.FORMATS:
+        return None, "Unknown format; use " + ", ".join(export.FORMATS)
+    if not export.available(fmt):
+        return None, f"{fmt} export requires pyarrow"
+    if since and not valid_iso(since):
+        return None, "Invalid since timestamp"
+    if zone and zone not in ZONES_META:
+        return None, "Unknown zone"
+    if status and status_code(status) is None:
+        return None, "Unknown status"
+    return {"fmt": fmt, "since": since, "zone": zone, "status": status}, None
+
+def export_chunks(fmt, since=None, zone=None, status=None, progress=None):
+    """
+    Byte chunks of a compliance export, reading one farm at a time.
+    json keeps the document shape (summary, zones, farms with history, thresholds);
+    the tabular formats carry one row per sample.
+    """
+    # One snapshot for the whole export: every farm (and the json head) as of the same write
+    with STATE_LOCK.read():
+        view = FARMS.snapshot()
+        head = {
+            "generated_at": datetime.utcnow().isoformat(),
+            "summary": agg_stats(),
+            "zones": compute_zone_aggregation()
+        } if fmt == "json" else None
+    farms = view.select(status=status, zone=zone)
+
+    def each_farm():
+        for i, f in enumerate(farms):
+            if progress and i % 500 == 0:
+                progress(i / len(farms))
+            yield f
+
+    def history_rows(f):
+        rows = farm_history(f, since=since)
+        if SAMPLE_STORE:  # the store also holds samples written after the snapshot
+            last = f.last_update
+            rows = [h for h in rows if h["time"] <= last]
+        return rows
+
+    if fmt == "json":
+        def farm_docs():
+            # cached farm fragment with the history spliced in as the last key; the
+            # durable history is read per farm and not cached (it would pin every farm's
+            # full history in memory after one export)
+            for f in each_farm():
+                doc = farm_fragment(f, FarmRecord.DICT_FIELDS[:-1])
+                yield doc[:-1] + b',"history":' + dumps(history_rows(f)) + b"}"
+
+        tail = {"thresholds": {
+            "critical": THRESHOLD_CRITICAL,
+            "high": THRESHOLD_HIGH,
+            "medium": THRESHOLD_MEDIUM,
+            "fda_intervention": FDA_INTERVENTION_LEVEL
+        }}
+        return export.json_document_chunks(head, farm_docs(), tail)
+
+    def sample_rows():
+        for f in each_farm():
+            for h in history_rows(f):
+                yield {
+                    "farm_id": f.id,
+                    "farm_name": f.name,
+                    "location": f.location,
+                    "zone": f.zone,
+                    "status": get_status(h["value"]),
+                    "time": h["time"],
+                    "value": h["value"],
+                    "value_bq": ppb_to_bq(h["value"]),
+                    "inspector": h["inspector"],
+                    "notes": h["notes"]
+                }
+
+    return export.encode_rows(fmt, sample_rows())
+
+def build_export(job, fmt="json", since=None, zone=None, status=None):
+    """Job: write a compliance export to the job's result file"""
+    mimetype, suffix, _ = export.FORMATS[fmt]
+    return StreamResult(export_chunks(fmt, since, zone, status, progress=job.report), mimetype, suffix)
+
+JOBS.register("simulate", run_simulation)
+JOBS.register("export", build_export)
+
+def submit_job(kind, params):
+    """Queue a job for the current user; (job, None) or (None, error response)"""
+    try:
+        return JOBS.submit(kind, params, owner=request.current_user["username"]), None
+    except QueueFull:
+        resp = jsonify({"success": False, "error": "Job queue is full, retry later", "queue_depth": JOBS.depth})
+        resp.headers["Retry-After"] = "5"
+        return None, (resp, 429)
+
+def job_accepted(job):
+    resp = jsonify({"success": True, "job": job.to_dict()})
+    resp.headers["Location"] = f"/api/jobs/{job.id}"
+    return resp, 202
+
+def job_result(job):
+    """The finished job's stored result, or its status when it did not succeed"""
+    if job.status == SUCCEEDED:
+        return send_file(job.result_path, mimetype=job.mimetype)
+    if job.status == FAILED:
+        return jsonify({"success": False, "error": job.error, "job": job.to_dict()}), 500
+    if job.status == CANCELLED:
+        return jsonify({"success": False, "error": "Job cancelled", "job": job.to_dict()}), 409
+    return job_accepted(job)
+
 @app.route("/api/simulate", methods=["GET"])
 @require_role(allowed=["admin"])
 def api_simulate():
-    """Simulate random contamination changes for demo"""
-    # Precompute zone averages for gentle mean-reversion
-    zone_snapshot = {}
-    for f in FARMS:
-        zid = closest_zone_id(f["lat"], f["lng"])
-        zone_snapshot.setdefault(zid, []).append(f["value"])
-
-    zone_avg = {zid: statistics.mean(vals) if vals else 30 for zid, vals in zone_snapshot.items()}
-
-    for f in FARMS:
-        zid = closest_zone_id(f["lat"], f["lng"])
-        avg = zone_avg.get(zid, 30)
-        random_variation = random.uniform(-4.5, 5.5)
-        trend_correction = (avg - f["value"]) * 0.15
-        seasonal = math.sin(random.random() * math.pi) * 1.2
-        newv = f["value"] + random_variation + trend_correction + seasonal
-        newv = max(0, min(72, round(newv, 2)))
-        
-        history = f.setdefault("history", [])
-        history.append({
-            "time": datetime.utcnow().isoformat(),
-            "inspector": "auto-sim",
-            "value": newv,
-            "notes": "Simulated data"
-        })
-        # Keep history manageable
-        if len(history) > 30:
-            del history[0]
-        
-        f["value"] = newv
-        f["value_bq"] = ppb_to_bq(newv)
-        f["status"] = get_status(newv)
-        f["lastUpdate"] = history[-1]["time"]
-        f["export_ready"] = f["status"] in ["Safe", "Medium"]
-    
-    return jsonify({"success": True, "message": "Simulation completed", "timestamp": datetime.utcnow().isoformat()})
+    """Run a simulation job; answers inline when it finishes quickly, else 202 with the job"""
+    params, error = parse_simulate_params(request.args)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    job, busy = submit_job("simulate", params)
+    if busy:
+        return busy
+    job.wait(LEGACY_JOB_WAIT_SECONDS)
+    return job_result(job)
 
 @app.route("/api/export", methods=["GET"])
 @require_role(allowed=["admin"])
 def api_export():
-    """Export data in JSON format for reporting"""
-    export_data = {
-        "generated_at": datetime.utcnow().isoformat(),
-        "summary": agg_stats(),
-        "zones": compute_zone_aggregation(),
-        "farms": FARMS,
-        "thresholds": {
-            "critical": THRESHOLD_CRITICAL,
-            "high": THRESHOLD_HIGH,
-            "medium": THRESHOLD_MEDIUM,
-            "fda_intervention": FDA_INTERVENTION_LEVEL
-        }
-    }
-    return jsonify(export_data)
+    """Stream a compliance export: format=json|ndjson|csv|parquet|arrow, optional since=, zone=, status="""
+    params, error = parse_export_params(request.args)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    mimetype, suffix, _ = export.FORMATS[params["fmt"]]
+    filename = f"cesium-guard-export-{datetime.utcnow():%Y%m%dT%H%M%S}{suffix}"
+    return Response(export_chunks(**params), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.route("/api/jobs", methods=["POST"])
+@require_role(allowed=["admin"])
+def api_jobs_submit():
+    """Submit a background job: {"type": "simulate"|"export", "params": {...}}"""
+    data = request.get_json(silent=True) or {}
+    kind = data.get("type")
+    params = data.get("params") or {}
+    if kind == "simulate":
+        params, error = parse_simulate_params(params)
+        if error:
+            return jsonify({"success": False, "error": error}), 400
+    elif kind == "export":
+        params, error = parse_export_params(params)
+        if error:
+            return jsonify({"success": False, "error": error}), 400
+    else:
+        return jsonify({"success": False, "error": "Unknown job type"}), 400
+    job, busy = submit_job(kind, params)
+    return busy or job_accepted(job)
+
+@app.route("/api/jobs", methods=["GET"])
+@require_role(allowed=["admin"])
+def api_jobs_list():
+    jobs = [j.to_dict() for j in reversed(JOBS.list())]
+    return jsonify({"jobs": jobs, "queue_depth": JOBS.depth, "max_queued": JOBS.max_queued})
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@require_role(allowed=["admin"])
+def api_job_status(job_id):
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+@app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+@require_role(allowed=["admin"])
+def api_job_cancel(job_id):
+    job = JOBS.cancel(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"success": True, "job": job.to_dict()})
+
+@app.route("/api/jobs/<job_id>/result", methods=["GET"])
+@require_role(allowed=["admin"])
+def api_job_result(job_id):
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return job_result(job)
+
+ALERT_TEXT = {
+    (CRITICAL, LEVEL): ("⚠️ CRITICAL: {name} exceeds safe threshold",
+                        "Immediate inspection and export suspension recommended"),
+    (WARNING, LEVEL): ("⚡ HIGH RISK: {name} approaching critical levels", "Enhanced monitoring required"),
+    (WARNING, RATE): ("📈 RAPID RISE: {name} up {rise} ppb since the previous sample",
+                        "Re-sample to confirm the reading")
+}
 
 @app.route("/api/alerts", methods=["GET"])
+@cached_response()
 def api_alerts():
-    """Get active alerts for critical contamination"""
-    alerts = []
-    for f in FARMS:
-        if f["status"] == "Critical":
-            alerts.append({
-                "severity": "critical",
-                "farm_id": f["id"],
-                "farm_name": f["name"],
-                "location": f["location"],
-                "value": f["value"],
-                "value_bq": f["value_bq"],
-                "message": f"⚠️ CRITICAL: {f['name']} exceeds safe threshold",
-                "timestamp": f["lastUpdate"],
-                "action_required": "Immediate inspection and export suspension recommended"
-            })
-        elif f["status"] == "High":
-            alerts.append({
-                "severity": "warning",
-                "farm_id": f["id"],
-                "farm_name": f["name"],
-                "location": f["location"],
-                "value": f["value"],
-                "value_bq": f["value_bq"],
-                "message": f"⚡ HIGH RISK: {f['name']} approaching critical levels",
-                "timestamp": f["lastUpdate"],
-                "action_required": "Enhanced monitoring required"
-            })
-    
-    return jsonify({"alerts": sorted(alerts, key=lambda x: x["value"], reverse=True), "count": len(alerts)})
+    """Open alerts, highest first; with since=<cursor> only alerts opened, changed, acked or cleared after it"""
+    since = request.args.get("since")
+    if since is None:
+        alerts = sorted((alert_dict(a) for a in ALERTS.open.values()), key=lambda x: x["value"], reverse=True)
+        return jsonify({"alerts": alerts, "count": len(alerts), "cursor": ALERTS.seq})
+    if not since.isdigit():
+        return jsonify({"error": "since must be a cursor returned by /api/alerts"}), 400
+    changed = ALERTS.since(int(since))
+    reset = changed is None
+    if reset:
+        # the cursor is older than the retained history: resync from the open set
+        changed = sorted(ALERTS.open.values(), key=lambda a: a.seq)
+    alerts = [alert_dict(a) for a in changed]
+    return jsonify({"alerts": alerts, "count": len(alerts), "cursor": ALERTS.seq, "reset": reset})
+
+@app.route("/api/alerts/<int:alert_id>/ack", methods=["POST"])
+@require_role(allowed=["admin", "field"])
+def api_alert_ack(alert_id):
+    """Acknowledge an open alert once (409 if already acknowledged); it stays open until the readings clear it"""
+    with SHARED.writing() as events:
+        alert = ALERTS.by_id.get(alert_id)
+        if alert is None or alert.status != OPEN:
+            return jsonify({"success": False, "error": "Alert not open"}), 404
+        if alert.acked_by is not None:
+            return jsonify({"success": False, "error": "Alert already acknowledged",
+                            "alert": alert_dict(alert)}), 409
+        events.append(("ack", {"alert_id": alert_id, "user": request.current_user["username"],
+                               "time": datetime.utcnow().isoformat()}))
+    return jsonify({"success": True, "alert": alert_dict(ALERTS.by_id[alert_id])})
+
+def alert_dict(alert):
+    """API shape of an alert"""
+    f = FARMS.get(alert.farm_id)
+    message, action = ALERT_TEXT[(alert.severity, alert.trigger)]
+    rise = round(alert.value - alert.baseline, 2) if alert.baseline is not None else None
+    return {
+        "id": alert.id,
+        "severity": alert.severity,
+        "trigger": alert.trigger,
+        "status": alert.status,
+        "farm_id": alert.farm_id,
+        "farm_name": f.name if f else None,
+        "location": f.location if f else None,
+        "value": alert.value,
+        "value_bq": ppb_to_bq(alert.value),
+        "message": message.format(name=f.name if f else alert.farm_id, rise=rise),
+        "timestamp": f.last_update if f else alert.updated_at,
+        "action_required": action,
+        "opened_at": alert.opened_at,
+        "updated_at": alert.updated_at,
+        "acked_by": alert.acked_by,
+        "acked_at": alert.acked_at,
+        "cursor": alert.seq
+    }
+
+class EventStream:
+    """
+    /api/stream body: a snapshot, then the broker's frames after `cursor`, with keepalives.
+    WSGI servers iterate it and hold a thread per open stream, so under WSGI it
+    holds one of STREAM_WSGI_SLOTS until the server closes it; asgi.py iterates
+    it asynchronously, so an idle stream only costs a suspended coroutine.
+    """
+
+    def __init__(self, cursor, slot=False):
+        self.cursor = cursor
+        self.slot = slot
+
+    def close(self):
+        if self.slot:
+            self.slot = False
+            STREAM_WSGI_SLOTS.release()
+
+    @staticmethod
+    def snapshot_frame(pos):
+        return sse_frame("snapshot", stream_snapshot(), BROKER.event_id(pos))
+
+    def __iter__(self):
+        pos = self.cursor
+        if pos is None or BROKER.since(pos) is None:
+            pos = BROKER.seq
+            yield self.snapshot_frame(pos)
+        while True:
+            frames = BROKER.wait(pos, timeout=STREAM_KEEPALIVE_SECONDS)
+            if frames is None:
+                # Fell behind the broker ring; start over from a fresh snapshot
+                pos = BROKER.seq
+                yield self.snapshot_frame(pos)
+                continue
+            if not frames:
+                yield b": keepalive\n\n"
+                continue
+            for seq, kind, frame in frames:
+                pos = seq
+                yield self.snapshot_frame(seq) if kind == "resync" else frame
+
+    async def __aiter__(self):
+        # Same frames as __iter__; snapshots are built on the loop's executor
+        loop = asyncio.get_running_loop()
+        pos = self.cursor
+        if pos is None or BROKER.since(pos) is None:
+            pos = BROKER.seq
+            yield await loop.run_in_executor(None, self.snapshot_frame, pos)
+        while True:
+            frames = await BROKER.wait_async(pos, timeout=STREAM_KEEPALIVE_SECONDS)
+            if frames is None:
+                pos = BROKER.seq
+                yield await loop.run_in_executor(None, self.snapshot_frame, pos)
+                continue
+            if not frames:
+                yield b": keepalive\n\n"
+                continue
+            for seq, kind, frame in frames:
+                pos = seq
+                yield await loop.run_in_executor(None, self.snapshot_frame, seq) if kind == "resync" else frame
+
+@app.route("/api/stream", methods=["GET"])
+def api_stream():
+    """Server-Sent Events: a snapshot on connect, then deltas as samples and simulations land"""
+    cursor = BROKER.cursor(request.headers.get("Last-Event-ID"))
+    slot = not request.environ.get("cesium.async_body")  # a WSGI server will hold a thread on it
+    if slot and not STREAM_WSGI_SLOTS.acquire(blocking=False):
+        resp = jsonify({"success": False, "error": "Too many open streams, poll instead"})
+        resp.headers["Retry-After"] = "30"
+        return resp, 503
+    # direct_passthrough hands the EventStream itself to the server, so asgi.py can iterate it async
+    return Response(EventStream(cursor, slot), mimetype="text/event-stream", direct_passthrough=True,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/intel", methods=["GET"])
+@cached_response(ttl=60)
 def api_intel():
     """Serve synthesized insights for the action center"""
     return jsonify(compute_intel())
 
+@app.route("/api/dispatch", methods=["GET"])
+@require_role(allowed=["admin", "field"])
+@cached_response(ttl=60)
+def api_dispatch():
+    """
+    Overdue farms by dispatch priority, paged (page=, per_page=) and optionally
+    per zone= / inspector=; routes=1 adds nearby-farm routes (route_size=, max_km=).
+    """
+    zone = request.args.get("zone")
+    inspector = request.args.get("inspector")
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 20, type=int)
+    if zone is not None and zone not in ZONES_META:
+        return jsonify({"error": "Zone not found"}), 404
+    if page < 1 or not 1 <= per_page <= 100:
+        return jsonify({"error": "page must be >= 1 and per_page between 1 and 100"}), 400
+    now_us = iso_to_us(datetime.utcnow().isoformat())
+    total, queue = DISPATCH.page(now_us, offset=(page - 1) * per_page, limit=per_page,
+                                 zone=zone, inspector=inspector)
+    out = {
+        "sla_hours": SAMPLING_SLA_HOURS,
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "queue": [dispatch_entry(e) for e in queue]
+    }
+    if request.args.get("routes") == "1":
+        size = min(max(request.args.get("route_size", 4, type=int), 1), 10)
+        max_km = min(max(request.args.get("max_km", 50.0, type=float), 0.0), 500.0)
+        routes = DISPATCH.batches(now_us, count=per_page, size=size, max_km=max_km, zone=zone, inspector=inspector)
+        out["routes"] = [{
+            "route_km": r["route_km"],
+            "stops": [dispatch_entry(e) for e in r["stops"]]
+        } for r in routes]
+    return jsonify(out)
+
+def dispatch_entry(entry):
+    """API shape of a DISPATCH queue entry"""
+    f = FARMS.get(entry["farm_id"])
+    return {
+        "id": f.id,
+        "name": f.name,
+        "zone": ZONES_META.get(f.zone, {}).get("name", f.zone),
+        "inspector": entry["inspector"],
+        "last_update": datetime.fromisoformat(f.last_update).strftime("%d %b %H:%M"),
+        "hours_since": entry["hours_since"],
+        "priority": entry["priority"],
+        "value": f.value,
+        "severity": f.status,
+        "lat": f.lat,
+        "lng": f.lng
+    }
+
 # Health check for Railway
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"status": "healthy", "farms": len(FARMS)}), 200
 
+# Prometheus scrape target; numbers are for the worker process that answers
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/metrics", methods=["GET"])
+@require_role(allowed=["admin"])
+def api_metrics():
+    """Request counts, sizes and recent p50/p95/p99 per endpoint and span, as JSON"""
+    return jsonify(METRICS.summary())
+
+@app.route("/api/profile", methods=["GET", "POST"])
+@require_role(allowed=["admin"])
+def api_profile():
+    """POST {"requests": N} profiles this worker's next N requests; GET reports progress"""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        try:
+            count = int(data.get("requests", 10))
+        except (TypeError, ValueError):
+            return jsonify({"error": "requests must be an integer"}), 400
+        if not 1 <= count <= PROFILE_MAX_REQUESTS:
+            return jsonify({"error": f"requests must be 1..{PROFILE_MAX_REQUESTS}"}), 400
+        PROFILER.arm(count)
+    return jsonify({"pid": os.getpid(), **PROFILER.status()})
+
+@app.route("/api/profile/download", methods=["GET"])
+@require_role(allowed=["admin"])
+def api_profile_download():
+    """The captured profile: format=pstats (default, for snakeviz/pstats) or text"""
+    fmt = request.args.get("format", "pstats")
+    if fmt not in ("pstats", "text"):
+        return jsonify({"error": "format must be pstats or text"}), 400
+    data = PROFILER.dump() if fmt == "pstats" else PROFILER.text(request.args.get("sort", "cumulative"))
+    if data is None:
+        return jsonify({"error": "No profile captured yet"}), 404
+    if fmt == "text":
+        return Response(data, mimetype="text/plain")
+    return Response(data, mimetype="application/octet-stream",
+                    headers={"Content-Disposition": f"attachment; filename=cesium-{os.getpid()}.prof"})
+
 # -----------------------
 # ERROR HANDLERS
 # -----------------------
@@ -741,9 +2049,8 @@ def method_not_allowed(error):
 
 @app.errorhandler(Exception)
 def handle_exception(e):
-    import traceback
-    print("[ERROR]", e)
-    traceback.print_exc()
+    METRICS.count_exception()
+    app.logger.exception("Unhandled exception on %s %s", request.method, request.path)
     return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
 @app.errorhandler(404)
@@ -752,17 +2059,58 @@ def not_found(error):
 
 @app.errorhandler(500)
 def internal_error(error):
-    import traceback
-    print("[ERROR]", error)
-    traceback.print_exc()
+    METRICS.count_exception()
+    app.logger.error("Internal error on %s %s: %s", request.method, request.path, error)
     return jsonify({"error": "Internal server error"}), 500
 
+METRICS.gauge("farms", "Farms in this replica", lambda: len(FARMS))
+METRICS.gauge("data_version", "Response cache data version", lambda: RESPONSE_CACHE.version)
+METRICS.gauge("shared_seq", "Last shared-state event applied by this process", lambda: SHARED.seq)
+METRICS.gauge("revoked_sessions", "Live session revocations", lambda: len(SESSIONS.revoked))
+
+# -----------------------
+# STARTUP
+# -----------------------
+# Importing this module only defines things; data sources are opened by
+# start(), from create_app() or lazily on the first request
+_START_LOCK = threading.Lock()
+_started = False
+
+def start():
+    """
+    Open the sample store, restore/replay the shared log into this process's
+    replica and start the job workers; runs once per process. The first process
+    to find the log empty seeds it and the others pick the seed up from the log.
+    """
+    global SAMPLE_STORE, _started
+    if _started:
+        return
+    with _START_LOCK:
+        if _started:
+            return
+        if DATA_DIR and SAMPLE_STORE is None:
+            SAMPLE_STORE = SampleStore(DATA_DIR)
+        SHARED.start()
+        with SHARED.writing() as events:
+            if SHARED.seq == 0:
+                if SAMPLE_STORE:
+                    SAMPLE_STORE.refresh()
+                events.append(("load", seed_farms()))
+        JOBS.start()
+        _started = True
+
+def create_app():
+    """App factory for gunicorn (`app:create_app()`): the app with its replica ready"""
+    start()
+    return app
+
 # -----------------------
 # RUN SERVER
 # -----------------------
 if __name__ == "__main__":
     # Only run the server for local development; Gunicorn will handle production
     port = int(os.getenv("PORT", 8000))
+    create_app()
     print("=" * 60)
     print("🦐 CESIUM GUARD - Shrimp Contamination Monitoring System")
     print("=" * 60)
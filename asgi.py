@@ -0,0 +1,215 @@
+"""
+ASGI entry point: the same routes behind an asyncio server.
+
+    uvicorn --factory asgi:create_app --host 0.0.0.0 --port 8000 --workers 2
+
+WSGIBridge runs the Flask app for each request on a bounded thread pool
+(CESIUM_ASGI_THREADS), so every handler, CPU-heavy ones like compute_intel
+included, stays off the event loop; simulations and exports still run on
+the job workers. Only RESPONSE_CACHE hits and 304s (app.cached_hit) are
+answered on the loop itself, since they run no handler at all. The loop owns the connections: request bodies are read and
+responses written asynchronously, so a slow client (an inspector on a flaky
+mobile link) holds a coroutine instead of a pool thread. /api/stream's body
+is async-iterable (app.EventStream) and waits on the broker with no thread
+at all; other streamed bodies (exports) are pulled from the pool a batch at
+a time and written with backpressure. The replica, shared log and jobs are
+the same as under gunicorn. The ASGI server (uvicorn) is an optional
+dependency.
+"""
+import asyncio
+import io
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+
+ASGI_THREADS = int(os.getenv("CESIUM_ASGI_THREADS", 32))
+MAX_REQUEST_BYTES = 64 * 1024 * 1024  # bodies are buffered before the app runs
+STREAM_BATCH_BYTES = 256 * 1024       # streamed WSGI body read per pool hop
+
+
+def wsgi_environ(scope, body):
+    """PEP 3333 environ for an ASGI http scope and its (fully read) body"""
+    script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+    path_info = scope["path"].encode("utf8").decode("latin1")
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "cesium.async_body": True  # async-iterable bodies (app.EventStream) are iterated on the loop
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name == "CONTENT_LENGTH":
+            continue  # set from the body actually read
+        key = name if name == "CONTENT_TYPE" else "HTTP_" + name
+        value = value.decode("latin1")
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+def _close(body):
+    if hasattr(body, "close"):
+        body.close()
+
+
+class WSGIBridge:
+    """
+    ASGI app running a WSGI app on a thread pool; async-iterable bodies are sent from the loop.
+    fast(environ), if given, runs on the loop first and returns (status, headers, body) for a
+    request it can answer without the app, else None.
+    """
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, fast=None):
+        self.wsgi_app = wsgi_app
+        self.fast = fast
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self.http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        # websockets are not served
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # EventStream builds its snapshots on the loop's default executor
+                asyncio.get_running_loop().set_default_executor(self.executor)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        parts = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            parts.append(message.get("body", b""))
+            size += len(parts[-1])
+            if size > MAX_REQUEST_BYTES:
+                await self.plain(send, 413, b"Request body too large")
+                return
+            if not message.get("more_body"):
+                break
+        environ = wsgi_environ(scope, b"".join(parts))
+        hit = self.fast(environ) if self.fast else None
+        if hit is not None:
+            status, headers, data = hit
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]})
+            await send({"type": "http.response.body", "body": data})
+            return
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+
+        def run():
+            """(body, None) for streamed bodies, (None, bytes) for buffered ones (a Content-Length, or a 304)"""
+            body = self.wsgi_app(environ, start_response)
+            if hasattr(body, "__aiter__") or (started["status"] != 304 and
+                                              not any(k == b"content-length" for k, _ in started["headers"])):
+                return body, None
+            try:
+                return None, b"".join(body)
+            finally:
+                _close(body)
+
+        try:
+            body, data = await asyncio.get_running_loop().run_in_executor(self.executor, run)
+        except Exception:
+            traceback.print_exc()
+            await self.plain(send, 500, b"Internal Server Error")
+            return
+        await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+        if data is not None:
+            await send({"type": "http.response.body", "body": data})
+        else:
+            chunks = body if hasattr(body, "__aiter__") else self.pull(body)
+            await self.stream(chunks, receive, send)
+
+    async def pull(self, body):
+        """A streamed WSGI body as async chunks, read on the pool STREAM_BATCH_BYTES at a time"""
+        it = iter(body)
+
+        def batch():
+            parts, size = [], 0
+            for chunk in it:
+                parts.append(chunk)
+                size += len(chunk)
+                if size >= STREAM_BATCH_BYTES:
+                    return b"".join(parts), False
+            return b"".join(parts), True
+
+        future = None
+        try:
+            while True:
+                future = self.executor.submit(batch)
+                data, last = await asyncio.wrap_future(future)
+                if data:
+                    yield data
+                if last:
+                    return
+        finally:
+            if future is not None and not future.done():
+                future.add_done_callback(lambda _: _close(body))  # the client left mid-batch
+            else:
+                self.executor.submit(_close, body)
+
+    async def stream(self, chunks, receive, send):
+        """Send chunks until they run out or the client goes away"""
+        async def pump():
+            async for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        sending = asyncio.ensure_future(pump())
+        watching = asyncio.ensure_future(disconnected())
+        done, _ = await asyncio.wait((sending, watching), return_when=asyncio.FIRST_COMPLETED)
+        for task in (sending, watching):
+            task.cancel()
+        sent, _ = await asyncio.gather(sending, watching, return_exceptions=True)
+        if sending in done and isinstance(sent, Exception):
+            raise sent  # errors from the body
+
+    @staticmethod
+    async def plain(send, status, text):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(text)).encode())]})
+        await send({"type": "http.response.body", "body": text})
+
+
+def create_app():
+    """ASGI app factory (`uvicorn --factory asgi:create_app`): the started Flask app behind WSGIBridge"""
+    return WSGIBridge(app.create_app(), fast=app.cached_hit)
@@ -0,0 +1,175 @@
+"""
+Dashboard polling mix replayed at configurable concurrency.
+
+    python -m bench.api_load --farms 10000 --history 14 --concurrency 1 8 32 --duration 10
+    python -m bench.api_load --url http://127.0.0.1:8000 --concurrency 8
+
+Each virtual client repeats index.html's loadAll poll (farms without
+history, zones, stats, intel and the viewport heatmap), opens a farm popup
+(history?limit=30) with --popup-ratio, posts a sample with --write-ratio and
+runs a one-step simulation with --simulate-ratio. Without --url the app
+runs in this process on synthetic data through Flask's test client;
+with --url it drives an already running server over keep-alive connections.
+Reports throughput and per-endpoint p50/p95/p99.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from metrics import quantiles
+
+POLL = [
+    ("farms", "/api/farms?include_history=false"),
+    ("zones", "/api/zones"),
+    ("stats", "/api/stats"),
+    ("intel", "/api/intel"),
+    ("heatmap", "/api/heatmap?bbox=-9,104,-5,115&zoom=7"),
+]
+
+
+class LocalTransport:
+    """Requests through Flask's test client, one client per thread"""
+
+    def __init__(self, farms, history):
+        import app
+        from bench.synthetic import make_farms
+        self.app = app
+        if farms:
+            app.load_farms(make_farms(farms, history_points=history))
+        self.token = app.generate_token("admin")
+        self.farm_count = len(app.FARMS)
+
+    def session(self):
+        client = self.app.app.test_client()
+        headers = {"Authorization": "Bearer " + self.token}
+
+        def call(method, path, body=None):
+            return client.open(path, method=method, json=body, headers=headers).status_code
+        return call
+
+
+class HTTPTransport:
+    """Requests to a running server, one keep-alive connection per thread"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        _, body = self._request(self._connect(), "POST", "/api/login",
+                                {"username": "admin", "password": "secureadmin"})
+        self.token = json.loads(body)["token"]
+        _, body = self._request(self._connect(), "GET", "/api/farms?limit=1&include_history=false")
+        self.farm_count = json.loads(body)["total"]
+
+    def _connect(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+    def _request(self, conn, method, path, body=None, token=None):
+        headers = {"Authorization": "Bearer " + token} if token else {}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(body)
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+
+    def session(self):
+        conn = self._connect()
+
+        def call(method, path, body=None):
+            return self._request(conn, method, path, body, self.token)[0]
+        return call
+
+
+def run_mix(transport, concurrency, duration, popup_ratio=0.3, write_ratio=0.02, simulate_ratio=0.0, seed=0):
+    """
+    Drive the mix from `concurrency` threads for `duration` seconds.
+    Returns {"requests", "errors", "req_s", "endpoints": {label: {count, p50, p95, p99 (ms)}}}.
+    """
+    latencies = {}
+    errors = [0]
+    lock = threading.Lock()
+    start = threading.Barrier(concurrency + 1)
+    deadline = [0.0]
+
+    def client(i):
+        rng = random.Random(seed * 1000 + i)
+        call = transport.session()
+        mine = {}
+        failed = 0
+
+        def timed(label, method, path, body=None):
+            t0 = time.perf_counter()
+            status = call(method, path, body)
+            mine.setdefault(label, []).append(time.perf_counter() - t0)
+            return status < 400
+
+        start.wait()
+        while time.perf_counter() < deadline[0]:
+            for label, path in POLL:
+                failed += not timed(label, "GET", path)
+            if rng.random() < popup_ratio:
+                fid = rng.randint(1, transport.farm_count)
+                failed += not timed("history", "GET", f"/api/farm/{fid}/history?limit=30")
+            if rng.random() < write_ratio:
+                failed += not timed("samples", "POST", "/api/samples", {
+                    "farm_id": rng.randint(1, transport.farm_count),
+                    "value": round(rng.uniform(5, 70), 2), "inspector": "bench"})
+            if rng.random() < simulate_ratio:
+                failed += not timed("simulate", "GET", "/api/simulate")
+        with lock:
+            for label, values in mine.items():
+                latencies.setdefault(label, []).extend(values)
+            errors[0] += failed
+
+    pool = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in pool:
+        t.start()
+    deadline[0] = time.perf_counter() + duration
+    started = time.perf_counter()
+    start.wait()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(v) for v in latencies.values())
+    endpoints = {}
+    for label, values in sorted(latencies.items()):
+        qs = quantiles(values)
+        endpoints[label] = {"count": len(values), **{"p%d" % round(q * 100): v * 1000 for q, v in qs.items()}}
+    return {"requests": total, "errors": errors[0], "req_s": total / elapsed, "endpoints": endpoints}
+
+
+def print_report(concurrency, result):
+    print(f"concurrency={concurrency}  requests={result['requests']}  errors={result['errors']}"
+          f"  throughput={result['req_s']:.0f} req/s")
+    print(f"  {'endpoint':>10}  {'count':>7}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}")
+    for label, row in result["endpoints"].items():
+        print(f"  {label:>10}  {row['count']:>7}  {row['p50']:>8.2f}  {row['p95']:>8.2f}  {row['p99']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="drive a running server instead of the in-process app")
+    parser.add_argument("--farms", type=int, default=10000, help="synthetic farms (in-process only)")
+    parser.add_argument("--history", type=int, default=14, help="samples per synthetic farm")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--popup-ratio", type=float, default=0.3, help="popups per poll")
+    parser.add_argument("--write-ratio", type=float, default=0.02, help="POST /api/samples per poll")
+    parser.add_argument("--simulate-ratio", type=float, default=0.0, help="one-step simulations per poll")
+    args = parser.parse_args()
+
+    transport = HTTPTransport(args.url) if args.url else LocalTransport(args.farms, args.history)
+    print(f"farms={transport.farm_count}  transport={'http ' + args.url if args.url else 'test client'}")
+    for concurrency in args.concurrency:
+        result = run_mix(transport, concurrency, args.duration, args.popup_ratio,
+                         args.write_ratio, args.simulate_ratio)
+        print_report(concurrency, result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Held connections and tail latency: gunicorn gthread vs the ASGI entry point.
+
+    python -m bench.asgi_load --held 0 64 256 --clients 8 --threads 32 --duration 10
+
+For each server and each --held count it starts the server on a fresh
+CESIUM_DATA_DIR, opens that many /api/stream connections (dashboards left
+open, or inspectors on slow links) and keeps them open while --clients
+keep-alive connections repeat the dashboard poll (bench.api_load.POLL) with
+a --timeout per request. Reports how many streams got a 200 (gunicorn
+refuses streams past CESIUM_STREAM_WSGI_MAX per worker with a 503),
+poll throughput, p50/p99 and failed or timed-out polls. Both servers get
+--threads handler threads per worker (gunicorn --threads,
+CESIUM_ASGI_THREADS) and --workers processes; the ASGI run needs uvicorn.
+"""
+import argparse
+import http.client
+import json
+import os
+import selectors
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench.api_load import POLL
+from bench.load_workers import ROOT, free_port, request, stop_server
+from metrics import quantiles
+
+SERVERS = {
+    "gunicorn": lambda port, args: [
+        sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+        "--worker-class", "gthread", "--threads", str(args.threads), "--timeout", "120",
+        "--log-level", "warning", "app:create_app()"],
+    "asgi": lambda port, args: [
+        sys.executable, "-m", "uvicorn", "--factory", "asgi:create_app", "--host", "127.0.0.1",
+        "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"],
+}
+
+
+def start(server, args, data_dir):
+    port = free_port()
+    env = dict(os.environ, CESIUM_DATA_DIR=data_dir, CESIUM_ASGI_THREADS=str(args.threads))
+    proc = subprocess.Popen(SERVERS[server](port, args), cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if request(http.client.HTTPConnection("127.0.0.1", port, timeout=2), "GET", "/health")[0] == 200:
+                return proc, port
+        except OSError:
+            time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError(f"{server} did not become healthy")
+
+
+def hold_streams(port, count, stop, opened):
+    """Open `count` /api/stream connections and drain them until stop; opened[0] counts 200 responses"""
+    sel = selectors.DefaultSelector()
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(b"GET /api/stream HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n")
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ, [b"", False])
+    while not stop.is_set():
+        for key, _ in sel.select(timeout=0.2):
+            state = key.data
+            try:
+                data = key.fileobj.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+                continue
+            if not state[1]:
+                state[0] += data
+                if state[0].startswith(b"HTTP/1.1 200"):
+                    state[1] = True
+                    opened[0] += 1
+    for key in list(sel.get_map().values()):
+        key.fileobj.close()
+
+
+def poll(port, token, deadline, timeout, latencies, errors, lock):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    mine, failed = [], 0
+    while time.time() < deadline:
+        for _, path in POLL:
+            t0 = time.perf_counter()
+            try:
+                status, _ = request(conn, "GET", path, token=token)
+                ok = status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+            if ok:
+                mine.append(time.perf_counter() - t0)
+            else:
+                failed += 1
+    with lock:
+        latencies.extend(mine)
+        errors[0] += failed
+
+
+def run(server, held, args):
+    data_dir = tempfile.mkdtemp(prefix="cesium-asgi-")
+    proc, port = start(server, args, data_dir)
+    stop = threading.Event()
+    opened = [0]
+    holder = None
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        _, body = request(conn, "POST", "/api/login", body={"username": "admin", "password": "secureadmin"})
+        token = json.loads(body)["token"]
+        holder = threading.Thread(target=hold_streams, args=(port, held, stop, opened))
+        holder.start()
+        time.sleep(args.settle)
+
+        latencies, errors, lock = [], [0], threading.Lock()
+        deadline = time.time() + args.duration
+        started = time.perf_counter()
+        pool = [threading.Thread(target=poll, args=(port, token, deadline, args.timeout, latencies, errors, lock))
+                for _ in range(args.clients)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+        qs = quantiles(latencies)
+        return {
+            "streams": opened[0],
+            "req_s": len(latencies) / elapsed,
+            "p50": qs[0.5] * 1000 if latencies else float("nan"),
+            "p99": qs[0.99] * 1000 if latencies else float("nan"),
+            "errors": errors[0]
+        }
+    finally:
+        stop.set()
+        if holder:
+            holder.join()  # streams closed before the server drains
+        stop_server(proc)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument("--held", type=int, nargs="+", default=[0, 64, 256], help="open /api/stream connections")
+    parser.add_argument("--clients", type=int, default=8, help="polling keep-alive connections")
+    parser.add_argument("--threads", type=int, default=32, help="handler threads per worker")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=5, help="seconds before a poll counts as failed")
+    parser.add_argument("--settle", type=float, default=2, help="seconds between opening streams and polling")
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()}  workers={args.workers}  threads={args.threads}  clients={args.clients}")
+    print(f"{'server':>9}  {'held':>5}  {'streams':>7}  {'req/s':>7}  {'p50 ms':>8}  {'p99 ms':>8}  {'failed':>6}")
+    for server in args.servers:
+        for held in args.held:
+            r = run(server, held, args)
+            print(f"{server:>9}  {held:>5}  {r['streams']:>7}  {r['req_s']:>7.0f}  {r['p50']:>8.1f}"
+                  f"  {r['p99']:>8.1f}  {r['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
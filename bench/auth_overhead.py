@@ -0,0 +1,95 @@
+"""
+Per-request authentication cost under thread concurrency.
+
+    python -m bench.auth_overhead --threads 1 8 32 --requests 20000
+
+Compares verifying a signed session token (sessions.SessionManager, with a
+populated revocation set) against the old per-request token lookup in the
+shared SQLite table, and times /api/me end to end through the Flask test
+client. "jwt cold" cycles through more tokens than the verified-token cache
+holds, so every call checks the signature. Reported latency is wall time per request across all threads.
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+import app
+from sessions import VERIFIED_CACHE, SessionManager
+
+
+def run_threads(threads, total, fn):
+    """Wall-clock microseconds per call of fn() split over `threads` threads"""
+    per_thread = total // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(per_thread):
+            fn()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for t in pool:
+        t.join()
+    return (time.perf_counter() - t0) / (per_thread * threads) * 1e6
+
+
+def sqlite_lookup(tokens):
+    """The pre-session scheme: one token table row per login, read on every request"""
+    path = os.path.join(tempfile.mkdtemp(prefix="cesium-auth-"), "tokens.db")
+    setup = sqlite3.connect(path)
+    setup.execute("PRAGMA journal_mode=WAL")
+    setup.execute("CREATE TABLE tokens (token TEXT PRIMARY KEY, username TEXT NOT NULL, issued_at TEXT NOT NULL)")
+    setup.executemany("INSERT INTO tokens VALUES (?, 'admin', '2024-01-01T00:00:00')", [(t,) for t in tokens])
+    setup.commit()
+    local = threading.local()
+    token = tokens[len(tokens) // 2]
+
+    def lookup():
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = sqlite3.connect(path)
+        return conn.execute("SELECT username, issued_at FROM tokens WHERE token = ?", (token,)).fetchone()
+    return lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--logins", type=int, default=100000, help="stored tokens / revocations")
+    args = parser.parse_args()
+
+    sessions = SessionManager("bench-secret")
+    now = time.time()
+    for _ in range(args.logins):
+        sessions.revoke(uuid4().hex, now + 3600)
+    token = sessions.issue("admin", "admin")
+    cold = itertools.cycle([sessions.issue("admin", "admin") for _ in range(2 * VERIFIED_CACHE)])
+    lookup = sqlite_lookup([uuid4().hex for _ in range(args.logins)])
+
+    client = app.app.test_client()
+    me_headers = {"Authorization": "Bearer " + app.generate_token("admin")}
+
+    def api_me():
+        return client.get("/api/me", headers=me_headers)
+
+    print(f"{'threads':>7}  {'jwt cold us':>11}  {'jwt verify us':>13}  {'sqlite lookup us':>16}  {'/api/me us':>10}")
+    for threads in args.threads:
+        cold_us = run_threads(threads, args.requests, lambda: sessions.verify(next(cold)))
+        jwt_us = run_threads(threads, args.requests, lambda: sessions.verify(token))
+        sql_us = run_threads(threads, args.requests, lookup)
+        me_us = run_threads(threads, max(threads, args.requests // 10), api_me)
+        print(f"{threads:>7}  {cold_us:>11.1f}  {jwt_us:>13.1f}  {sql_us:>16.1f}  {me_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
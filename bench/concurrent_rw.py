@@ -0,0 +1,143 @@
+"""
+Read-heavy traffic against concurrent simulation and sample writes.
+
+    python -m bench.concurrent_rw --farms 10000 --readers 8 --duration 10 --steps 1
+
+Runs the app in this process on synthetic data. One writer thread commits
+simulations of --steps steps back to back, another posts samples to a
+fixed 1% of the farms; reader threads poll stats, zones and the farm list
+and stream /api/export. Every export is checked against two invariants a
+consistent read must hold: a committed simulation stamps every farm with
+one time, so all farms that receive no samples share one lastUpdate, and
+the summary's status counts match the statuses of the farms listed after
+it. Reports reader and writer latencies and the number of inconsistent
+exports; exits with status 1 if there were any.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from metrics import quantiles
+
+READS = [
+    ("stats", "/api/stats"),
+    ("zones", "/api/zones"),
+    ("farms", "/api/farms?include_history=false&limit=100"),
+    ("export", "/api/export?since=2999-01-01T00:00:00"),  # every farm, no history rows
+]
+STATUSES = ("Safe", "Medium", "High", "Critical")
+
+
+def check_export(doc, sampled):
+    """None if the export reads as one state, else what is off"""
+    stamps = {f["lastUpdate"] for f in doc["farms"] if f["id"] not in sampled}
+    if len(stamps) > 1:
+        return f"{len(stamps)} simulation stamps in one export"
+    counts = {s: 0 for s in STATUSES}
+    for f in doc["farms"]:
+        counts[f["status"]] += 1
+    summary = {s: doc["summary"][s.lower()] for s in STATUSES}
+    if counts != summary:
+        return f"summary counts {summary} but farms {counts}"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--farms", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=14, help="samples per synthetic farm")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--steps", type=int, default=1, help="steps per committed simulation")
+    args = parser.parse_args()
+
+    import app
+    from bench.synthetic import make_farms
+    app.load_farms(make_farms(args.farms, history_points=args.history))
+    headers = {"Authorization": "Bearer " + app.generate_token("admin")}
+    sampled = set(range(1, args.farms + 1, 100))
+    # A first commit gives every farm the same stamp, which the check relies on
+    assert app.app.test_client().get("/api/simulate?seed=0", headers=headers).status_code == 200
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies = {}
+    writes = {"simulate": [], "samples": []}
+    problems = []
+
+    def reader(i):
+        client = app.app.test_client()
+        mine = {}
+        n = i
+        while not stop.is_set():
+            label, path = READS[n % len(READS)]
+            n += 1
+            t0 = time.perf_counter()
+            resp = client.get(path, headers=headers)
+            body = resp.get_data()
+            mine.setdefault(label, []).append(time.perf_counter() - t0)
+            problem = f"HTTP {resp.status_code}" if resp.status_code != 200 else None
+            if label == "export" and problem is None:
+                problem = check_export(json.loads(body), sampled)
+            if problem:
+                with lock:
+                    problems.append(f"{label}: {problem}")
+        with lock:
+            for label, values in mine.items():
+                latencies.setdefault(label, []).extend(values)
+
+    def simulator():
+        client = app.app.test_client()
+        seed = 1
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            status = client.get(f"/api/simulate?seed={seed}&steps={args.steps}&commit=true",
+                                headers=headers).status_code
+            writes["simulate"].append(time.perf_counter() - t0)
+            if status != 200:
+                with lock:
+                    problems.append(f"simulate: HTTP {status}")
+            seed += 1
+
+    def sampler():
+        client = app.app.test_client()
+        ids = sorted(sampled)
+        n = 0
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            status = client.post("/api/samples", headers=headers, json={
+                "farm_id": ids[n % len(ids)], "value": 5 + n % 60, "inspector": "bench"}).status_code
+            writes["samples"].append(time.perf_counter() - t0)
+            if status != 200:
+                with lock:
+                    problems.append(f"samples: HTTP {status}")
+            n += 1
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    threads += [threading.Thread(target=simulator), threading.Thread(target=sampler)]
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print(f"farms={args.farms}  readers={args.readers}  duration={args.duration}s")
+    print(f"  {'request':>10}  {'count':>7}  {'p50 ms':>8}  {'p99 ms':>8}  {'max ms':>8}")
+    for label, values in sorted(latencies.items()) + sorted(writes.items()):
+        if values:
+            qs = quantiles(values)
+            print(f"  {label:>10}  {len(values):>7}  {qs[0.5] * 1000:>8.2f}  {qs[0.99] * 1000:>8.2f}"
+                  f"  {max(values) * 1000:>8.2f}")
+    exports = len(latencies.get("export", ()))
+    print(f"inconsistent or failed responses: {len(problems)} ({exports} exports checked)")
+    for problem in problems[:10]:
+        print("  " + problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
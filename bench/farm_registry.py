@@ -0,0 +1,104 @@
+"""
+Memory and lookup latency of the slotted farm registry versus plain farm dicts.
+
+    python -m bench.farm_registry --sizes 10000 100000 1000000
+
+The dict baseline reproduces the previous layout (one dict per farm, one dict
+per history sample, linear id scans, per-request lowercased status compare);
+it is skipped above --dict-max farms to keep the run within memory.
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+import app
+from bench.synthetic import iter_farms
+from registry import FarmRecord, FarmRegistry
+
+
+def measure(build):
+    """(result, bytes still allocated by build())"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, used
+
+
+def time_per_call(fn, args):
+    """Mean microseconds per call, with the collector paused as timeit does"""
+    gc.collect()
+    gc.disable()
+    try:
+        t0 = time.perf_counter()
+        for a in args:
+            fn(a)
+        return (time.perf_counter() - t0) / len(args) * 1e6
+    finally:
+        gc.enable()
+
+
+def build_registry(n, history):
+    records = []
+    for d in iter_farms(n, history_points=history):
+        farm = FarmRecord.from_dict(d)
+        app.init_farm(farm)
+        records.append(farm)
+    registry = FarmRegistry()
+    registry.load(records)
+    return registry
+
+
+def build_dicts(n, history):
+    farms = list(iter_farms(n, history_points=history))
+    for f in farms:
+        f["value"] = f["history"][-1]["value"]
+        f["value_bq"] = app.ppb_to_bq(f["value"])
+        f["status"] = app.get_status(f["value"])
+        f["lastUpdate"] = f["history"][-1]["time"]
+        f["export_ready"] = f["status"] in ["Safe", "Medium"]
+        f["zone"] = app.closest_zone_id(f["lat"], f["lng"])
+    return farms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--history", type=int, default=14, help="samples kept per farm")
+    parser.add_argument("--dict-max", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'farms':>8}  {'layout':>8}  {'MB':>8}  {'B/farm':>7}  {'get(id) us':>11}  "
+          f"{'status=high us':>15}  {'serialize us':>13}")
+    for n in args.sizes:
+        rng = random.Random(n)
+        ids = [rng.randint(1, n) for _ in range(2000)]
+
+        registry, used = measure(lambda: build_registry(n, args.history))
+        get_us = time_per_call(registry.get, ids)
+        filter_us = time_per_call(lambda s: registry.select(status=s), ["HIGH"] * 20)
+        ser_us = time_per_call(lambda fid: registry.get(fid).to_dict(), ids[:500])
+        print(f"{n:>8}  {'slots':>8}  {used / 2**20:>8.1f}  {used / n:>7.0f}  {get_us:>11.2f}  "
+              f"{filter_us:>15.0f}  {ser_us:>13.2f}")
+        del registry
+
+        if n > args.dict_max:
+            print(f"{n:>8}  {'dicts':>8}  {'(skipped, above --dict-max)':>45}")
+            continue
+        farms, used = measure(lambda: build_dicts(n, args.history))
+        scan = lambda fid: next((f for f in farms if f["id"] == fid), None)
+        get_us = time_per_call(scan, ids[:max(5, 2000000 // n)])
+        filter_us = time_per_call(
+            lambda s: [f for f in farms if f["status"].lower() == s.lower()], ["HIGH"] * 20)
+        print(f"{n:>8}  {'dicts':>8}  {used / 2**20:>8.1f}  {used / n:>7.0f}  {get_us:>11.2f}  "
+              f"{filter_us:>15.0f}  {'-':>13}")
+        del farms
+
+
+if __name__ == "__main__":
+    main()
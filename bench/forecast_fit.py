@@ -0,0 +1,65 @@
+"""
+Fit and predict throughput of the batched forecast engine.
+
+    python -m bench.forecast_fit --sizes 1000 10000 100000 --history 30 --horizon 7
+
+For each series count it reports the batch fit of every history, the cost of
+folding in single new readings, one cold forecast of every series (batched
+AR solves plus Holt projections) and the cached repeat.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from forecast import ForecastEngine
+
+
+def synthetic_series(n, length, seed=0):
+    """n AR(1)-ish series around random farm baselines"""
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(12, 60, n)
+    phi = rng.uniform(0.0, 0.8, n)
+    y = np.empty((n, length))
+    y[:, 0] = base
+    for t in range(1, length):
+        y[:, t] = base + phi * (y[:, t - 1] - base) + rng.normal(0, 3, n)
+    return {i + 1: row.tolist() for i, row in enumerate(np.round(y, 2))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--history", type=int, default=30, help="samples per series")
+    parser.add_argument("--horizon", type=int, default=7)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'series':>8}  {'fit s':>7}  {'add us':>7}  {'forecast s':>10}  {'cached us':>9}  {'ar share':>8}")
+    for n in args.sizes:
+        series = synthetic_series(n, args.history)
+        engine = ForecastEngine()
+        t0 = time.perf_counter()
+        engine.load(series)
+        fit = time.perf_counter() - t0
+
+        rng = np.random.default_rng(n)
+        keys = rng.integers(1, n + 1, args.updates).tolist()
+        values = rng.uniform(5, 70, args.updates).round(2).tolist()
+        t0 = time.perf_counter()
+        for key, value in zip(keys, values):
+            engine.add(key, value)
+        add_us = (time.perf_counter() - t0) / args.updates * 1e6
+
+        t0 = time.perf_counter()
+        result = engine.forecast(args.horizon)
+        cold = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        engine.forecast(args.horizon)
+        cached_us = (time.perf_counter() - t0) * 1e6
+        ar_share = float(np.mean(result.model == "ar"))
+        print(f"{n:>8}  {fit:>7.2f}  {add_us:>7.1f}  {cold:>10.2f}  {cached_us:>9.1f}  {ar_share:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Heatmap payload size and cost: per-farm points versus level-of-detail cells.
+
+    python -m bench.heatmap_lod --sizes 1000 10000 100000
+
+For each farm count it reports the bytes of the legacy /api/heatmap body and of
+the cell responses for a national view (zoom 5), a Java view (zoom 8) and one
+tile, plus build time per query and the incremental cost of a sample.
+"""
+import argparse
+import random
+import time
+
+import app
+from bench.synthetic import make_farms
+
+VIEWS = [
+    ("national z5", "/api/heatmap?bbox=-11,94,7,142&zoom=5"),
+    ("java z8", "/api/heatmap?bbox=-8.8,105,-5.8,115&zoom=8"),
+    ("tile 8/203/132", "/api/heatmap/tiles/8/203/132"),
+]
+
+
+def timed_get(client, path):
+    """(body bytes, ms) for an uncached GET"""
+    app.bump_data_version()
+    t0 = time.perf_counter()
+    body = client.get(path).data
+    return len(body), (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    client = app.app.test_client()
+    print(f"{'farms':>8}  {'view':>15}  {'bytes':>10}  {'ms':>8}")
+    for n in args.sizes:
+        app.load_farms(make_farms(n, history_points=1))
+        size, ms = timed_get(client, "/api/heatmap")
+        print(f"{n:>8}  {'points (legacy)':>15}  {size:>10}  {ms:>8.1f}")
+        for label, path in VIEWS:
+            size, ms = timed_get(client, path)
+            print(f"{n:>8}  {label:>15}  {size:>10}  {ms:>8.1f}")
+
+        farms = list(app.FARMS)
+        rng = random.Random(n)
+        picks = [rng.choice(farms) for _ in range(2000)]
+        t0 = time.perf_counter()
+        for f in picks:
+            f.value = round(rng.uniform(0, 72), 2)
+            app.HEAT_GRID.upsert(f)
+        us = (time.perf_counter() - t0) / len(picks) * 1e6
+        print(f"{n:>8}  {'grid upsert':>15}  {'':>10}  {us / 1000:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+/api/farms body encoding: stdlib json versus orjson and per-farm fragments.
+
+    python -m bench.json_encoding --sizes 100 1000 10000 --history 30
+
+For each farm count it times building the full list body (farms with
+history) the old way (to_dict + stdlib json, as Flask's default provider
+did), with serialization.dumps, from cold FRAGMENTS, and from warm
+FRAGMENTS after a single farm changed; plus the include_history=false body.
+"""
+import argparse
+import json
+import time
+
+import app
+import serialization
+from bench.synthetic import make_farms
+from registry import FarmRecord
+
+
+def best_ms(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        body = fn()
+        best = min(best, time.perf_counter() - t0)
+    return len(body), best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--history", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"encoder: {serialization.ENCODER}")
+    print(f"{'farms':>7}  {'variant':>22}  {'bytes':>10}  {'ms':>8}")
+    summary = FarmRecord.DICT_FIELDS[:-1]
+    for n in args.sizes:
+        app.load_farms(make_farms(n, history_points=args.history))
+        farms = list(app.FARMS)
+
+        def stdlib():
+            return json.dumps([f.to_dict() for f in farms], sort_keys=True, separators=(",", ":")).encode()
+
+        def dumps():
+            return serialization.dumps([f.to_dict() for f in farms], sort_keys=True)
+
+        def cold_fragments():
+            app.FRAGMENTS.clear()
+            return serialization.join_array([app.farm_fragment(f) for f in farms])
+
+        def warm_fragments():
+            app.FRAGMENTS.invalidate(farms[0].id)
+            return serialization.join_array([app.farm_fragment(f) for f in farms])
+
+        def warm_summary():
+            app.FRAGMENTS.invalidate(farms[0].id)
+            return serialization.join_array([app.farm_fragment(f, summary) for f in farms])
+
+        for label, fn in (("stdlib json (old)", stdlib), ("dumps", dumps), ("fragments cold", cold_fragments),
+                          ("fragments, 1 changed", warm_fragments), ("include_history=false", warm_summary)):
+            size, ms = best_ms(fn, args.repeat)
+            print(f"{n:>7}  {label:>22}  {size:>10}  {ms:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Throughput of the app under gunicorn with 1..N worker processes, plus a cross-worker consistency check.
+
+    python -m bench.load_workers --workers 1 2 4 --duration 10 --clients 4 --threads 8
+
+Each run starts gunicorn on a fresh CESIUM_DATA_DIR, drives a read-heavy mix
+(farms, stats, zones, farm detail) with --write-ratio POST /api/samples from
+--clients processes x --threads keep-alive connections, then asks every worker
+for /api/farms and /api/stats and checks that they agree and that every
+accepted sample is present.
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READS = ["/api/farms", "/api/stats", "/api/zones", "/api/farm/{id}", "/api/farms?status=high"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(conn, method, path, body=None, token=None):
+    headers = {"Authorization": "Bearer " + token} if token else {}
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+        body = json.dumps(body)
+    conn.request(method, path, body=body, headers=headers)
+    resp = conn.getresponse()
+    return resp.status, resp.read()
+
+
+def start_server(workers, threads, port, data_dir):
+    env = dict(os.environ, CESIUM_DATA_DIR=data_dir)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+         "--worker-class", "gthread", "--threads", str(threads), "--log-level", "warning", "app:create_app()"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            if request(conn, "GET", "/health")[0] == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError("gunicorn did not become healthy")
+
+
+def stop_server(proc):
+    os.killpg(proc.pid, signal.SIGTERM)
+    proc.wait(timeout=30)
+
+
+def client(args):
+    """One client process: `threads` connections looping until the deadline"""
+    port, token, threads, deadline, write_ratio, seed = args
+    latencies = []
+    writes = [0]
+    errors = [0]
+    lock = threading.Lock()
+
+    def loop(i):
+        rng = random.Random(seed * 1000 + i)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine = []
+        ok_writes = 0
+        failed = 0
+        while time.time() < deadline:
+            t0 = time.perf_counter()
+            if rng.random() < write_ratio:
+                status, _ = request(conn, "POST", "/api/samples", token=token, body={
+                    "farm_id": rng.randint(1, 27), "value": round(rng.uniform(5, 70), 2), "inspector": "bench"})
+                ok_writes += status == 200
+            else:
+                status, _ = request(conn, "GET", rng.choice(READS).format(id=rng.randint(1, 27)), token=token)
+            mine.append(time.perf_counter() - t0)
+            failed += status != 200
+        with lock:
+            latencies.extend(mine)
+            writes[0] += ok_writes
+            errors[0] += failed
+
+    pool = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies, writes[0], errors[0]
+
+
+def consistency(port, token, probes=24):
+    """(distinct /api/farms bodies, distinct stats, total samples) seen over fresh connections"""
+    farms_bodies, stats_bodies, totals = set(), set(), set()
+    for _ in range(probes):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        _, body = request(conn, "GET", "/api/farms", token=token)
+        farms = json.loads(body)
+        farms_bodies.add(hashlib.sha1(body).hexdigest())
+        totals.add(sum(len(f["history"]) for f in farms))
+        _, body = request(conn, "GET", "/api/stats", token=token)
+        stats = json.loads(body)
+        stats_bodies.add(tuple(stats[k] for k in ("total", "avg", "safe", "medium", "high", "critical")))
+        conn.close()
+    return len(farms_bodies), len(stats_bodies), totals
+
+
+def run(workers, args):
+    data_dir = tempfile.mkdtemp(prefix="cesium-load-")
+    port = free_port()
+    proc = start_server(workers, args.threads, port, data_dir)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        _, body = request(conn, "POST", "/api/login", body={"username": "admin", "password": "secureadmin"})
+        token = json.loads(body)["token"]
+        _, body = request(conn, "GET", "/api/farms", token=token)
+        seeded = sum(len(f["history"]) for f in json.loads(body))
+
+        deadline = time.time() + args.duration
+        jobs = [(port, token, args.threads, deadline, args.write_ratio, c) for c in range(args.clients)]
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.map(client, jobs)
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(x for r in results for x in r[0])
+        writes = sum(r[1] for r in results)
+        errors = sum(r[2] for r in results)
+        time.sleep(1.0)  # let every worker's sync thread apply the last writes
+        farm_views, stat_views, totals = consistency(port, token)
+        return {
+            "rps": len(latencies) / elapsed,
+            "p50": latencies[len(latencies) // 2] * 1000,
+            "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+            "writes": writes,
+            "errors": errors,
+            "consistent": farm_views == 1 and stat_views == 1 and totals == {seeded + writes}
+        }
+    finally:
+        stop_server(proc)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--threads", type=int, default=8, help="connections per client, and gunicorn threads per worker")
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()}  clients={args.clients}x{args.threads}  write_ratio={args.write_ratio}")
+    print(f"{'workers':>7}  {'req/s':>8}  {'p50 ms':>7}  {'p95 ms':>7}  {'writes':>7}  {'errors':>6}  consistent")
+    for n in args.workers:
+        r = run(n, args)
+        print(f"{n:>7}  {r['rps']:>8.0f}  {r['p50']:>7.1f}  {r['p95']:>7.1f}  {r['writes']:>7}  "
+              f"{r['errors']:>6}  {'yes' if r['consistent'] else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Helper microbenchmarks plus the polling mix, checked against a stored baseline.
+
+    python -m bench.regression                      # compare with bench/baseline.json
+    python -m bench.regression --update             # record a new baseline on this machine
+
+Runs bench.helpers, the polling endpoints as RESPONSE_CACHE misses, single
+sample posts, a committing one-step simulation and bench.api_load (with
+writes) at one configuration and compares every metric with the baseline:
+latencies regress when they grow by more than --tolerance, throughput when
+it drops by more than --tolerance. Exits with status 1 on any regression,
+so it can gate CI. Baselines are only comparable on the hardware that
+recorded them: the baseline stores the CPU model and count, and on other
+hardware the comparison is printed but the gate is skipped (exit 0).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from bench import api_load, helpers
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+CONFIG_KEYS = ("farms", "history", "concurrency", "duration", "write_ratio")
+
+
+def hardware():
+    """What the timings depend on besides the code: CPU model and count, architecture, Python"""
+    model = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            model = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), model)
+    except OSError:
+        pass
+    return {"cpu": model, "cpus": os.cpu_count(), "machine": platform.machine(),
+            "python": platform.python_version()}
+
+
+def best_ms(call, method, path, body=None, repeat=9, setup=None):
+    """Best ms of `repeat` requests (a single request is at the mercy of GC); setup() runs before each, untimed"""
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        status = call(method, path, body)
+        best = min(best, time.perf_counter() - t0)
+        if status >= 400:
+            raise RuntimeError(f"{method} {path}: HTTP {status}")
+    return best * 1000
+
+
+def collect(args):
+    """{metric name: value}; names ending in req_s are higher-is-better, the rest are times"""
+    import app
+    results = {}
+    for name, us in helpers.measure(args.farms, args.history).items():
+        results[f"helpers.{name}.us"] = us
+    transport = api_load.LocalTransport(0, args.history)  # reuses the farms helpers.measure loaded
+    call = transport.session()
+    for label, path in api_load.POLL:
+        results[f"miss.{label}.ms"] = best_ms(call, "GET", path, setup=app.bump_data_version)
+    results["write.samples.ms"] = best_ms(call, "POST", "/api/samples",
+                                          {"farm_id": 1, "value": 21.5, "inspector": "bench"})
+    results["simulate.commit_ms"] = best_ms(call, "GET", "/api/simulate?seed=0&commit=true")
+    mix = api_load.run_mix(transport, args.concurrency, args.duration, write_ratio=args.write_ratio)
+    results["load.req_s"] = mix["req_s"]
+    for label, row in mix["endpoints"].items():
+        results[f"load.{label}.p50_ms"] = row["p50"]
+        results[f"load.{label}.p95_ms"] = row["p95"]
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """[(name, base, now, change, regressed)] for every metric in both"""
+    rows = []
+    for name, base in sorted(baseline.items()):
+        if name not in results or not base:
+            continue
+        now = results[name]
+        change = now / base - 1
+        regressed = change < -tolerance if name.endswith("req_s") else change > tolerance
+        rows.append((name, base, now, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--farms", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=14)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.02, help="POST /api/samples per poll in the mix")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative change")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in CONFIG_KEYS}
+    if args.update:
+        results = collect(args)
+        with open(args.baseline, "w") as f:
+            json.dump({"config": config, "hardware": hardware(),
+                       "metrics": {k: round(v, 3) for k, v in results.items()}}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline} ({len(results)} metrics)")
+        return 0
+
+    with open(args.baseline) as f:
+        stored = json.load(f)
+    if stored["config"] != config:
+        print(f"baseline was recorded with {stored['config']}, this run uses {config}")
+        return 2
+    skip = stored.get("hardware") != hardware()
+    if skip:
+        print(f"baseline was recorded on {stored.get('hardware')}, this machine is {hardware()}")
+    results = collect(args)
+    rows = compare(results, stored["metrics"], args.tolerance)
+    print(f"{'metric':>36}  {'baseline':>10}  {'now':>10}  {'change':>8}")
+    for name, base, now, change, regressed in rows:
+        print(f"{name:>36}  {base:>10.2f}  {now:>10.2f}  {change:>+8.0%}{'  REGRESSION' if regressed else ''}")
+    failed = [row[0] for row in rows if row[4]]
+    print(f"{len(failed)} regression(s) beyond {args.tolerance:.0%}" if failed else "no regressions")
+    if skip:
+        print("different hardware: gate skipped, record a baseline here with --update")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Spatial index queries against a linear scan, up to national-scale farm counts.
+
+    python -m bench.spatial_query --sizes 10000 100000 1000000 --radius 10 --k 10 --box 0.2
+
+For each farm count it indexes the synthetic farm positions in a GridIndex
+with the registry's cell size (the index behind /api/farms/near), then
+times radius (--radius km), k-nearest (--k) and bounding-box (--box degrees
+square) queries around random farms, one incremental move, and the same
+queries as a haversine scan over every farm. Every index answer is checked
+against the scan; exits with status 1 on a mismatch.
+"""
+import argparse
+import random
+import sys
+import time
+
+from bench.synthetic import iter_farms
+from geo import GridIndex, haversine_km
+from registry import SPATIAL_CELL_DEG
+
+
+def per_call_us(fn, args_list):
+    t0 = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - t0) / len(args_list) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--radius", type=float, default=10, help="radius query, km")
+    parser.add_argument("--k", type=int, default=10, help="k-nearest query")
+    parser.add_argument("--box", type=float, default=0.2, help="bounding-box side, degrees")
+    parser.add_argument("--queries", type=int, default=500, help="index queries per kind")
+    parser.add_argument("--scans", type=int, default=5, help="linear-scan queries per kind (checked)")
+    args = parser.parse_args()
+
+    problems = 0
+    print(f"cell_deg={SPATIAL_CELL_DEG}  radius={args.radius} km  k={args.k}  box={args.box} deg")
+    print(f"{'farms':>8}  {'build s':>7}  {'query':>7}  {'index us':>9}  {'scan us':>11}  {'speedup':>8}  {'hits':>6}")
+    for n in args.sizes:
+        points = [(f["id"], f["lat"], f["lng"]) for f in iter_farms(n, history_points=0)]
+        t0 = time.perf_counter()
+        index = GridIndex(cell_deg=SPATIAL_CELL_DEG)
+        for key, lat, lng in points:
+            index.insert(key, lat, lng)
+        build = time.perf_counter() - t0
+
+        rnd = random.Random(n)
+        centres = [(lat + rnd.uniform(-0.05, 0.05), lng + rnd.uniform(-0.05, 0.05))
+                   for _, lat, lng in rnd.sample(points, args.queries)]
+        half = args.box / 2
+        kinds = {
+            "radius": (lambda lat, lng: sorted((d, key) for key, d in index.within(lat, lng, args.radius)),
+                       lambda lat, lng: sorted(dk for dk in ((haversine_km(lat, lng, plat, plng), key)
+                                                             for key, plat, plng in points) if dk[0] <= args.radius)),
+            "knn": (lambda lat, lng: [(d, key) for key, d in index.nearest_k(lat, lng, args.k)],
+                    lambda lat, lng: sorted((haversine_km(lat, lng, plat, plng), key)
+                                            for key, plat, plng in points)[:args.k]),
+            "bbox": (lambda lat, lng: sorted(index.in_bbox(lat - half, lng - half, lat + half, lng + half)),
+                     lambda lat, lng: sorted(key for key, plat, plng in points
+                                             if lat - half <= plat <= lat + half and lng - half <= plng <= lng + half)),
+        }
+        first = True
+        for kind, (query, scan) in kinds.items():
+            index_us = per_call_us(query, centres)
+            scan_us = per_call_us(scan, centres[:args.scans])
+            hits = sum(len(query(*c)) for c in centres) / len(centres)
+            for c in centres[:args.scans]:
+                if query(*c) != scan(*c):
+                    problems += 1
+                    print(f"  mismatch: {kind} at {c}")
+            label = f"{n:>8}  {build:>7.2f}" if first else f"{'':>8}  {'':>7}"
+            print(f"{label}  {kind:>7}  {index_us:>9.1f}  {scan_us:>11.0f}  {scan_us / index_us:>7.0f}x  {hits:>6.1f}")
+            first = False
+        moves = [(key, lat + 0.01, lng - 0.01) for key, lat, lng in rnd.sample(points, args.queries)]
+        print(f"{'':>8}  {'':>7}  {'move':>7}  {per_call_us(index.insert, moves):>9.1f}")
+    if problems:
+        print(f"{problems} index answer(s) differ from the scan")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Worker startup time: module import, log replay and checkpoint restore.
+
+    python -m bench.startup --sizes 1000 10000 100000 --history 14
+
+For each farm count it prepares a CESIUM_DATA_DIR whose shared log holds
+the synthetic registry, then starts fresh interpreter processes that import
+app and call start(), the way a gunicorn worker boots: once replaying the
+log (checkpoint removed) and once restoring the replica checkpoint. Each
+boot reports import and start() time and a digest of /api/stats and
+/api/zones, which must match between the two paths.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PREPARE = """
+import app
+from bench.synthetic import make_farms
+app.load_farms(make_farms({n}, history_points={history}))
+app.SHARED.save_checkpoint()
+"""
+
+BOOT = """
+import hashlib, json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.start()
+t2 = time.perf_counter()
+c = app.app.test_client()
+body = c.get("/api/stats").get_data() + c.get("/api/zones").get_data()
+digest = hashlib.sha1(body.replace(b"\\n", b"")).hexdigest()[:12]
+print(json.dumps({"import": t1 - t0, "start": t2 - t1, "farms": len(app.FARMS), "digest": digest}))
+"""
+
+
+def run(code, data_dir):
+    env = dict(os.environ, CESIUM_DATA_DIR=data_dir, PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1]) if out.strip() else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--history", type=int, default=14, help="samples per farm")
+    parser.add_argument("--repeat", type=int, default=3, help="boots per path (best is reported)")
+    args = parser.parse_args()
+
+    print(f"{'farms':>8}  {'path':>10}  {'import s':>8}  {'start s':>8}  {'ready s':>8}  {'digest':>12}")
+    for n in args.sizes:
+        data_dir = tempfile.mkdtemp(prefix="cesium-startup-")
+        try:
+            run(PREPARE.format(n=n, history=args.history), data_dir)
+            checkpoint = os.path.join(data_dir, "state.db.replica")
+            saved = checkpoint + ".saved"
+            os.replace(checkpoint, saved)
+            for path in ("replay", "checkpoint"):
+                best = None
+                for _ in range(args.repeat):
+                    if path == "checkpoint":
+                        shutil.copyfile(saved, checkpoint)
+                    elif os.path.exists(checkpoint):
+                        os.remove(checkpoint)  # a slow replay writes one for the next boot
+                    boot = run(BOOT, data_dir)
+                    if best is None or boot["import"] + boot["start"] < best["import"] + best["start"]:
+                        best = boot
+                assert best["farms"] == n, best
+                print(f"{n:>8}  {path:>10}  {best['import']:>8.3f}  {best['start']:>8.3f}"
+                      f"  {best['import'] + best['start']:>8.3f}  {best['digest']:>12}")
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Deterministic synthetic farm registry spread along the ZONES_META coastlines"""
+import random
+from datetime import datetime, timedelta
+
+INSPECTORS = ["Asep", "Siti", "Tono", "Budi", "Ani", "Dewi", "Eko"]
+CERTIFICATIONS = [["HACCP", "BAP"], ["HACCP"], ["BAP", "CBIB"], ["HACCP", "BAP", "CBIB"]]
+
+
+def make_farms(n, history_points=14, seed=0, zones=None, now=None):
+    """Build n farm dicts in the API shape, each with history_points daily samples"""
+    return list(iter_farms(n, history_points, seed, zones, now))
+
+
+def iter_farms(n, history_points=14, seed=0, zones=None, now=None):
+    """Generator form of make_farms, for sizes that should not be held as dicts all at once"""
+    if zones is None:
+        from app import ZONES_META
+        zones = ZONES_META
+    rng = random.Random(seed)
+    now = now or datetime.utcnow()
+    centers = [(zid, meta["center"]) for zid, meta in sorted(zones.items())]
+    times = [(now - timedelta(days=history_points - d - 1)).isoformat() for d in range(history_points)]
+    for i in range(n):
+        zid, (clat, clng) = centers[i % len(centers)]
+        base = rng.uniform(12, 45) if rng.random() > 0.15 else rng.uniform(40, 75)
+        history = [{
+            "time": t,
+            "inspector": rng.choice(INSPECTORS),
+            "value": round(max(0, base + rng.uniform(-6, 6)), 2),
+            "notes": ""
+        } for t in times]
+        yield {
+            "id": i + 1,
+            "name": f"Synthetic Farm {i + 1}",
+            "location": f"{zid} #{i + 1}",
+            "lat": round(clat + rng.uniform(-1.5, 1.5), 4),
+            "lng": round(clng + rng.uniform(-1.5, 1.5), 4),
+            "operator": f"Operator {i % 97}",
+            "capacity": f"{rng.randint(4, 25)} ha",
+            "history": history,
+            "certifications": list(rng.choice(CERTIFICATIONS))
+        }
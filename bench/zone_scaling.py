@@ -0,0 +1,56 @@
+"""
+How the zone-dependent endpoints scale with farm count.
+
+    python -m bench.zone_scaling --sizes 1000 10000 50000
+
+The data version is bumped before every timed call, so each one is a
+RESPONSE_CACHE miss that computes its body.
+"""
+import argparse
+import time
+
+import app
+from bench.synthetic import make_farms
+
+ENDPOINTS = [
+    ("GET", "/api/zones"),
+    ("GET", "/api/farms?zone=pantura_java"),
+    ("GET", "/api/intel"),
+    ("GET", "/api/simulate?commit=false"),
+    ("GET", "/api/simulate?commit=true"),
+]
+
+
+def time_call(fn, repeat, setup=None):
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    client = app.app.test_client()
+    headers = {"Authorization": "Bearer " + app.generate_token("admin")}
+    lat, lng = -6.2, 106.8
+
+    print(f"{'farms':>8}  {'closest_zone_id':>16}" + "".join(f"  {path:>30}" for _, path in ENDPOINTS))
+    for n in args.sizes:
+        app.load_farms(make_farms(n))
+        row = [time_call(lambda: app.closest_zone_id(lat, lng), 1000) * 1000]
+        for method, path in ENDPOINTS:
+            row.append(time_call(lambda: client.open(path, method=method, headers=headers), args.repeat,
+                                 setup=app.bump_data_version))
+        print(f"{n:>8}  {row[0]:>13.2f} us" + "".join(f"  {ms:>27.1f} ms" for ms in row[1:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from collections import deque
+from itertools import islice
+
+from serialization import dumps
+
+
+def sse_frame(kind, data, seq=None):
+    """Encode one Server-Sent Events frame; dumps() output is compact, so the data is one line"""
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {kind}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+
+class EventBroker:
+    """
+    Fan-out of live events to /api/stream subscribers.
+    Each event is encoded once into a bounded ring of (seq, kind, frame). A
+    subscriber is only its last-seen sequence number, so the broker keeps no
+    per-connection queue or thread; publish cost does not grow with the
+    number of open streams.
+    Event ids are "<instance>-<seq>", so a Last-Event-ID issued by another
+    worker process is recognised as foreign instead of misread as a cursor.
+    Async subscribers (wait_async) share one future per event loop.
+    """
+
+    def __init__(self, maxlen=512, instance=""):
+        self.instance = instance
+        self.seq = 0
+        self._ring = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self._loops = {}  # event loop -> future resolved by the next publish
+
+    def publish(self, kind, data):
+        with self._cond:
+            self.seq += 1
+            self._ring.append((self.seq, kind, sse_frame(kind, data, self.event_id(self.seq))))
+            self._cond.notify_all()
+            for loop, future in self._loops.items():
+                try:
+                    loop.call_soon_threadsafe(_resolve, future)
+                except RuntimeError:  # loop already closed
+                    pass
+            self._loops.clear()
+            return self.seq
+
+    def event_id(self, seq):
+        return f"{self.instance}-{seq}" if self.instance else seq
+
+    def cursor(self, event_id):
+        """Sequence number from a Last-Event-ID header, None unless this broker issued it"""
+        instance, _, seq = (event_id or "").rpartition("-")
+        return int(seq) if instance == self.instance and seq.isdigit() else None
+
+    def since(self, cursor):
+        """Frames published after cursor, or None if the cursor fell off the ring"""
+        with self._cond:
+            if cursor >= self.seq:
+                return []
+            if not self._ring or self._ring[0][0] > cursor + 1:
+                return None
+            return list(islice(self._ring, cursor + 1 - self._ring[0][0], None))
+
+    def wait(self, cursor, timeout):
+        """Block until something newer than cursor is published (or timeout)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > cursor, timeout)
+        return self.since(cursor)
+
+    async def wait_async(self, cursor, timeout):
+        """wait() for a coroutine: suspends on the event loop instead of holding a thread"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            future = None
+            if self.seq <= cursor:
+                future = self._loops.get(loop)
+                if future is None:
+                    future = self._loops[loop] = loop.create_future()
+        if future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.since(cursor)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,42 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Pre-serialized GET response bodies keyed by (endpoint, query args, data version).
+    Writers call bump() after mutating farm data; every entry built for an
+    older version becomes unreachable and is dropped. Each entry carries a
+    strong ETag derived from its bytes.
+    """
+
+    def __init__(self, max_entries=512):
+        self.version = 0
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            return self.version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, version):
+        """Store body under key if version is still current; returns (etag, body) either way"""
+        etag = '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+        entry = (etag, body)
+        with self._lock:
+            if version == self.version:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
@@ -0,0 +1,274 @@
+"""
+Sampling dispatcher: overdue farms in priority order.
+
+A farm is overdue once its last sample is older than the SLA. Its priority
+at time t is
+
+    value + w_zone * zone severity level + w_hour * hours since last sample
+
+The time term grows at the same rate for every farm, so the order never
+changes between writes: farms are ranked by the time-free part
+(value + w_zone * level - w_hour * hours at last sample) and the common
+term is added back only when a priority is reported. Rankings are sorted
+lists (as in aggregates.py), one for all overdue farms plus one per zone
+and per inspector, so a page is a slice and never touches the farm count.
+
+Farms inside the SLA wait in an hour-bucketed timer wheel keyed by their
+deadline; advance(now) moves only the farms whose deadline has passed.
+A farm is re-ranked when it is sampled or simulated (upsert) or when its
+zone changes severity level (set_zone_level). Overdue farms are also kept in
+a spatial grid so routes pick up nearby farms without scanning the queue.
+"""
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+from geo import GridIndex
+
+HOUR_US = 3600 * 10**6
+SLA_HOURS = 36
+W_ZONE = 10.0  # ppb-equivalent per zone severity level (Safe=0 .. Critical=3)
+W_HOUR = 0.5   # ppb-equivalent per hour since the last sample
+
+
+class Dispatcher:
+    def __init__(self, sla_hours=SLA_HOURS, w_zone=W_ZONE, w_hour=W_HOUR):
+        self.sla_us = sla_hours * HOUR_US
+        self.w_zone = w_zone
+        self.w_hour = w_hour
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.clock = 0          # latest time passed to advance(), epoch us
+        self.farms = {}         # farm id -> (value, updated us, zone, inspector, lat, lng)
+        self.zone_level = {}    # zone -> severity level
+        self.zone_members = {}  # zone -> farm ids
+        self.keys = {}          # overdue farm id -> rank key in the queues
+        self.queue = []         # rank keys (-time-free priority, farm id), all overdue farms
+        self.by_zone = {}       # zone -> rank keys
+        self.by_inspector = {}  # inspector -> rank keys
+        self.deadline = {}      # pending farm id -> deadline us
+        self._wheel = {}        # deadline hour -> pending farm ids
+        self._hours = []        # heap of hours present in _wheel
+        self.spatial = GridIndex(cell_deg=0.5)  # positions of overdue farms, for routes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of overdue farms"""
+        return len(self.queue)
+
+    # -- writes --------------------------------------------------------------
+
+    def upsert(self, fid, value, updated_us, zone, inspector, lat, lng):
+        """Add or refresh a farm after a sample, simulation step or move"""
+        with self._lock:
+            self._remove(fid)
+            self.farms[fid] = (value, updated_us, zone, inspector, lat, lng)
+            self.zone_members.setdefault(zone, set()).add(fid)
+            deadline = updated_us + self.sla_us
+            if deadline <= self.clock:
+                self._enqueue(fid)
+            else:
+                self._wait(fid, deadline)
+
+    def upsert_many(self, rows):
+        """
+        upsert() of many (fid, value, updated_us, zone, inspector, lat, lng) rows.
+        Past a quarter of the farms the overdue queues are filtered once and the
+        new rank keys merged in with one sort, instead of an O(n) insort per farm.
+        """
+        if len(rows) * 4 < len(self.farms):
+            for row in rows:
+                self.upsert(*row)
+            return
+        with self._lock:
+            dequeued = set()
+            for row in rows:
+                fid = row[0]
+                old = self.farms.pop(fid, None)
+                if old is None:
+                    continue
+                self.zone_members[old[2]].discard(fid)
+                if fid in self.keys:
+                    del self.keys[fid]
+                    self.spatial.remove(fid)
+                    dequeued.add(fid)
+                else:
+                    deadline = self.deadline.pop(fid)
+                    self._wheel[deadline // HOUR_US].discard(fid)
+            if dequeued:
+                for ranked in (self.queue, *self.by_zone.values(), *self.by_inspector.values()):
+                    ranked[:] = [key for key in ranked if key[1] not in dequeued]
+            overdue = False
+            waiting = {}  # deadline hour -> farm ids; a batch usually shares one
+            for fid, value, updated_us, zone, inspector, lat, lng in rows:
+                self.farms[fid] = (value, updated_us, zone, inspector, lat, lng)
+                self.zone_members.setdefault(zone, set()).add(fid)
+                deadline = updated_us + self.sla_us
+                if deadline <= self.clock:
+                    self._enqueue(fid, insert=False)
+                    overdue = True
+                else:
+                    self.deadline[fid] = deadline
+                    waiting.setdefault(deadline // HOUR_US, []).append(fid)
+            for hour, fids in waiting.items():
+                bucket = self._wheel.get(hour)
+                if bucket is None:
+                    bucket = self._wheel[hour] = set()
+                    heapq.heappush(self._hours, hour)
+                bucket.update(fids)
+            if overdue:
+                for ranked in (self.queue, *self.by_zone.values(), *self.by_inspector.values()):
+                    ranked.sort()  # sorted runs plus an appended tail: a merge
+
+    def discard(self, fid):
+        with self._lock:
+            self._remove(fid)
+
+    def set_zone_level(self, zone, level):
+        """Record a zone's severity level; re-ranks its overdue farms when the level changed"""
+        with self._lock:
+            if self.zone_level.get(zone) == level:
+                return
+            self.zone_level[zone] = level
+            for fid in self.zone_members.get(zone, ()):
+                if fid in self.keys:
+                    self._dequeue(fid)
+                    self._enqueue(fid)
+
+    def advance(self, now_us):
+        """Move every farm whose deadline is at or before now_us into the overdue queues"""
+        with self._lock:
+            self.clock = max(self.clock, now_us)
+            hour_now = now_us // HOUR_US
+            while self._hours and self._hours[0] <= hour_now:
+                hour = self._hours[0]
+                bucket = self._wheel[hour]
+                for fid in [f for f in bucket if self.deadline[f] <= now_us]:
+                    bucket.discard(fid)
+                    del self.deadline[fid]
+                    self._enqueue(fid)
+                if bucket and hour == hour_now:
+                    break  # the rest of this hour is still inside the SLA
+                heapq.heappop(self._hours)
+                del self._wheel[hour]
+
+    def _remove(self, fid):
+        old = self.farms.pop(fid, None)
+        if old is None:
+            return
+        self.zone_members[old[2]].discard(fid)
+        if fid in self.keys:
+            self._dequeue(fid, old)
+        else:
+            deadline = self.deadline.pop(fid)
+            self._wheel[deadline // HOUR_US].discard(fid)
+
+    def _wait(self, fid, deadline):
+        self.deadline[fid] = deadline
+        hour = deadline // HOUR_US
+        bucket = self._wheel.get(hour)
+        if bucket is None:
+            bucket = self._wheel[hour] = set()
+            heapq.heappush(self._hours, hour)
+        bucket.add(fid)
+
+    def _enqueue(self, fid, insert=True):
+        """Rank an overdue farm; insert=False appends the key and leaves the queues for the caller to sort"""
+        value, updated_us, zone, inspector = self.farms[fid][:4]
+        static = value + self.w_zone * self.zone_level.get(zone, 0) - self.w_hour * updated_us / HOUR_US
+        key = (-round(static, 6), fid)  # rounded so equal priorities tie-break on id
+        self.keys[fid] = key
+        add = insort if insert else list.append
+        add(self.queue, key)
+        add(self.by_zone.setdefault(zone, []), key)
+        add(self.by_inspector.setdefault(inspector, []), key)
+        self.spatial.insert(fid, *self.farms[fid][4:6])
+
+    def _dequeue(self, fid, farm=None):
+        key = self.keys.pop(fid)
+        zone, inspector = (farm or self.farms[fid])[2:4]
+        for ranked in (self.queue, self.by_zone[zone], self.by_inspector[inspector]):
+            del ranked[bisect_left(ranked, key)]
+        self.spatial.remove(fid)
+
+    # -- reads ---------------------------------------------------------------
+
+    def _ranked(self, zone, inspector):
+        if zone is not None and inspector is not None:
+            return [k for k in self.by_zone.get(zone, ()) if self.farms[k[1]][3] == inspector]
+        if zone is not None:
+            return self.by_zone.get(zone, [])
+        if inspector is not None:
+            return self.by_inspector.get(inspector, [])
+        return self.queue
+
+    def _entry(self, key, now_us):
+        fid = key[1]
+        value, updated_us, zone, inspector, lat, lng = self.farms[fid]
+        return {
+            "farm_id": fid,
+            "priority": round(-key[0] + self.w_hour * now_us / HOUR_US, 2),
+            "hours_since": round((now_us - updated_us) / HOUR_US, 1),
+            "value": value,
+            "zone": zone,
+            "inspector": inspector,
+            "lat": lat,
+            "lng": lng
+        }
+
+    def page(self, now_us, offset=0, limit=20, zone=None, inspector=None):
+        """(overdue count, entries offset..offset+limit) of one queue, highest priority first"""
+        self.advance(now_us)
+        with self._lock:
+            ranked = self._ranked(zone, inspector)
+            return len(ranked), [self._entry(k, now_us) for k in ranked[offset:offset + limit]]
+
+    def batches(self, now_us, count=5, size=4, max_km=50.0, zone=None, inspector=None):
+        """
+        Up to `count` routes of up to `size` overdue farms of one queue. Each route
+        starts at the highest-priority farm not yet routed and repeatedly moves to
+        the nearest unrouted farm of the same queue within max_km of the last stop.
+        Cost depends on count, size and the farm density around the stops, not on
+        the farm count.
+        """
+        self.advance(now_us)
+        with self._lock:
+            routes = []
+            used = set()
+            for key in self._ranked(zone, inspector):
+                if len(routes) >= count:
+                    break
+                if key[1] in used:
+                    continue
+                stops = [key[1]]
+                used.add(key[1])
+                km = 0.0
+                while len(stops) < size:
+                    lat, lng = self.farms[stops[-1]][4:6]
+                    near = [(d, fid) for fid, d in self.spatial.within(lat, lng, max_km)
+                            if fid not in used and self._in_queue(fid, zone, inspector)]
+                    if not near:
+                        break
+                    d, fid = min(near)
+                    stops.append(fid)
+                    used.add(fid)
+                    km += d
+                routes.append({
+                    "stops": [self._entry(self.keys[fid], now_us) for fid in stops],
+                    "route_km": round(km, 1)
+                })
+            return routes
+
+    def _in_queue(self, fid, zone, inspector):
+        farm = self.farms[fid]
+        return (zone is None or farm[2] == zone) and (inspector is None or farm[3] == inspector)
@@ -0,0 +1,144 @@
+"""
+Streaming encoders for compliance exports.
+
+Every encoder takes an iterable and yields bytes chunks, so an export is
+produced incrementally with memory bounded by one batch. Tabular formats
+(NDJSON, CSV, Parquet, Arrow IPC) carry one row per sample; JSON keeps the
+document shape of the original /api/export. Parquet and Arrow need the
+optional pyarrow dependency.
+"""
+import csv
+import io
+
+from serialization import dumps
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: columnar formats are unavailable without it
+    pa = None
+    pq = None
+
+SAMPLE_COLUMNS = ("farm_id", "farm_name", "location", "zone", "status",
+                  "time", "value", "value_bq", "inspector", "notes")
+
+# format -> (mimetype, file suffix, needs pyarrow)
+FORMATS = {
+    "json": ("application/json", ".json", False),
+    "ndjson": ("application/x-ndjson", ".ndjson", False),
+    "csv": ("text/csv", ".csv", False),
+    "parquet": ("application/vnd.apache.parquet", ".parquet", True),
+    "arrow": ("application/vnd.apache.arrow.stream", ".arrows", True)
+}
+
+BATCH_ROWS = 2000
+
+
+def available(fmt):
+    return fmt in FORMATS and (pa is not None or not FORMATS[fmt][2])
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ndjson_chunks(rows):
+    for batch in _batches(rows, BATCH_ROWS):
+        yield b"".join(dumps(r) + b"\n" for r in batch)
+
+
+def csv_chunks(rows, columns=SAMPLE_COLUMNS):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for batch in _batches(rows, BATCH_ROWS):
+        writer.writerows([r[c] for c in columns] for r in batch)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def json_document_chunks(head, farms, tail):
+    """
+    {...head, "farms": [...], ...tail} with farms serialized one at a time;
+    a farm may be a dict or its already-encoded bytes.
+    """
+    yield dumps(head)[:-1] + (b',"farms":[' if head else b'{"farms":[')
+    for i, farm in enumerate(farms):
+        yield (b"," if i else b"") + (farm if isinstance(farm, bytes) else dumps(farm))
+    yield b"]" + (b"," + dumps(tail)[1:] if tail else b"}")
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file object that hands out what was written since the last drain()"""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        out = b"".join(self._parts)
+        self._parts = []
+        return out
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("farm_id", pa.int64()), ("farm_name", pa.string()), ("location", pa.string()),
+        ("zone", pa.string()), ("status", pa.string()), ("time", pa.string()),
+        ("value", pa.float64()), ("value_bq", pa.float64()),
+        ("inspector", pa.string()), ("notes", pa.string())
+    ])
+
+
+def _record_batches(rows, schema, size):
+    for batch in _batches(rows, size):
+        yield pa.RecordBatch.from_pydict({c: [r[c] for r in batch] for c in SAMPLE_COLUMNS}, schema=schema)
+
+
+def parquet_chunks(rows, row_group=50_000):
+    schema = _arrow_schema()
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    for record_batch in _record_batches(rows, schema, row_group):
+        writer.write_batch(record_batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def arrow_chunks(rows):
+    schema = _arrow_schema()
+    sink = _Sink()
+    writer = pa.ipc.new_stream(sink, schema)
+    for record_batch in _record_batches(rows, schema, BATCH_ROWS):
+        writer.write_batch(record_batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def encode_rows(fmt, rows):
+    """Byte chunks for a tabular format"""
+    return {"ndjson": ndjson_chunks, "csv": csv_chunks,
+            "parquet": parquet_chunks, "arrow": arrow_chunks}[fmt](rows)
@@ -0,0 +1,320 @@
+"""
+Batched per-series forecasts with prediction intervals.
+
+Each series (one farm's readings, in sample order) carries two models whose
+state is updated in O(1) per sample, so nothing is refit from scratch:
+
+  holt  additive-trend exponential smoothing in error-correction form
+        (level += trend + alpha * e, trend += beta * e), plus the running
+        sum of squared one-step errors
+  ar    AR(order) with intercept, kept as least-squares normal equations
+        (X'X, X'y, y'y) and the last `order` values
+
+State lives in NumPy arrays indexed by slot, so forecast() solves every AR
+system in one batched np.linalg.solve and projects all series at once; per
+series the model with the lower in-sample residual variance is used. Results
+are cached per horizon until the next add() or load(). next_mean(), the
+registry-wide next reading behind the dashboard intel, is kept as running
+sums instead, so after a write only the series that changed are re-projected.
+
+Intervals are Gaussian: Holt's closed-form h-step variance, and the AR psi
+weights for the AR model. Groups (zones, the whole registry) are forecast as
+the mean of their members, with member errors taken as independent.
+"""
+import math
+import threading
+
+import numpy as np
+
+ALPHA = 0.5
+BETA = 0.05
+ORDER = 3
+Z_95 = 1.959964
+RIDGE = 1e-6       # keeps X'X invertible for flat series
+AR_ROWS_PER_PARAM = 3  # AR is only considered with this many regression rows per coefficient
+RESUM_EVERY = 100000   # re-projected series before next_mean()'s running sums are recomputed exactly
+
+
+class Forecast:
+    """forecast() result: per-slot mean and standard error for steps 1..horizon"""
+
+    def __init__(self, slots, mean, se, model):
+        self.slots = slots
+        self.mean = mean    # (series, horizon)
+        self.se = se        # (series, horizon)
+        self.model = model  # (series,) "holt" or "ar"
+
+    def series(self, key, z=Z_95):
+        i = self.slots.get(key)
+        if i is None:
+            return None
+        return self.model[i], self.mean[i], self.mean[i] - z * self.se[i], self.mean[i] + z * self.se[i]
+
+    def group(self, keys=None, z=Z_95):
+        """(mean, lower, upper) of the average of several series (default: all), None if none are known"""
+        idx = list(self.slots.values()) if keys is None else [self.slots[k] for k in keys if k in self.slots]
+        if not idx:
+            return None
+        mean = self.mean[idx].mean(axis=0)
+        se = np.sqrt((self.se[idx] ** 2).sum(axis=0)) / len(idx)
+        return mean, mean - z * se, mean + z * se
+
+
+class ForecastEngine:
+    def __init__(self, alpha=ALPHA, beta=BETA, order=ORDER):
+        self.alpha = alpha
+        self.beta = beta
+        self.order = order
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset(self, capacity=1024):
+        k = self.order + 1
+        self.slots = {}
+        self.keys = []
+        self.n = np.zeros(capacity, np.int64)
+        self.level = np.zeros(capacity)
+        self.trend = np.zeros(capacity)
+        self.sse = np.zeros(capacity)               # Holt one-step squared errors
+        self.lags = np.zeros((capacity, self.order))  # most recent value first
+        self.xtx = np.zeros((capacity, k, k))
+        self.xty = np.zeros((capacity, k))
+        self.yty = np.zeros(capacity)
+        self.next_step = np.zeros(capacity)         # one-step mean and variance, as of next_mean()
+        self.next_var = np.zeros(capacity)
+        self._dirty = None  # slots added to since next_mean(); None: every slot
+        self._sums = [0.0, 0.0]
+        self._resum = 0
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _slot(self, key):
+        i = self.slots.get(key)
+        if i is None:
+            i = self.slots[key] = len(self.keys)
+            self.keys.append(key)
+            if i == len(self.n):
+                self._grow(2 * i)
+        return i
+
+    def _grow(self, capacity):
+        for name in ("n", "level", "trend", "sse", "lags", "xtx", "xty", "yty", "next_step", "next_var"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, key, value):
+        """Fold one new reading into a series' models"""
+        i = self._slot(key)
+        self._cache.clear()
+        if self._dirty is not None:
+            self._dirty.add(i)
+        n = self.n[i]
+        if n == 0:
+            self.level[i] = value
+        else:
+            e = value - (self.level[i] + self.trend[i])
+            self.sse[i] += e * e
+            self.level[i] += self.trend[i] + self.alpha * e
+            self.trend[i] += self.beta * e
+        if n >= self.order:
+            x = np.empty(self.order + 1)
+            x[0] = 1.0
+            x[1:] = self.lags[i]
+            self.xtx[i] += np.outer(x, x)
+            self.xty[i] += x * value
+            self.yty[i] += value * value
+        self.lags[i, 1:] = self.lags[i, :-1]
+        self.lags[i, 0] = value
+        self.n[i] = n + 1
+
+    def add_many(self, keys, values):
+        """add() of one reading to each of several distinct series, as one vectorized update"""
+        idx = np.array([self._slot(key) for key in keys], np.int64)
+        if not len(idx):
+            return
+        value = np.asarray(values, np.float64)
+        self._cache.clear()
+        if self._dirty is not None:
+            self._dirty.update(idx.tolist())
+        n = self.n[idx]
+        first = n == 0
+        e = value - (self.level[idx] + self.trend[idx])
+        e[first] = 0.0
+        self.sse[idx] += e * e
+        self.level[idx] = np.where(first, value, self.level[idx] + (self.trend[idx] + self.alpha * e))
+        self.trend[idx] += self.beta * e
+        fit = idx[n >= self.order]
+        if len(fit):
+            x = np.empty((len(fit), self.order + 1))
+            x[:, 0] = 1.0
+            x[:, 1:] = self.lags[fit]
+            y = value[n >= self.order]
+            self.xtx[fit] += x[:, :, None] * x[:, None, :]
+            self.xty[fit] += x * y[:, None]
+            self.yty[fit] += y * y
+        self.lags[idx, 1:] = self.lags[idx, :-1]
+        self.lags[idx, 0] = value
+        self.n[idx] = n + 1
+
+    def load(self, series):
+        """
+        Replace every model with ones fit to series: {key: [values in sample order]}.
+        Series of equal length are fit together, one vectorized pass per sample position.
+        """
+        self.reset(capacity=max(1024, len(series)))
+        by_length = {}
+        for key, values in series.items():
+            by_length.setdefault(len(values), []).append((self._slot(key), values))
+        p = self.order
+        for length, members in by_length.items():
+            if not length:
+                continue
+            idx = np.array([i for i, _ in members])
+            y = np.array([values for _, values in members], dtype=np.float64)
+            level = y[:, 0].copy()
+            trend = np.zeros(len(idx))
+            sse = np.zeros(len(idx))
+            for t in range(1, length):
+                e = y[:, t] - (level + trend)
+                sse += e * e
+                level += trend + self.alpha * e
+                trend += self.beta * e
+            self.level[idx], self.trend[idx], self.sse[idx] = level, trend, sse
+            if length > p:
+                windows = np.lib.stride_tricks.sliding_window_view(y, p + 1, axis=1)[:, :, ::-1]
+                x = np.concatenate([np.ones(windows.shape[:2] + (1,)), windows[:, :, 1:]], axis=2)
+                target = windows[:, :, 0]
+                self.xtx[idx] = np.einsum("gti,gtj->gij", x, x)
+                self.xty[idx] = np.einsum("gti,gt->gi", x, target)
+                self.yty[idx] = (target * target).sum(axis=1)
+            recent = y[:, ::-1][:, :p]
+            self.lags[idx, :recent.shape[1]] = recent
+            self.n[idx] = length
+
+    def forecast(self, horizon):
+        """Forecast of every series for steps 1..horizon (cached until the next write)"""
+        cached = self._cache.get(horizon)
+        if cached is not None:
+            return cached
+        mean, se, model = self._project(slice(0, len(self.keys)), horizon)
+        result = self._cache[horizon] = Forecast(self.slots, mean, se, model)
+        return result
+
+    def next_mean(self, z=Z_95):
+        """(mean, lower, upper) of the average next reading over every series, as forecast(1).group()"""
+        with self._lock:
+            return self._next_mean(z)
+
+    def _next_mean(self, z):
+        m = len(self.keys)
+        if not m:
+            return None
+        if self._dirty is None or len(self._dirty) * 4 > m or self._resum <= 0:
+            mean, se, _ = self._project(slice(0, m), 1)
+            self.next_step[:m], self.next_var[:m] = mean[:, 0], se[:, 0] ** 2
+            self._sums = [float(self.next_step[:m].sum()), float(self.next_var[:m].sum())]
+            self._resum = RESUM_EVERY
+        elif self._dirty:
+            idx = np.fromiter(self._dirty, np.int64, len(self._dirty))
+            mean, se, _ = self._project(idx, 1)
+            var = se[:, 0] ** 2
+            self._sums[0] += float((mean[:, 0] - self.next_step[idx]).sum())
+            self._sums[1] += float((var - self.next_var[idx]).sum())
+            self.next_step[idx], self.next_var[idx] = mean[:, 0], var
+            self._resum -= len(idx)
+        self._dirty = set()
+        mean = self._sums[0] / m
+        se = math.sqrt(max(self._sums[1], 0.0)) / m
+        return mean, mean - z * se, mean + z * se
+
+    def _project(self, idx, horizon):
+        """(mean, se, model) for steps 1..horizon of the series at slots idx (a slice or an index array)"""
+        n = self.n[idx]
+        m = len(n)
+        steps = np.arange(1, horizon + 1)
+
+        # Holt: mean l + h b, variance s2 (1 + sum_{j<h} (alpha + j beta)^2)
+        holt_mean = self.level[idx, None] + self.trend[idx, None] * steps
+        holt_s2 = np.where(n > 1, self.sse[idx] / np.maximum(n - 1, 1), 0.0)
+        growth = np.cumsum(np.r_[1.0, (self.alpha + self.beta * steps[:-1]) ** 2])
+        holt_se = np.sqrt(holt_s2[:, None] * growth)
+
+        mean, se = holt_mean, holt_se
+        model = np.full(m, "holt", dtype=object)
+        k = self.order + 1
+        rows = n - self.order
+        usable = np.flatnonzero(rows >= AR_ROWS_PER_PARAM * k)
+        if len(usable):
+            slots = idx[usable] if isinstance(idx, np.ndarray) else usable + idx.start
+            xtx = self.xtx[slots] + RIDGE * np.eye(k)
+            xty = self.xty[slots]
+            coef = np.linalg.solve(xtx, xty[:, :, None])[:, :, 0]
+            ssr = self.yty[slots] - np.einsum("gi,gi->g", coef, xty)
+            ar_s2 = np.maximum(ssr, 0.0) / (rows[usable] - k)
+            better = ar_s2 < holt_s2[usable]
+            if better.any():
+                pick = usable[better]
+                ar_mean, ar_se = self._project_ar(coef[better], self.lags[slots[better]], ar_s2[better], horizon)
+                mean, se = mean.copy(), se.copy()
+                mean[pick], se[pick] = ar_mean, ar_se
+                model[pick] = "ar"
+        return mean, se, model
+
+    def _project_ar(self, coef, lags, s2, horizon):
+        """Iterated AR means and psi-weight standard errors"""
+        p = self.order
+        phi = coef[:, 1:]
+        lags = lags.copy()
+        mean = np.empty((len(coef), horizon))
+        psi = np.zeros((len(coef), horizon))
+        psi[:, 0] = 1.0
+        for h in range(horizon):
+            nxt = coef[:, 0] + np.einsum("gi,gi->g", phi, lags)
+            mean[:, h] = nxt
+            lags[:, 1:] = lags[:, :-1]
+            lags[:, 0] = nxt
+            if h:
+                back = psi[:, h - 1::-1][:, :p]
+                psi[:, h] = np.einsum("gi,gi->g", phi[:, :back.shape[1]], back)
+        se = np.sqrt(s2[:, None] * np.cumsum(psi ** 2, axis=1))
+        return mean, se
+
+    def to_state(self):
+        m = len(self.keys)
+        return {
+            "keys": self.keys,
+            "n": self.n[:m].tolist(),
+            "level": self.level[:m].tolist(),
+            "trend": self.trend[:m].tolist(),
+            "sse": self.sse[:m].tolist(),
+            "lags": self.lags[:m].tolist(),
+            "xtx": self.xtx[:m].tolist(),
+            "xty": self.xty[:m].tolist(),
+            "yty": self.yty[:m].tolist()
+        }
+
+    def load_state(self, state):
+        m = len(state["keys"])
+        self.reset(capacity=max(1024, m))
+        for key in state["keys"]:
+            self._slot(key)
+        for name in ("n", "level", "trend", "sse", "lags", "xtx", "xty", "yty"):
+            if m:
+                getattr(self, name)[:m] = np.array(state[name], dtype=getattr(self, name).dtype)
+
+
+def normal_cdf(x):
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
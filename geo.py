@@ -0,0 +1,170 @@
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two coordinates in kilometres"""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """
+    Uniform lat/lng bucket grid over keyed points.
+    Points can be inserted, moved and removed incrementally; nearest lookups
+    walk rings of cells outward and stop once no unvisited cell can hold a
+    closer point (distances are great-circle, not squared degrees). A query
+    costs the cells it visits plus the points in them, so pick cell_deg near
+    the typical query radius. Columns count from -180 and wrap around the
+    antimeridian (the last one is narrower when cell_deg does not divide 360).
+    """
+
+    def __init__(self, cell_deg=1.0):
+        self.cell_deg = cell_deg
+        self.ncols = math.ceil(360.0 / cell_deg - 1e-9)
+        self._short = self.ncols * cell_deg - 360.0  # how much narrower the last column is
+        self.cells = {}   # (row, col) -> {key: (lat, lng)}
+        self.points = {}  # key -> (lat, lng)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, key):
+        return key in self.points
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_deg)),
+                min(int(math.floor((lng + 180.0) / self.cell_deg)), self.ncols - 1))
+
+    def insert(self, key, lat, lng):
+        """Add a point, or move it if the key is already indexed"""
+        if key in self.points:
+            self.remove(key)
+        pos = self.points[key] = (lat, lng)
+        self.cells.setdefault(self._cell(lat, lng), {})[key] = pos
+
+    def remove(self, key):
+        pos = self.points.pop(key, None)
+        if pos is None:
+            return
+        cell = self._cell(*pos)
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self.cells[cell]
+
+    def _ring(self, row, col, r):
+        """Yield the cells lying exactly r steps (Chebyshev) away from (row, col), columns wrapped, each once"""
+        if r == 0:
+            yield (row, col)
+            return
+        n = self.ncols
+        lo, hi = col - r, col + r
+        if 2 * r + 1 >= n:
+            cols = range(n)
+            sides = sorted({lo % n, hi % n}) if 2 * r - 1 < n else ()  # else ring r - 1 spanned every column
+        elif lo >= 0 and hi < n:
+            cols, sides = range(lo, hi + 1), (lo, hi)
+        else:
+            cols, sides = [c % n for c in range(lo, hi + 1)], (lo % n, hi % n)
+        for c in cols:
+            yield (row - r, c)
+            yield (row + r, c)
+        for c in sides:
+            for rr in range(row - r + 1, row + r):
+                yield (rr, c)
+
+    def _ring_min_km(self, lat, r):
+        """Lower bound on the distance from lat to any point outside rings 0..r"""
+        deg = r * self.cell_deg
+        by_lat = deg * KM_PER_DEG_LAT
+        if 2 * r + 1 >= self.ncols:
+            return by_lat  # every column visited
+        dl = math.radians(min(max(deg - self._short, 0.0), 90.0))
+        by_lng = EARTH_RADIUS_KM * math.asin(min(1.0, abs(math.cos(math.radians(lat))) * math.sin(dl)))
+        return min(by_lat, by_lng)
+
+    def nearest(self, lat, lng):
+        """Return (key, distance_km) of the closest point, or (None, inf) when empty"""
+        best, bestd = None, float("inf")
+        if not self.points:
+            return best, bestd
+        row, col = self._cell(lat, lng)
+        seen = 0
+        r = 0
+        while True:
+            for cell in self._ring(row, col, r):
+                bucket = self.cells.get(cell)
+                if not bucket:
+                    continue
+                for key, (plat, plng) in bucket.items():
+                    seen += 1
+                    d = haversine_km(lat, lng, plat, plng)
+                    if d < bestd:
+                        bestd, best = d, key
+            if seen >= len(self.points) or bestd <= self._ring_min_km(lat, r):
+                return best, bestd
+            r += 1
+
+    def within(self, lat, lng, km):
+        """Yield (key, distance_km) of every point within km, nearest rings first"""
+        row, col = self._cell(lat, lng)
+        r = 0
+        while True:
+            for cell in self._ring(row, col, r):
+                for key, (plat, plng) in self.cells.get(cell, {}).items():
+                    d = haversine_km(lat, lng, plat, plng)
+                    if d <= km:
+                        yield key, d
+            if self._ring_min_km(lat, r) > km or r * self.cell_deg >= 180:
+                return
+            r += 1
+
+    def nearest_k(self, lat, lng, k):
+        """Return up to k (key, distance_km) pairs, nearest first (ties by key)"""
+        if k <= 0 or not self.points:
+            return []
+        found = []  # (distance_km, key) of every point visited
+        worst = []  # max-heap (negated) of the k smallest distances so far
+        row, col = self._cell(lat, lng)
+        r = 0
+        while True:
+            for cell in self._ring(row, col, r):
+                for key, (plat, plng) in self.cells.get(cell, {}).items():
+                    d = haversine_km(lat, lng, plat, plng)
+                    found.append((d, key))
+                    if len(worst) < k:
+                        heapq.heappush(worst, -d)
+                    elif d < -worst[0]:
+                        heapq.heapreplace(worst, -d)
+            if len(found) >= len(self.points) or (len(worst) == k and -worst[0] <= self._ring_min_km(lat, r)):
+                return [(key, d) for d, key in heapq.nsmallest(k, found)]
+            r += 1
+
+    def in_bbox(self, south, west, north, east):
+        """Yield the keys inside a lat/lng box; west > east means the box crosses the antimeridian"""
+        row0, row1 = self._cell(south, 0)[0], self._cell(north, 0)[0]
+        spans = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        cols = [(self._cell(0, w)[1], self._cell(0, e)[1]) for w, e in spans]
+        covered = (row1 - row0 + 1) * sum(c1 - c0 + 1 for c0, c1 in cols)
+        if covered < len(self.cells):
+            buckets = (self.cells.get((row, col)) for row in range(row0, row1 + 1)
+                       for c0, c1 in cols for col in range(c0, c1 + 1))
+        else:
+            buckets = (b for (row, col), b in self.cells.items()
+                       if row0 <= row <= row1 and any(c0 <= col <= c1 for c0, c1 in cols))
+        for bucket in buckets:
+            if not bucket:
+                continue
+            for key, (plat, plng) in bucket.items():
+                if south <= plat <= north and any(w <= plng <= e for w, e in spans):
+                    yield key
+
@@ -0,0 +1,335 @@
+"""
+Level-of-detail heatmap cells.
+
+Farms are binned into a quadtree of Web Mercator cells: level L splits the
+world into 2^L x 2^L cells, so a map at zoom z shown with CELL_SHIFT extra
+levels gets cells of 256 / 2^CELL_SHIFT pixels. Every level from
+CELL_SHIFT to MAX_LEVEL keeps count, exact fixed-point sum and max ppb per
+occupied cell and is updated in O(levels log n) per sample; max uses a
+lazy-deletion heap so a farm whose value drops does not force a rescan.
+Queries touch only the cells inside the bounding box and coarsen the level
+until at most MAX_QUERY_CELLS cells could be returned, so the payload is
+bounded by the viewport, not by the number of farms. Zooms finer than
+MAX_LEVEL are aggregated on the fly from the member sets of the finest cells.
+
+upsert_many() takes a write that revalues a large share of the farms as
+a table update: the levels are marked stale, and the first read of a level
+recomputes all its sums (a bincount over the farms' cell indexes, with the
+fixed-point values split into two exact halves) and heaps (one lexsort; a
+cell's slice of the sorted (-value, id) pairs is already heap-ordered).
+Per-farm writes keep counts current and leave a stale level's sums and
+heaps to that refill.
+"""
+import heapq
+import math
+import threading
+
+import numpy as np
+
+CELL_SHIFT = 4         # 16 px cells on 256 px tiles
+MAX_LEVEL = 14         # ~2.4 km cells at the equator
+MAX_QUERY_CELLS = 4096
+MAX_LAT = 85.05112878  # Web Mercator latitude limit
+
+_FX = 1 << 40  # fixed-point scale for exact add/remove of sums, as in aggregates.py
+_VECTOR_LIMIT = 1 << 22  # |value| * _FX fits int64 with room to spare, so numpy's truncation is int()'s
+_BINCOUNT_LIMIT = 1 << 21  # farms whose 32-bit halves (< 2**32 and 2**30) sum exactly in float64
+
+
+def mercator(lat, lng, level):
+    """Integer cell (x, y) of a point at a level"""
+    n = 1 << level
+    lat = min(max(lat, -MAX_LAT), MAX_LAT)
+    x = int((lng + 180.0) / 360.0 * n)
+    s = math.sin(math.radians(lat))
+    y = int((0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def cell_center(x, y, level):
+    """(lat, lng) of the middle of a cell"""
+    n = 1 << level
+    lng = (x + 0.5) / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / n))))
+    return lat, lng
+
+
+class _Cell:
+    __slots__ = ("count", "sum", "heap", "members")
+
+    def __init__(self, finest):
+        self.count = 0
+        self.sum = 0
+        self.heap = []  # (-value, farm id); entries of moved or updated farms are dropped lazily
+        self.members = set() if finest else None
+
+
+class HeatGrid:
+    """Per-level cell aggregates (count, mean, max ppb) over farm positions"""
+
+    def __init__(self, min_level=CELL_SHIFT, max_level=MAX_LEVEL):
+        self.min_level = min_level
+        self.max_level = max_level
+        self._lock = threading.Lock()  # readers refilling a stale level
+        self.reset()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_layout"] = None  # rebuilt on demand
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.levels = {level: {} for level in range(self.min_level, self.max_level + 1)}
+        self._farms = {}     # farm id -> (finest x, finest y, value, lat, lng)
+        self._stale = set()  # levels whose sums and heaps are recomputed on their next read
+        self._layout = None  # {level: (cell index per farm in _farms order, cells)} while no farm moves
+
+    def __len__(self):
+        return len(self._farms)
+
+    def upsert(self, farm):
+        """Add a farm or move its contribution to its current position and value"""
+        x, y = mercator(farm.lat, farm.lng, self.max_level)
+        old = self._farms.get(farm.id)
+        if old is not None and old[:2] == (x, y):
+            self._farms[farm.id] = (x, y, farm.value, farm.lat, farm.lng)
+            if old[2] != farm.value:
+                self._revalue(farm.id, x, y, old[2], farm.value)
+            return
+        self.discard(farm.id)
+        self._add(farm.id, x, y, farm.value, farm.lat, farm.lng)
+
+    def _add(self, fid, x, y, value, lat, lng):
+        self._layout = None
+        self._farms[fid] = (x, y, value, lat, lng)
+        fx = int(value * _FX)
+        for level, cells in self.levels.items():
+            shift = self.max_level - level
+            key = (x >> shift, y >> shift)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = _Cell(level == self.max_level)
+            cell.count += 1
+            if level not in self._stale:
+                cell.sum += fx
+                heapq.heappush(cell.heap, (-value, fid))
+            if cell.members is not None:
+                cell.members.add(fid)
+
+    def _revalue(self, fid, x, y, old_value, value):
+        """Swap a farm's value in the cells it already occupies"""
+        diff = int(value * _FX) - int(old_value * _FX)
+        for level, cells in self.levels.items():
+            if level in self._stale:
+                continue
+            shift = self.max_level - level
+            key = (x >> shift, y >> shift)
+            cell = cells[key]
+            cell.sum += diff
+            heapq.heappush(cell.heap, (-value, fid))
+            if len(cell.heap) > 2 * cell.count + 8:
+                self._compact(cell, key, level)
+
+    def upsert_many(self, farms):
+        """
+        upsert() for many farms. Past a quarter of the grid only the farm table
+        is updated (cells are regrouped if a farm moved or is new) and every
+        level goes stale; see the module docstring.
+        """
+        if len(farms) * 4 < len(self._farms):
+            for farm in farms:
+                self.upsert(farm)
+            return
+        moved = False
+        for farm in farms:
+            old = self._farms.get(farm.id)
+            if old is not None and old[3:] == (farm.lat, farm.lng):
+                x, y = old[:2]
+            else:
+                x, y = mercator(farm.lat, farm.lng, self.max_level)
+                moved = moved or old is None or old[:2] != (x, y)
+            self._farms[farm.id] = (x, y, farm.value, farm.lat, farm.lng)
+        if moved:
+            self._index(regroup=True)
+        self._stale.update(self.levels)
+
+    def _arrays(self):
+        """(ids, x, y, values) of every farm, in _farms order"""
+        rows = list(self._farms.values())
+        return (np.fromiter(self._farms, np.int64, len(rows)), np.array([r[0] for r in rows], np.int64),
+                np.array([r[1] for r in rows], np.int64), np.array([r[2] for r in rows], np.float64))
+
+    def _index(self, regroup):
+        """
+        Map every farm to its cell per level. regroup rebuilds the cells
+        themselves (counts and finest-level members) for the farms' positions.
+        """
+        fid, x, y, _ = self._arrays()
+        self._layout = {}
+        for level, cells in self.levels.items():
+            shift = self.max_level - level
+            keys, inverse = np.unique(((x >> shift) << 32) | (y >> shift), return_inverse=True)
+            keys = [(k >> 32, k & 0xFFFFFFFF) for k in keys.tolist()]
+            if regroup:
+                finest = level == self.max_level
+                cells = self.levels[level] = {key: _Cell(finest) for key in keys}
+                for cell, count in zip(cells.values(), np.bincount(inverse, minlength=len(keys)).tolist()):
+                    cell.count = count
+                if finest:
+                    for fid_, i in zip(fid.tolist(), inverse.tolist()):
+                        cells[keys[i]].members.add(fid_)
+            self._layout[level] = (inverse.ravel(), [cells[key] for key in keys])
+
+    def _refill(self, level):
+        """Recompute a stale level's sums and heaps from _farms"""
+        with self._lock:
+            if level not in self._stale:
+                return
+            fid, _, _, value = self._arrays()
+            if not np.all(np.abs(value) < _VECTOR_LIMIT):
+                farms = self._farms
+                self.reset()
+                for key, (x, y, v, lat, lng) in farms.items():
+                    self._add(key, x, y, v, lat, lng)
+                return
+            if self._layout is None:
+                self._index(regroup=False)
+            inverse, cells = self._layout[level]
+            fx = (value * _FX).astype(np.int64)
+            hi, lo = fx >> 32, fx & 0xFFFFFFFF  # halves whose per-cell sums stay exact
+            if len(value) < _BINCOUNT_LIMIT:
+                his = np.bincount(inverse, hi, len(cells)).astype(np.int64)
+                los = np.bincount(inverse, lo, len(cells)).astype(np.int64)
+            else:
+                his = np.zeros(len(cells), np.int64)
+                los = np.zeros(len(cells), np.int64)
+                np.add.at(his, inverse, hi)
+                np.add.at(los, inverse, lo)
+            neg = -value
+            order = np.lexsort((fid, neg, inverse))
+            pairs = list(zip(neg[order].tolist(), fid[order].tolist()))
+            bounds = np.cumsum(np.bincount(inverse, minlength=len(cells))).tolist()
+            start = 0
+            for cell, end, h, low in zip(cells, bounds, his.tolist(), los.tolist()):
+                cell.sum = (h << 32) + low
+                cell.heap = pairs[start:end]  # sorted, so already a heap
+                start = end
+            self._stale.discard(level)
+
+    def discard(self, fid):
+        old = self._farms.pop(fid, None)
+        if old is None:
+            return
+        self._layout = None
+        x, y, value = old[:3]
+        fx = int(value * _FX)
+        for level, cells in self.levels.items():
+            shift = self.max_level - level
+            key = (x >> shift, y >> shift)
+            cell = cells[key]
+            cell.count -= 1
+            stale = level in self._stale
+            if not stale:
+                cell.sum -= fx
+            if cell.members is not None:
+                cell.members.discard(fid)
+            if not cell.count:
+                del cells[key]
+            elif not stale and len(cell.heap) > 2 * cell.count + 8:
+                self._compact(cell, key, level)
+
+    def _is_live(self, entry, key, shift):
+        """Whether a heap entry still describes a farm in this cell at that value"""
+        neg_value, fid = entry
+        cur = self._farms.get(fid)
+        return cur is not None and cur[2] == -neg_value and (cur[0] >> shift, cur[1] >> shift) == key
+
+    def _compact(self, cell, key, level):
+        """Drop stale heap entries once they outnumber the live ones"""
+        shift = self.max_level - level
+        live = {entry[1]: entry for entry in cell.heap if self._is_live(entry, key, shift)}
+        cell.heap = list(live.values())
+        heapq.heapify(cell.heap)
+
+    def _max(self, cell, key, level):
+        shift = self.max_level - level
+        heap = cell.heap
+        while heap and not self._is_live(heap[0], key, shift):
+            heapq.heappop(heap)
+        return -heap[0][0] if heap else None
+
+    def _ranges(self, south, west, north, east, level):
+        """x ranges (two when the box crosses the antimeridian) and the y range of a box"""
+        west = min(max(west, -180.0), 180.0)
+        east = min(max(east, -180.0), 180.0)
+        x0, y0 = mercator(north, west, level)
+        x1, y1 = mercator(south, east, level)
+        n = 1 << level
+        xs = [(x0, x1)] if x0 <= x1 else [(x0, n - 1), (0, x1)]
+        return xs, (min(y0, y1), max(y0, y1))
+
+    def query(self, south, west, north, east, zoom):
+        """(level used, [[lat, lng, count, mean, max], ...]) for the cells of a map view"""
+        level = max(zoom + CELL_SHIFT, self.min_level)
+        while True:
+            xs, (y0, y1) = self._ranges(south, west, north, east, level)
+            span = sum(b - a + 1 for a, b in xs) * (y1 - y0 + 1)
+            if span <= MAX_QUERY_CELLS or level <= self.min_level:
+                break
+            level -= 1
+        return level, self._collect(level, xs, (y0, y1), span)
+
+    def tile(self, z, x, y):
+        """Cells inside slippy-map tile z/x/y"""
+        level = z + CELL_SHIFT
+        lo_x, lo_y = x << CELL_SHIFT, y << CELL_SHIFT
+        size = 1 << CELL_SHIFT
+        return self._collect(level, [(lo_x, lo_x + size - 1)], (lo_y, lo_y + size - 1), size * size)
+
+    def _collect(self, level, xs, ys, span):
+        y0, y1 = ys
+        if level > self.max_level:
+            return self._collect_fine(level, xs, ys)
+        if level in self._stale:
+            self._refill(level)
+        cells = self.levels[level]
+        if span < len(cells):
+            keys = ((cx, cy) for a, b in xs for cx in range(a, b + 1) for cy in range(y0, y1 + 1))
+            found = ((k, cells.get(k)) for k in keys)
+            found = [(k, c) for k, c in found if c is not None]
+        else:
+            found = [(k, c) for k, c in cells.items()
+                     if y0 <= k[1] <= y1 and any(a <= k[0] <= b for a, b in xs)]
+        out = []
+        for key, cell in sorted(found):
+            lat, lng = cell_center(key[0], key[1], level)
+            out.append([round(lat, 5), round(lng, 5), cell.count,
+                        round(cell.sum / (_FX * cell.count), 2), self._max(cell, key, level)])
+        return out
+
+    def _collect_fine(self, level, xs, ys):
+        """Cells finer than MAX_LEVEL, built from the member farms of the finest stored cells"""
+        shift = level - self.max_level
+        coarse_xs = [(a >> shift, b >> shift) for a, b in xs]
+        coarse_ys = (ys[0] >> shift, ys[1] >> shift)
+        stored = self.levels[self.max_level]
+        groups = {}
+        for cx0, cx1 in coarse_xs:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(coarse_ys[0], coarse_ys[1] + 1):
+                    cell = stored.get((cx, cy))
+                    for fid in cell.members if cell else ():
+                        _, _, value, lat, lng = self._farms[fid]
+                        key = mercator(lat, lng, level)
+                        if ys[0] <= key[1] <= ys[1] and any(a <= key[0] <= b for a, b in xs):
+                            groups.setdefault(key, []).append(value)
+        out = []
+        for key, values in sorted(groups.items()):
+            lat, lng = cell_center(key[0], key[1], level)
+            out.append([round(lat, 5), round(lng, 5), len(values), round(sum(values) / len(values), 2), max(values)])
+        return out
@@ -0,0 +1,182 @@
+"""Parsing and batch validation for bulk sample uploads (JSON Lines, JSON text sequences or CSV bodies)"""
+import csv
+import io
+import json
+from collections import OrderedDict
+from itertools import repeat
+
+import numpy as np
+
+CSV_TYPES = ("text/csv", "application/csv")
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/x-jsonlines")
+JSON_SEQ_TYPES = ("application/json-seq",)
+RS = "\x1e"  # record separator before every JSON text of a json-seq body (RFC 7464)
+
+# Largest accepted reading (ppb): far above any real sample, and it keeps running sums finite
+MAX_VALUE = 1e6
+
+# Error codes in precedence order; a row reports the first one that applies
+ROW_ERRORS = (
+    None,
+    "Malformed row",
+    "Missing required fields: farm_id and value",
+    "Invalid farm_id",
+    "Farm not found",
+    "Invalid value format",
+    "Value cannot be negative",
+    f"Value cannot exceed {MAX_VALUE:,.0f}",
+    "Duplicate sample_id in batch",
+)
+
+
+class BulkFormatError(ValueError):
+    """The request body cannot be read as a bulk upload at all"""
+
+
+def iter_rows(stream, content_type):
+    """Yield one dict per data row of a JSON Lines, json-seq or CSV body, reading it incrementally"""
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if content_type in CSV_TYPES:
+        reader = csv.DictReader(text)
+        if not reader.fieldnames or not {"farm_id", "value"} <= {f.strip() for f in reader.fieldnames}:
+            raise BulkFormatError("CSV header must include farm_id and value")
+        for row in reader:
+            yield {k.strip(): v for k, v in row.items() if k is not None}
+    elif content_type in NDJSON_TYPES:
+        for line in text:
+            line = line.strip()
+            if line:
+                yield _json_row(line)
+    elif content_type in JSON_SEQ_TYPES:
+        for record in _json_seq(text):
+            record = record.strip()
+            if record:
+                yield _json_row(record)
+    else:
+        raise BulkFormatError("Unsupported content type; send text/csv, application/x-ndjson or application/json-seq")
+
+
+def _json_row(text):
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        obj = None
+    return obj if isinstance(obj, dict) else {"_malformed": True}
+
+
+def _json_seq(text, chunk_size=64 * 1024):
+    """The records of a json-seq body: the text between RS characters, which may span lines"""
+    tail = ""
+    while True:
+        chunk = text.read(chunk_size)
+        if not chunk:
+            break
+        *records, tail = (tail + chunk).split(RS)
+        yield from records
+    yield tail
+
+
+_CHUNK = 1024  # rows converted per numpy call; only a chunk that fails is parsed row by row
+_type = np.frompyfunc(type, 1, 1)
+_str = np.frompyfunc(str, 1, 1)
+_strip = np.frompyfunc(str.strip, 1, 1)
+
+
+def _column(rows, key):
+    """(values, their types) of one field across the rows, None where it is absent"""
+    col = np.fromiter(map(dict.get, rows, repeat(key)), dtype=object, count=len(rows))
+    return col, _type(col)
+
+
+def _blank(col, kind):
+    """(mask of None and whitespace-only strings, col with its strings stripped)"""
+    blank = kind == type(None)
+    strings = kind == str
+    if strings.any():
+        col = col.copy()
+        stripped = _strip(col[strings])
+        col[strings] = stripped
+        blank[strings] = ~stripped.astype(bool)
+    return blank, col
+
+
+def _convert(col, dtype, convert, fill):
+    """(array, ok mask): col as dtype, converted by numpy a chunk at a time; failing chunks go row by row"""
+    out = np.full(len(col), fill, dtype=dtype)
+    ok = np.ones(len(col), dtype=bool)
+    for start in range(0, len(col), _CHUNK):
+        chunk = col[start:start + _CHUNK]
+        try:
+            out[start:start + len(chunk)] = chunk.astype(dtype)
+            continue
+        except (TypeError, ValueError, OverflowError):
+            pass
+        for i, v in enumerate(chunk.tolist(), start):
+            try:
+                out[i] = convert(v)
+            except (TypeError, ValueError, OverflowError):
+                ok[i] = False
+    return out, ok
+
+
+def validate_batch(rows, known_ids):
+    """
+    Validate a batch column-wise: each column is converted by numpy in bulk and
+    every check is a mask over the whole batch.
+    Returns (farm_ids, values, sample_ids, codes) where codes[i] indexes ROW_ERRORS (0 = valid).
+    """
+    n = len(rows)
+    malformed = np.fromiter(map(bool, map(dict.get, rows, repeat("_malformed"))), dtype=bool, count=n)
+    (fid_col, fid_kind), (val_col, val_kind), (sid_col, sid_kind) = (
+        _column(rows, "farm_id"), _column(rows, "value"), _column(rows, "sample_id"))
+    missing = ~malformed & (_blank(fid_col, fid_kind)[0] | _blank(val_col, val_kind)[0])
+    parse = ~(malformed | missing)
+
+    # farm ids are integers or integer strings; floats and booleans are refused, not truncated
+    parse_id = parse & (fid_kind != float) & (fid_kind != bool)
+    ids = np.full(n, -1, dtype=np.int64)
+    ids[parse_id], ok = _convert(fid_col[parse_id], np.int64, int, -1)
+    bad_id = parse & ~parse_id
+    bad_id[np.flatnonzero(parse_id)[~ok]] = True
+
+    vals = np.full(n, np.nan)
+    vals[parse] = _convert(val_col[parse], np.float64, float, np.nan)[0]  # failures stay NaN, reported as invalid
+
+    sid_blank, sids = _blank(sid_col, sid_kind)
+    other = ~sid_blank & (sid_kind != str)
+    sids[other] = _strip(_str(sids[other]))
+    sids[sid_blank] = None
+    with_sid = np.flatnonzero(~sid_blank)
+    sample_ids = sids.tolist()
+
+    unknown = ~np.isin(ids, known_ids)
+    bad_value = ~np.isfinite(vals)
+    negative = np.less(vals, 0, where=~bad_value, out=np.zeros(n, dtype=bool))
+    too_large = np.greater(vals, MAX_VALUE, where=~bad_value, out=np.zeros(n, dtype=bool))
+    dup = np.zeros(n, dtype=bool)
+    if len(with_sid):
+        _, first = np.unique(sids[with_sid], return_index=True)
+        again = np.ones(len(with_sid), dtype=bool)
+        again[first] = False
+        dup[with_sid[again]] = True
+
+    codes = np.zeros(n, dtype=np.int8)
+    for code, mask in reversed(list(enumerate((malformed, missing, bad_id, unknown, bad_value, negative, too_large, dup), 1))):
+        codes[mask] = code
+    return ids, vals, sample_ids, codes
+
+
+class RecentIds:
+    """Bounded set of recently applied client sample ids (oldest evicted first)"""
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._ids = OrderedDict()
+
+    def __contains__(self, sid):
+        return sid in self._ids
+
+    def add(self, sid):
+        self._ids[sid] = None
+        if len(self._ids) > self.maxlen:
+            self._ids.popitem(last=False)
@@ -0,0 +1,290 @@
+"""
+Background jobs for long-running admin actions (simulation, export).
+
+Jobs are submitted to a bounded queue and run on a small pool of worker
+threads, so a heavy request never occupies a web worker thread for its
+whole duration. A job function receives its Job and reports progress
+through job.report(), which is also where cooperative cancellation takes
+effect. Results are written to files under a results directory (JSON, or
+the byte chunks of a StreamResult) and served for download until the job
+is evicted. With a shared store, job records and cancel requests are kept
+there too, so any worker process can report on, cancel or serve a job that
+another process runs.
+"""
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# report() reaches the shared store (record write, cancel check) at most this often,
+# unless progress moved by at least SYNC_PROGRESS since the last time it did
+SYNC_SECONDS = 0.5
+SYNC_PROGRESS = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """The job queue is at capacity; the client should retry later"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function once cancellation was requested"""
+
+
+class StreamResult:
+    """A job result produced as byte chunks, written to the result file as they arrive"""
+
+    def __init__(self, chunks, mimetype, suffix):
+        self.chunks = chunks
+        self.mimetype = mimetype
+        self.suffix = suffix
+
+
+class Job:
+    def __init__(self, kind, params, owner, store=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.owner = owner
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.error = None
+        self.result_path = None
+        self.mimetype = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._store = store
+        self._synced_at = 0.0
+        self._synced_progress = 0.0
+
+    def report(self, progress, message=None):
+        """
+        Record progress in [0, 1]; raises JobCancelled if the job was cancelled.
+        A local cancel takes effect at once; the shared store is only written and
+        asked for cancel requests every SYNC_SECONDS or SYNC_PROGRESS of progress.
+        """
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.progress = round(min(max(progress, 0.0), 1.0), 4)
+        if message is not None:
+            self.message = message
+        if not self._store:
+            return
+        now = time.monotonic()
+        if (now - self._synced_at < SYNC_SECONDS and self.progress - self._synced_progress < SYNC_PROGRESS
+                and self.progress < 1.0):
+            return
+        self._synced_at = now
+        self._synced_progress = self.progress
+        if self.cancelled:
+            raise JobCancelled()
+        self.save()
+
+    @property
+    def cancelled(self):
+        if not self._cancel.is_set() and self._store and self._store.cancel_requested(self.id):
+            self._cancel.set()  # requested through another process
+        return self._cancel.is_set()
+
+    def save(self):
+        if self._store:
+            self._store.save_job(self.id, {**self.to_dict(), "result_path": self.result_path,
+                                           "mimetype": self.mimetype})
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; True if it did within timeout"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        def iso(ts):
+            return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)) if ts else None
+        return {
+            "id": self.id,
+            "type": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "created_at": iso(self.created_at),
+            "started_at": iso(self.started_at),
+            "finished_at": iso(self.finished_at),
+            "result_url": f"/api/jobs/{self.id}/result" if self.status == SUCCEEDED else None
+        }
+
+
+class SharedJob:
+    """Read-only view of a job record from the shared store (possibly run by another process)"""
+
+    def __init__(self, record):
+        self.id = record["id"]
+        self.status = record["status"]
+        self.error = record["error"]
+        self.result_path = record.pop("result_path", None)
+        self.mimetype = record.pop("mimetype", None)
+        self._record = record
+
+    def to_dict(self):
+        return dict(self._record)
+
+
+class JobQueue:
+    """
+    Bounded FIFO of jobs served by `workers` daemon threads.
+    submit() raises QueueFull once `max_queued` jobs are waiting; finished
+    jobs beyond `keep` are evicted oldest-first together with their result file.
+    store: optional shared_state.SharedState holding job records for all processes.
+    Nothing touches the disk or starts a thread until start() or the first submit();
+    results_dir None means a private temporary directory.
+    """
+
+    def __init__(self, results_dir, workers=2, max_queued=16, keep=200, store=None):
+        self.results_dir = results_dir
+        self.workers = workers
+        self.max_queued = max_queued
+        self.keep = keep
+        self.store = store
+        self.handlers = {}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._queued = 0
+        self._threads = []
+
+    def start(self):
+        """Create the results directory and the worker threads (once)"""
+        with self._lock:
+            if self._threads:
+                return
+            if self.results_dir is None:
+                self.results_dir = tempfile.mkdtemp(prefix="cesium-jobs-")
+            os.makedirs(self.results_dir, exist_ok=True)
+            if self.store is None:
+                for name in os.listdir(self.results_dir):
+                    # results of a previous process are unreachable once its job table is gone
+                    os.remove(os.path.join(self.results_dir, name))
+            self._threads = [
+                threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for t in self._threads:
+                t.start()
+
+    def register(self, kind, fn):
+        """fn(job, **params) -> JSON-serializable result or StreamResult"""
+        self.handlers[kind] = fn
+
+    def submit(self, kind, params=None, owner=None):
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        self.start()
+        job = Job(kind, params or {}, owner, self.store)
+        with self._lock:
+            if self._queued >= self.max_queued:
+                raise QueueFull()
+            self._queued += 1
+            self._jobs[job.id] = job
+            self._evict()
+        job.save()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store:
+            found = self.store.load_job(job_id)
+            job = SharedJob(found[0]) if found else None
+        return job
+
+    def list(self):
+        """Jobs oldest first; with a shared store, those of every process"""
+        if self.store:
+            return [SharedJob(r) for r in reversed(self.store.list_jobs(self.keep))]
+        with self._lock:
+            return list(self._jobs.values())
+
+    @property
+    def depth(self):
+        return self._queued
+
+    def cancel(self, job_id):
+        """Request cancellation; queued jobs never start, running ones stop at their next report()"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.status not in FINISHED:
+            if isinstance(job, Job):
+                job._cancel.set()
+            if self.store:
+                self.store.request_cancel(job_id)
+        return job
+
+    def _evict(self):
+        finished = [j for j in self._jobs.values() if j.status in FINISHED]
+        evicted = finished[:max(0, len(finished) - self.keep)]
+        for job in evicted:
+            del self._jobs[job.id]
+            if job.result_path:
+                try:
+                    os.remove(job.result_path)
+                except FileNotFoundError:
+                    pass
+        if evicted and self.store:
+            self.store.delete_jobs([job.id for job in evicted])
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job.save()
+        job._done.set()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self._queued -= 1
+            if job.cancelled:
+                self._finish(job, CANCELLED)
+                continue
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                job.save()
+                result = self.handlers[job.kind](job, **job.params)
+                if isinstance(result, StreamResult):
+                    path = os.path.join(self.results_dir, job.id + result.suffix)
+                    try:
+                        with open(path, "wb") as fh:
+                            for chunk in result.chunks:
+                                fh.write(chunk)
+                    except BaseException:
+                        os.remove(path)
+                        raise
+                    job.mimetype = result.mimetype
+                else:
+                    path = os.path.join(self.results_dir, job.id + ".json")
+                    with open(path, "w", encoding="utf-8") as fh:
+                        json.dump(result, fh)
+                    job.mimetype = "application/json"
+                job.result_path = path
+                job.progress = 1.0
+                self._finish(job, SUCCEEDED)
+            except JobCancelled:
+                self._finish(job, CANCELLED)
+            except Exception as e:
+                logger.exception("job %s %s failed", job.kind, job.id)
+                self._finish(job, FAILED, str(e))
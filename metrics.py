@@ -0,0 +1,302 @@
+"""
+Request metrics, timing spans and an on-demand profiler.
+
+Metrics records, per (endpoint rule, method), a latency histogram, request
+counts by status and response sizes, plus a latency histogram per named
+span (time() / timed()). Histograms use fixed buckets so an observation is
+a bisect and two additions; a small ring of recent latencies per endpoint
+gives p50/p95/p99 without keeping every sample. render() writes the
+Prometheus text exposition format. Everything is per process: with several
+gunicorn workers each scrape sees the worker that answered it, labelled by
+pid.
+
+Profiler captures cProfile stats for the next N requests once armed and
+merges them into one pstats dump for download. Only one request is profiled
+at a time; concurrent requests pass through unprofiled.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+RECENT = 1024  # latencies kept per endpoint for percentiles
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; counts[i] holds observations <= bounds[i], the last one +Inf"""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            total += n
+            yield bound, total
+
+
+def quantiles(values, qs=QUANTILES):
+    """Nearest-rank quantiles of values (any order)"""
+    ordered = sorted(values)
+    if not ordered:
+        return {q: None for q in qs}
+    return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in qs}
+
+
+def _labels(**labels):
+    return ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in labels.items())
+
+
+def _fmt(value):
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Endpoint:
+    __slots__ = ("latency", "size", "status", "recent")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.status = {}  # status code -> count
+        self.recent = deque(maxlen=RECENT)
+
+
+class Metrics:
+    def __init__(self, prefix="cesium"):
+        self.prefix = prefix
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._endpoints = {}  # (endpoint, method) -> _Endpoint
+        self._spans = {}      # span name -> (Histogram, recent deque)
+        self._gauges = []     # (name, help, fn)
+        self.exceptions = 0
+
+    # -- recording -----------------------------------------------------------
+
+    def observe_request(self, endpoint, method, status, seconds, size=None):
+        with self._lock:
+            ep = self._endpoints.get((endpoint, method))
+            if ep is None:
+                ep = self._endpoints[(endpoint, method)] = _Endpoint()
+            ep.latency.observe(seconds)
+            ep.recent.append(seconds)
+            ep.status[status] = ep.status.get(status, 0) + 1
+            if size is not None:
+                ep.size.observe(size)
+
+    def observe_span(self, name, seconds):
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = (Histogram(LATENCY_BUCKETS), deque(maxlen=RECENT))
+            span[0].observe(seconds)
+            span[1].append(seconds)
+
+    @contextmanager
+    def time(self, name):
+        """Record the duration of the with-block as span `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_span(name, time.perf_counter() - started)
+
+    def timed(self, name=None):
+        """Decorator form of time(); the span defaults to the function name"""
+        def wrapper(func):
+            span = name or func.__name__
+
+            @wraps(func)
+            def inner(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe_span(span, time.perf_counter() - started)
+            return inner
+        return wrapper
+
+    def gauge(self, name, help_text, fn):
+        """Report fn() as gauge `name` at every render()"""
+        self._gauges.append((name, help_text, fn))
+
+    def count_exception(self):
+        with self._lock:
+            self.exceptions += 1
+
+    # -- reading -------------------------------------------------------------
+
+    def summary(self):
+        """JSON-friendly counts, sizes and recent p50/p95/p99 (ms) per endpoint and span"""
+        def ms(qs):
+            return {"p%d" % round(q * 100): (round(v * 1000, 3) if v is not None else None) for q, v in qs.items()}
+
+        with self._lock:
+            endpoints = [
+                {
+                    "endpoint": endpoint,
+                    "method": method,
+                    "count": ep.latency.count,
+                    "status": {str(k): v for k, v in sorted(ep.status.items())},
+                    "mean_ms": round(ep.latency.sum / ep.latency.count * 1000, 3),
+                    "bytes_total": int(ep.size.sum),
+                    **ms(quantiles(ep.recent))
+                } for (endpoint, method), ep in sorted(self._endpoints.items())
+            ]
+            spans = [
+                {
+                    "span": name,
+                    "count": hist.count,
+                    "mean_ms": round(hist.sum / hist.count * 1000, 3),
+                    **ms(quantiles(recent))
+                } for name, (hist, recent) in sorted(self._spans.items())
+            ]
+            exceptions = self.exceptions
+        return {
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started, 1),
+            "exceptions": exceptions,
+            "endpoints": endpoints,
+            "spans": spans
+        }
+
+    def render(self):
+        """Prometheus text exposition (version 0.0.4)"""
+        p = self.prefix
+        pid = os.getpid()
+        out = []
+
+        def family(name, kind, help_text):
+            out.append(f"# HELP {p}_{name} {help_text}")
+            out.append(f"# TYPE {p}_{name} {kind}")
+
+        def histogram(name, hist, **labels):
+            for bound, total in hist.cumulative():
+                out.append(f"{p}_{name}_bucket{{{_labels(**labels, le=_fmt(bound))}}} {total}")
+            out.append(f"{p}_{name}_sum{{{_labels(**labels)}}} {_fmt(hist.sum)}")
+            out.append(f"{p}_{name}_count{{{_labels(**labels)}}} {hist.count}")
+
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            family("http_requests_total", "counter", "Requests answered, by endpoint, method and status")
+            for (endpoint, method), ep in endpoints:
+                for status, n in sorted(ep.status.items()):
+                    out.append(f"{p}_http_requests_total{{{_labels(endpoint=endpoint, method=method, status=status, pid=pid)}}} {n}")
+            family("http_request_duration_seconds", "histogram", "Request latency")
+            for (endpoint, method), ep in endpoints:
+                histogram("http_request_duration_seconds", ep.latency, endpoint=endpoint, method=method, pid=pid)
+            family("http_request_duration_recent_seconds", "gauge",
+                   f"Latency quantiles over the last {RECENT} requests")
+            for (endpoint, method), ep in endpoints:
+                for q, v in quantiles(ep.recent).items():
+                    if v is not None:
+                        out.append(f"{p}_http_request_duration_recent_seconds"
+                                   f"{{{_labels(endpoint=endpoint, method=method, quantile=q, pid=pid)}}} {_fmt(v)}")
+            family("http_response_size_bytes", "histogram", "Response body size, when known up front")
+            for (endpoint, method), ep in endpoints:
+                histogram("http_response_size_bytes", ep.size, endpoint=endpoint, method=method, pid=pid)
+            family("span_duration_seconds", "histogram", "Time spent in instrumented hot paths")
+            for name, (hist, _) in sorted(self._spans.items()):
+                histogram("span_duration_seconds", hist, span=name, pid=pid)
+            family("exceptions_total", "counter", "Unhandled exceptions turned into 500 responses")
+            out.append(f"{p}_exceptions_total{{{_labels(pid=pid)}}} {self.exceptions}")
+        for name, help_text, fn in self._gauges:
+            family(name, "gauge", help_text)
+            out.append(f"{p}_{name}{{{_labels(pid=pid)}}} {_fmt(fn())}")
+        return "\n".join(out) + "\n"
+
+
+class Profiler:
+    """cProfile over the next N requests, merged into one pstats dump"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()  # held while a request is being profiled
+        self.remaining = 0
+        self.captured = 0
+        self.requests = []  # (method, path, ms) of the captured requests
+        self._stats = None
+
+    def arm(self, requests):
+        """Discard any previous capture and profile the next `requests` requests"""
+        with self._lock:
+            self.remaining = requests
+            self.captured = 0
+            self.requests = []
+            self._stats = None
+
+    def start(self):
+        """A running cProfile.Profile for this request, or None when not armed or already busy"""
+        if not self.remaining or not self._busy.acquire(blocking=False):
+            return None
+        with self._lock:
+            if not self.remaining:
+                self._busy.release()
+                return None
+            self.remaining -= 1
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile, label, seconds):
+        profile.disable()
+        try:
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self.captured += 1
+                self.requests.append((*label, round(seconds * 1000, 3)))
+        finally:
+            self._busy.release()
+
+    def status(self):
+        with self._lock:
+            return {
+                "armed": self.remaining > 0,
+                "remaining": self.remaining,
+                "captured": self.captured,
+                "requests": [{"method": m, "path": p, "ms": ms} for m, p, ms in self.requests]
+            }
+
+    def dump(self):
+        """Merged stats in pstats' marshal format (load with pstats.Stats / snakeviz), or None"""
+        with self._lock:
+            if self._stats is None:
+                return None
+            return marshal.dumps(self._stats.stats)
+
+    def text(self, sort="cumulative", limit=60):
+        """The merged stats as pstats' printed table"""
+        with self._lock:
+            if self._stats is None:
+                return None
+            buf = io.StringIO()
+            self._stats.stream = buf
+            self._stats.sort_stats(sort).print_stats(limit)
+            return buf.getvalue()
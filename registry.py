@@ -0,0 +1,500 @@
+"""
+Farm registry.
+
+Each farm is a __slots__ record: the current reading lives in plain float/int
+slots (status as a small code, last update as epoch microseconds) and the
+recent sample window as parallel typed columns. The registry indexes records
+by id, status and zone; the JSON dict shape is only built by to_dict() at the
+serialization boundary.
+
+Records are copy-on-write: a writer changes a copy() and index() installs it,
+so a record a reader holds never changes under it. snapshot() hands out the
+whole farm set as of one completed write without taking a lock.
+"""
+import sys
+import threading
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+from geo import GridIndex
+from samplestore import iso_to_us, us_to_iso
+
+STATUSES = ("Safe", "Medium", "High", "Critical")
+STATUS_CODES = {name: code for code, name in enumerate(STATUSES)}
+_STATUS_LOOKUP = {name.lower(): code for name, code in STATUS_CODES.items()}
+
+# Orders a registry page can be sorted by: name -> key of a farm (ties go by id)
+SORT_KEYS = {
+    "id": lambda farm: farm.id,
+    "value": lambda farm: farm.value,
+    "lastUpdate": lambda farm: farm.updated_us,
+    "name": lambda farm: farm.name.casefold()
+}
+
+# Cell size of the farm position index (~5.5 km): a few cells per radius query at farm density
+SPATIAL_CELL_DEG = 0.05
+
+# Certification sets repeat across farms; share one tuple per distinct set
+_CERTIFICATIONS = {}
+
+
+def _intern(s):
+    return sys.intern(s) if isinstance(s, str) else s
+
+
+def status_code(name):
+    """Case-insensitive status name to code, None if unknown"""
+    return _STATUS_LOOKUP.get(str(name).lower())
+
+
+class History:
+    """A farm's recent samples as columns: epoch-us times, float64 values, inspectors, notes"""
+
+    __slots__ = ("times", "values", "inspectors", "notes")
+
+    def __init__(self):
+        self.times = array("q")
+        self.values = array("d")
+        self.inspectors = []
+        self.notes = []
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, t_us, value, inspector, notes):
+        self.times.append(t_us)
+        self.values.append(value)
+        self.inspectors.append(_intern(inspector))
+        self.notes.append(notes or "")
+
+    def copy(self):
+        other = History.__new__(History)
+        other.times = self.times[:]
+        other.values = self.values[:]
+        other.inspectors = self.inspectors[:]
+        other.notes = self.notes[:]
+        return other
+
+    def appended(self, t_us, value, inspector, notes, keep=None):
+        """A copy with one more sample, holding only the newest `keep` samples"""
+        start = max(len(self.times) + 1 - keep, 0) if keep else 0
+        other = History.__new__(History)
+        other.times = self.times[start:]
+        other.values = self.values[start:]
+        other.inspectors = self.inspectors[start:]
+        other.notes = self.notes[start:]
+        other.times.append(t_us)
+        other.values.append(value)
+        other.inspectors.append(_intern(inspector))
+        other.notes.append(notes or "")
+        return other
+
+    def trim(self, n):
+        """Keep only the newest n samples"""
+        if len(self.times) > n:
+            for col in (self.times, self.values, self.inspectors, self.notes):
+                del col[:-n]
+
+    def sample(self, i):
+        return {
+            "time": us_to_iso(self.times[i]),
+            "inspector": self.inspectors[i],
+            "value": self.values[i],
+            "notes": self.notes[i]
+        }
+
+    def to_dicts(self):
+        return [self.sample(i) for i in range(len(self.times))]
+
+
+class FarmRecord:
+    """One farm; see the module docstring for the layout"""
+
+    __slots__ = ("id", "name", "location", "lat", "lng", "operator", "capacity", "certifications",
+                 "zone", "value", "value_bq", "status_code", "updated_us", "history")
+
+    def __init__(self, id, name, location, lat, lng, operator="", capacity="", certifications=()):
+        self.id = id
+        self.name = name
+        self.location = location
+        self.lat = float(lat)
+        self.lng = float(lng)
+        self.operator = _intern(operator)
+        self.capacity = _intern(capacity)
+        certifications = tuple(certifications)
+        self.certifications = _CERTIFICATIONS.setdefault(certifications, certifications)
+        self.zone = None
+        self.value = 0.0
+        self.value_bq = 0.0
+        self.status_code = 0
+        self.updated_us = 0
+        self.history = History()
+
+    @classmethod
+    def from_dict(cls, d):
+        """Build a record from the API dict shape (history entries with ISO times)"""
+        farm = cls(d["id"], d["name"], d["location"], d["lat"], d["lng"],
+                   d.get("operator", ""), d.get("capacity", ""), d.get("certifications", ()))
+        for h in d.get("history", ()):
+            farm.history.append(iso_to_us(h["time"]), h["value"], h["inspector"], h["notes"])
+        return farm
+
+    def copy(self, history=None):
+        """A private copy for a writer to change and install with index(); history defaults to a copy of this one's"""
+        other = FarmRecord.__new__(FarmRecord)
+        # every slot, spelled out: a setattr loop costs 3x as much on the bulk write path
+        other.id = self.id
+        other.name = self.name
+        other.location = self.location
+        other.lat = self.lat
+        other.lng = self.lng
+        other.operator = self.operator
+        other.capacity = self.capacity
+        other.certifications = self.certifications
+        other.zone = self.zone
+        other.value = self.value
+        other.value_bq = self.value_bq
+        other.status_code = self.status_code
+        other.updated_us = self.updated_us
+        other.history = self.history.copy() if history is None else history
+        return other
+
+    @property
+    def status(self):
+        return STATUSES[self.status_code]
+
+    @property
+    def export_ready(self):
+        return self.status_code <= STATUS_CODES["Medium"]
+
+    @property
+    def last_update(self):
+        return us_to_iso(self.updated_us)
+
+    # Keys of to_dict(), in order ("history" only with include_history)
+    DICT_FIELDS = ("id", "name", "location", "lat", "lng", "operator", "capacity", "certifications", "value",
+                   "value_bq", "status", "lastUpdate", "export_ready", "zone", "history")
+
+    def to_dict(self, include_history=True):
+        out = {
+            "id": self.id,
+            "name": self.name,
+            "location": self.location,
+            "lat": self.lat,
+            "lng": self.lng,
+            "operator": self.operator,
+            "capacity": self.capacity,
+            "certifications": list(self.certifications),
+            "value": self.value,
+            "value_bq": self.value_bq,
+            "status": self.status,
+            "lastUpdate": self.last_update,
+            "export_ready": self.export_ready,
+            "zone": self.zone
+        }
+        if include_history:
+            out["history"] = self.history.to_dicts()
+        return out
+
+
+class FarmView:
+    """The farm set as of one completed write; immutable, so it is read without locks"""
+
+    __slots__ = ("version", "farms")
+
+    def __init__(self, version, farms):
+        self.version = version
+        self.farms = farms  # tuple of FarmRecord, in registry order
+
+    def __len__(self):
+        return len(self.farms)
+
+    def __iter__(self):
+        return iter(self.farms)
+
+    def select(self, status=None, zone=None):
+        """Farms matching the filters, by id (as FarmRegistry.select orders them)"""
+        code = status_code(status) if status is not None else None
+        if status is not None and code is None:
+            return []
+        return sorted((f for f in self.farms
+                       if (code is None or f.status_code == code) and (zone is None or f.zone == zone)),
+                      key=lambda f: f.id)
+
+
+class FarmRegistry:
+    """
+    Farm records by id, with status -> id-set, zone -> id-set and
+    certification -> id-set indexes plus (key, id) lists kept sorted by id,
+    value, last update and name for keyset pages. Iteration follows load
+    order. Writers call index(farm) after changing a farm's status, zone,
+    value or last update, mirroring AggregateStore.upsert(); index() also
+    installs the record, so writers pass in their changed copy.
+
+    spatial is a GridIndex of farm positions behind near(), nearest() and
+    in_bbox(); index() moves a farm in it when its lat/lng changed.
+
+    version counts write brackets (writing()): odd while a write is being
+    applied, even once it is complete. snapshot() caches one FarmView per
+    even version.
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_status = {code: set() for code in range(len(STATUSES))}
+        self.by_zone = {}
+        self.by_cert = {}
+        self.sorted = {name: [] for name in SORT_KEYS}
+        self._keys = {}     # farm id -> (status code, zone, value, updated us) currently indexed
+        self.spatial = GridIndex(cell_deg=SPATIAL_CELL_DEG)
+        self._lock = threading.Lock()
+        self.version = 0
+        self._view = FarmView(-1, ())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"], state["_view"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._view = FarmView(-1, ())
+        if not self.version % 2:  # checkpoints are written between writes
+            self._view = FarmView(self.version, tuple(self.by_id.values()))
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def get(self, fid):
+        try:
+            return self.by_id.get(fid)
+        except TypeError:   # unhashable id from a JSON body
+            return None
+
+    @contextmanager
+    def writing(self, publish=True):
+        """
+        Bracket one write (writers are serialized by the caller). On exit the
+        new farm set is published for snapshot(), a copy of the id -> record
+        pointers; replays pass publish=False and leave it to the next reader.
+        """
+        self.version += 1
+        try:
+            yield
+        finally:
+            self.version += 1
+            if publish:
+                self._view = FarmView(self.version, tuple(self.by_id.values()))
+
+    def snapshot(self):
+        """
+        FarmView of the last completed write. Readers never wait: while a write
+        is in progress they get the view published before it.
+        """
+        view = self._view
+        version = self.version
+        if view.version == version or version % 2:
+            return view
+        farms = tuple(self.by_id.values())  # one C-level pass; no other thread runs in between
+        if self.version != version:
+            return view  # a write started meanwhile; the copy may be half-applied
+        self._view = view = FarmView(version, farms)
+        return view
+
+    def load(self, records):
+        """Replace every record; readers see either the old or the new set, never a mix"""
+        fresh = FarmRegistry()
+        for farm in records:
+            fresh.by_id[farm.id] = farm
+            fresh.by_status[farm.status_code].add(farm.id)
+            fresh.by_zone.setdefault(farm.zone, set()).add(farm.id)
+            for cert in farm.certifications:
+                fresh.by_cert.setdefault(cert, set()).add(farm.id)
+            fresh._keys[farm.id] = (farm.status_code, farm.zone, farm.value, farm.updated_us)
+            fresh.spatial.insert(farm.id, farm.lat, farm.lng)
+        for name, key in SORT_KEYS.items():
+            fresh.sorted[name] = sorted((key(farm), farm.id) for farm in records)
+        with self._lock:
+            self.by_id, self.by_status, self.by_zone, self.by_cert, self.sorted, self._keys, self.spatial = (
+                fresh.by_id, fresh.by_status, fresh.by_zone, fresh.by_cert, fresh.sorted, fresh._keys,
+                fresh.spatial)
+        if not self.version % 2:
+            # outside writing(): the load is a completed write of its own, published for snapshot()
+            self.version += 2
+            self._view = FarmView(self.version, tuple(self.by_id.values()))
+
+    def index(self, farm):
+        """Install a farm record and refresh its status, zone, value, last-update and position entries"""
+        key = (farm.status_code, farm.zone, farm.value, farm.updated_us)
+        with self._lock:
+            self.by_id[farm.id] = farm
+            if self.spatial.points.get(farm.id) != (farm.lat, farm.lng):
+                self.spatial.insert(farm.id, farm.lat, farm.lng)
+            old = self._keys.get(farm.id)
+            if old == key:
+                return
+            if old is None:
+                for cert in farm.certifications:
+                    self.by_cert.setdefault(cert, set()).add(farm.id)
+                insort(self.sorted["id"], (farm.id, farm.id))
+                insort(self.sorted["name"], (SORT_KEYS["name"](farm), farm.id))
+            else:
+                self.by_status[old[0]].discard(farm.id)
+                self.by_zone[old[1]].discard(farm.id)
+                for name, value in (("value", old[2]), ("lastUpdate", old[3])):
+                    ranked = self.sorted[name]
+                    del ranked[bisect_left(ranked, (value, farm.id))]
+            self.by_status[key[0]].add(farm.id)
+            self.by_zone.setdefault(key[1], set()).add(farm.id)
+            insort(self.sorted["value"], (farm.value, farm.id))
+            insort(self.sorted["lastUpdate"], (farm.updated_us, farm.id))
+            self._keys[farm.id] = key
+
+    def index_many(self, farms):
+        """
+        index() for many records. Past a quarter of the registry the set indexes
+        are updated in one pass and the sorted lists rebuilt once, instead of an
+        O(n) insort per farm.
+        """
+        if len(farms) * 4 < len(self.by_id):
+            for farm in farms:
+                self.index(farm)
+            return
+        with self._lock:
+            added = False
+            for farm in farms:
+                fid = farm.id
+                self.by_id[fid] = farm
+                if self.spatial.points.get(fid) != (farm.lat, farm.lng):
+                    self.spatial.insert(fid, farm.lat, farm.lng)
+                key = (farm.status_code, farm.zone, farm.value, farm.updated_us)
+                old = self._keys.get(fid)
+                if old == key:
+                    continue
+                if old is None:
+                    added = True
+                    for cert in farm.certifications:
+                        self.by_cert.setdefault(cert, set()).add(fid)
+                else:
+                    self.by_status[old[0]].discard(fid)
+                    self.by_zone[old[1]].discard(fid)
+                self.by_status[key[0]].add(fid)
+                self.by_zone.setdefault(key[1], set()).add(fid)
+                self._keys[fid] = key
+            keys = self._keys
+            self.sorted["value"] = sorted([(k[2], fid) for fid, k in keys.items()])
+            self.sorted["lastUpdate"] = sorted([(k[3], fid) for fid, k in keys.items()])
+            if added:
+                for name in ("id", "name"):
+                    self.sorted[name] = sorted([(SORT_KEYS[name](f), f.id) for f in self.by_id.values()])
+
+    def _filter_sets(self, status, zone, certification):
+        """Index sets the filters restrict to; None in the list means a filter matches nothing"""
+        sets = []
+        if status is not None:
+            code = status_code(status)
+            sets.append(self.by_status[code] if code is not None else None)
+        if zone is not None:
+            sets.append(self.by_zone.get(zone))
+        if certification is not None:
+            sets.append(self.by_cert.get(certification))
+        return sets
+
+    def select(self, status=None, zone=None, certification=None, export_ready=None):
+        """Farms matching an optional status name (any case), zone id, certification and export_ready, in id order"""
+        if status is None and zone is None and certification is None and export_ready is None:
+            return list(self)
+        if status is None and zone is None and certification is None:
+            return self.page(export_ready=export_ready)[0]
+        with self._lock:
+            sets = self._filter_sets(status, zone, certification)
+            if None in sets:
+                return []
+            ids = sorted(set.intersection(*sets) if len(sets) > 1 else sets[0])
+            by_id = self.by_id
+        farms = [by_id[fid] for fid in ids]
+        if export_ready is not None:
+            farms = [f for f in farms if f.export_ready == export_ready]
+        return farms
+
+    def page(self, sort="id", descending=False, after=None, limit=None,
+             status=None, zone=None, certification=None, export_ready=None):
+        """
+        Keyset page: up to `limit` farms in (sort key, id) order, starting after
+        the (key, id) position `after`. Returns (farms, matching total).
+        With set filters, a selective filter (under 1/16 of the farms) is sorted
+        directly; otherwise the sorted index is walked from `after`, so a page
+        costs O(log n + limit x n / matches) either way.
+        """
+        with self._lock:
+            sets = self._filter_sets(status, zone, certification)
+            if None in sets:
+                return [], 0
+            by_id = self.by_id
+            keyfn = SORT_KEYS[sort]
+            sets.sort(key=len)
+
+            def matches(fid):
+                return (all(fid in s for s in sets)
+                        and (export_ready is None or by_id[fid].export_ready == export_ready))
+
+            if sets and len(sets[0]) * 16 <= len(by_id):
+                ranked = sorted((keyfn(by_id[fid]), fid) for fid in sets[0] if matches(fid))
+                total = len(ranked)
+                source = ranked
+            else:
+                source = self.sorted[sort]
+                total = None
+            if descending:
+                end = bisect_left(source, after) if after is not None else len(source)
+                walk = (source[i] for i in range(end - 1, -1, -1))
+            else:
+                start = bisect_right(source, after) if after is not None else 0
+                walk = (source[i] for i in range(start, len(source)))
+            out = []
+            for _, fid in walk:
+                if limit is not None and len(out) >= limit:
+                    break
+                if total is not None or matches(fid):
+                    out.append(by_id[fid])
+            if total is None:
+                total = self._count(sets, export_ready)
+        return out, total
+
+    def near(self, lat, lng, km, limit=None):
+        """([(farm, distance_km)] within km of a point, nearest first (ties by id), matching total)"""
+        with self._lock:
+            hits = sorted((d, fid) for fid, d in self.spatial.within(lat, lng, km))
+            by_id = self.by_id
+            return [(by_id[fid], d) for d, fid in hits[:limit]], len(hits)
+
+    def nearest(self, lat, lng, k):
+        """[(farm, distance_km)] of the k farms closest to a point, nearest first"""
+        with self._lock:
+            by_id = self.by_id
+            return [(by_id[fid], d) for fid, d in self.spatial.nearest_k(lat, lng, k)]
+
+    def in_bbox(self, south, west, north, east, limit=None):
+        """([farm] inside a lat/lng box in id order, matching total); west > east crosses the antimeridian"""
+        with self._lock:
+            ids = sorted(self.spatial.in_bbox(south, west, north, east))
+            by_id = self.by_id
+            return [by_id[fid] for fid in ids[:limit]], len(ids)
+
+    def _count(self, sets, export_ready):
+        """Matching farms for the walked-index case (every set filter is large there)"""
+        if not sets and export_ready is None:
+            return len(self.by_id)
+        if export_ready is None:
+            base = sets[0] if len(sets) == 1 else set.intersection(*sets)
+            return len(base)
+        ready = sum(len(self.by_status[c]) for c in range(STATUS_CODES["Medium"] + 1))
+        if not sets:
+            return ready if export_ready else len(self.by_id) - ready
+        base = set.intersection(*sets) if len(sets) > 1 else sets[0]
+        return sum(1 for fid in base if self.by_id[fid].export_ready == export_ready)
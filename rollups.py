@@ -0,0 +1,261 @@
+"""
+Time-bucketed rollups of farm and zone samples.
+
+Every sample lands in one bucket per resolution (hour, day, week) of the
+farm's series and of its zone's series; a bucket keeps count, sum, min, max,
+the latest value and a Welford sum of squared deviations, so a range query
+(and its pooled mean and spread) costs O(log buckets + buckets in range)
+regardless of how many raw samples the range covers. Bucket starts
+are kept in a sorted array per series; samples almost always arrive in time
+order, so adding one is an append. Hourly buckets are capped per series
+(HOUR_BUCKETS) so a long-running process does not grow without bound.
+
+A series pickles as two flat arrays and is only unpacked into its bucket
+dict when it is next read or written, so restoring a checkpoint does not pay
+for the series nobody asks about.
+"""
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+HOUR = 3600 * 10**6
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+RESOLUTIONS = {"hour": HOUR, "day": DAY, "week": WEEK}
+_WEEK_OFFSET = 4 * DAY  # the epoch is a Thursday; weeks start on Monday
+
+HOUR_BUCKETS = 24 * 90  # hourly buckets kept per series
+
+
+def bucket_start(t_us, step):
+    """Start (epoch us) of the bucket of width step containing t_us"""
+    if step == WEEK:
+        return (t_us - _WEEK_OFFSET) // WEEK * WEEK + _WEEK_OFFSET
+    return t_us // step * step
+
+
+class _Series:
+    """Buckets of one farm or zone at one resolution"""
+
+    __slots__ = ("starts", "buckets", "limit", "_packed")
+
+    def __init__(self, limit=None):
+        self.starts = array("q")
+        self.buckets = {}  # start -> [count, sum, min, max, last time, last value, m2]
+        self.limit = limit
+        self._packed = None
+
+    def __getstate__(self):
+        if self._packed is not None:
+            return self._packed
+        flat = array("d")
+        for start in self.starts:
+            flat.extend(self.buckets[start])
+        return self.limit, self.starts, flat
+
+    def __setstate__(self, state):
+        self.limit = state[0]
+        self._packed = state
+        self.starts = self.buckets = None
+
+    def _unpack(self):
+        _, self.starts, flat = self._packed
+        self._packed = None
+        self.buckets = {
+            start: [int(flat[i]), flat[i + 1], flat[i + 2], flat[i + 3], int(flat[i + 4]), flat[i + 5], flat[i + 6]]
+            for start, i in zip(self.starts, range(0, len(flat), 7))
+        }
+
+    def rows(self):
+        """[[start, count, sum, min, max, last time, last value, m2], ...] oldest first"""
+        if self._packed is not None:
+            self._unpack()
+        return [[s] + self.buckets[s] for s in self.starts]
+
+    def add(self, start, t_us, value):
+        if self._packed is not None:
+            self._unpack()
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            self.buckets[start] = [1, value, value, value, t_us, value, 0.0]
+            if not self.starts or start > self.starts[-1]:
+                self.starts.append(start)
+            else:
+                self.starts.insert(bisect_left(self.starts, start), start)
+            if self.limit and len(self.starts) > self.limit:
+                del self.buckets[self.starts[0]]
+                del self.starts[0]
+            return
+        delta = value - bucket[1] / bucket[0]
+        bucket[0] += 1
+        bucket[1] += value
+        bucket[6] += delta * (value - bucket[1] / bucket[0])
+        if value < bucket[2]:
+            bucket[2] = value
+        if value > bucket[3]:
+            bucket[3] = value
+        if t_us >= bucket[4]:
+            bucket[4] = t_us
+            bucket[5] = value
+
+    def merge(self, start, t_us, count, total, lo, hi, m2, last):
+        """Fold a group of samples taken at t_us (count, sum, min, max, m2, last value) into a bucket"""
+        if self._packed is not None:
+            self._unpack()
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            self.add(start, t_us, last)
+            bucket = self.buckets.get(start)
+            if bucket is not None:  # else older than every kept hour bucket, as add() drops it
+                bucket[:4] = [count, total, lo, hi]
+                bucket[6] = m2
+            return
+        n = bucket[0] + count
+        delta = total / count - bucket[1] / bucket[0]
+        bucket[6] += m2 + delta * delta * bucket[0] * count / n  # Chan et al.
+        bucket[0] = n
+        bucket[1] += total
+        bucket[2] = min(bucket[2], lo)
+        bucket[3] = max(bucket[3], hi)
+        if t_us >= bucket[4]:
+            bucket[4] = t_us
+            bucket[5] = last
+
+    def range(self, from_us, to_us):
+        """Buckets whose start lies in [from_us, to_us], oldest first"""
+        if self._packed is not None:
+            self._unpack()
+        lo = bisect_left(self.starts, from_us) if from_us is not None else 0
+        hi = bisect_right(self.starts, to_us) if to_us is not None else len(self.starts)
+        return [(s, self.buckets[s]) for s in self.starts[lo:hi]]
+
+
+class RollupStore:
+    """Hour/day/week rollups per farm ("farm", id) and per zone ("zone", id)"""
+
+    def __init__(self, hour_buckets=HOUR_BUCKETS):
+        self.hour_buckets = hour_buckets
+        self.reset()
+
+    def reset(self):
+        self.series = {}  # (scope, id) -> {resolution: _Series}
+
+    def _series(self, key):
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {
+                name: _Series(self.hour_buckets if step == HOUR else None)
+                for name, step in RESOLUTIONS.items()
+            }
+        return series
+
+    def add(self, farm_id, zone, t_us, value):
+        """Count one sample of a farm, taken while it belonged to zone"""
+        starts = [(name, bucket_start(t_us, step)) for name, step in RESOLUTIONS.items()]
+        for key in (("farm", farm_id), ("zone", zone)):
+            series = self._series(key)
+            for name, start in starts:
+                series[name].add(start, t_us, value)
+
+    def add_many(self, farm_ids, zones, t_us, values):
+        """
+        add() of one sample per farm, all taken at t_us: each farm series takes
+        its sample, each zone series takes its farms' samples as one merge.
+        """
+        starts = [(name, bucket_start(t_us, step)) for name, step in RESOLUTIONS.items()]
+        by_zone = {}
+        for fid, zone, value in zip(farm_ids, zones, values):
+            series = self.series.get(("farm", fid)) or self._series(("farm", fid))
+            for name, start in starts:
+                s_series = series[name]
+                bucket = s_series.buckets.get(start) if s_series._packed is None else None
+                if bucket is None or t_us < bucket[4]:
+                    s_series.add(start, t_us, value)
+                    continue
+                # _Series.add() for the common case, inlined: a later sample into an existing bucket
+                delta = value - bucket[1] / bucket[0]
+                bucket[0] += 1
+                bucket[1] += value
+                bucket[6] += delta * (value - bucket[1] / bucket[0])
+                if value < bucket[2]:
+                    bucket[2] = value
+                if value > bucket[3]:
+                    bucket[3] = value
+                bucket[4] = t_us
+                bucket[5] = value
+            by_zone.setdefault(zone, []).append(value)
+        for zone, group in by_zone.items():
+            count = len(group)
+            total = math.fsum(group)
+            mean = total / count
+            m2 = math.fsum([(v - mean) ** 2 for v in group])
+            lo, hi = min(group), max(group)
+            series = self._series(("zone", zone))
+            for name, start in starts:
+                series[name].merge(start, t_us, count, total, lo, hi, m2, group[-1])
+
+    def discard(self, farm_id):
+        self.series.pop(("farm", farm_id), None)
+
+    def query(self, scope, key, step, from_us=None, to_us=None):
+        """[(bucket start us, count, min, max, mean, last), ...] for buckets starting in [from_us, to_us]"""
+        series = self.series.get((scope, key))
+        if series is None:
+            return []
+        if from_us is not None:
+            from_us = bucket_start(from_us, RESOLUTIONS[step])
+        return [(start, b[0], b[2], b[3], b[1] / b[0], b[5]) for start, b in series[step].range(from_us, to_us)]
+
+    def merged(self, scope, keys, step, from_us=None, to_us=None):
+        """query() of several series (e.g. every zone) added together bucket by bucket"""
+        if from_us is not None:
+            from_us = bucket_start(from_us, RESOLUTIONS[step])
+        out = {}
+        for key in keys:
+            series = self.series.get((scope, key))
+            for start, b in series[step].range(from_us, to_us) if series else ():
+                acc = out.get(start)
+                if acc is None:
+                    out[start] = b[:6]
+                    continue
+                acc[0] += b[0]
+                acc[1] += b[1]
+                acc[2] = min(acc[2], b[2])
+                acc[3] = max(acc[3], b[3])
+                if b[4] > acc[4]:
+                    acc[4], acc[5] = b[4], b[5]
+        return [(start, b[0], b[2], b[3], b[1] / b[0], b[5]) for start, b in sorted(out.items())]
+
+    def stats(self, scope, key, step, from_us=None, to_us=None):
+        """(count, mean, sample stdev, min, max) of every sample in the buckets starting in [from_us, to_us], None if none"""
+        series = self.series.get((scope, key))
+        if series is None:
+            return None
+        if from_us is not None:
+            from_us = bucket_start(from_us, RESOLUTIONS[step])
+        buckets = [b for _, b in series[step].range(from_us, to_us)]
+        if not buckets:
+            return None
+        count = sum(b[0] for b in buckets)
+        mean = sum(b[1] for b in buckets) / count
+        m2 = sum(b[6] + b[0] * (b[1] / b[0] - mean) ** 2 for b in buckets)  # pooled (Chan et al.)
+        stdev = math.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+        return count, mean, stdev, min(b[2] for b in buckets), max(b[3] for b in buckets)
+
+    def to_state(self):
+        return {
+            "series": [
+                [scope, key, {name: s_series.rows() for name, s_series in series.items()}]
+                for (scope, key), series in self.series.items()
+            ]
+        }
+
+    def load_state(self, state):
+        self.reset()
+        for scope, key, resolutions in state["series"]:
+            series = self._series((scope, key))
+            for name, rows in resolutions.items():
+                s_series = series[name]
+                for start, *bucket in rows:
+                    s_series.starts.append(start)
+                    s_series.buckets[start] = bucket if len(bucket) == 7 else bucket + [0.0]  # snapshot from before m2
@@ -0,0 +1,391 @@
+"""
+Durable sample history.
+
+Every reading is appended to a binary log (farm_id, epoch microseconds,
+value, inspector id, notes offset). Once the log grows past a threshold it
+is compacted into an immutable columnar segment: per-farm contiguous runs
+of float32 values, int64 times, int32 inspector ids and int64 notes
+offsets, memory-mapped on open. A JSON manifest names the live segments
+and the current log generation and is swapped atomically, so a crash
+mid-compaction leaves the previous state intact.
+
+Opening a store maps each segment index and replays only the uncompacted
+log tail; history reads within one segment are zero-copy memoryview
+slices. Several processes may share a directory as long as their writes
+are serialized externally; refresh() picks up what the others wrote.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+from itertools import islice
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+ONE_US = timedelta(microseconds=1)
+
+LOG_RECORD = struct.Struct("<qqfiq")   # farm_id, t_us, value, inspector_id, notes_off
+LOG_DTYPE = np.dtype([("farm_id", "<i8"), ("t_us", "<i8"), ("value", "<f4"), ("inspector", "<i4"), ("notes", "<i8")])
+INDEX_RECORD = struct.Struct("<qqq")   # farm_id, start row, row count
+NOTE_LEN = struct.Struct("<I")
+COLUMNS = (("times", "q"), ("values", "f"), ("inspectors", "i"), ("notes", "q"))
+
+
+def iso_to_us(time_iso):
+    return (datetime.fromisoformat(time_iso) - EPOCH) // ONE_US
+
+
+def us_to_iso(t_us):
+    return (EPOCH + timedelta(microseconds=t_us)).isoformat()
+
+
+class Segment:
+    """One compacted, read-only columnar segment mapped into memory"""
+
+    def __init__(self, path):
+        self.path = path
+        self._maps = []
+        self.index = {}
+        raw = self._map("index.bin", "B")
+        for i in range(len(raw) // INDEX_RECORD.size):
+            fid, start, count = INDEX_RECORD.unpack_from(raw, i * INDEX_RECORD.size)
+            self.index[fid] = (start, count)
+        self.cols = {name: self._map(name + ".col", code) for name, code in COLUMNS}
+
+    def _map(self, name, code):
+        with open(os.path.join(self.path, name), "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return memoryview(b"").cast(code)
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm).cast(code)
+
+    def chunk(self, farm_id):
+        """Zero-copy (times, values, inspectors, notes) slices for one farm, or None"""
+        span = self.index.get(farm_id)
+        if span is None:
+            return None
+        start, count = span
+        return tuple(self.cols[name][start:start + count] for name, _ in COLUMNS)
+
+    def close(self):
+        self.cols = {}
+        for mm in self._maps:
+            try:
+                mm.close()
+            except BufferError:
+                pass  # a reader still holds a slice; the map is freed with it
+        self._maps = []
+
+
+class SampleStore:
+    """Append-only log plus memory-mapped columnar segments under one directory"""
+
+    def __init__(self, path, compact_threshold=200_000, max_segments=8):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self.max_segments = max_segments
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self.segments = [Segment(os.path.join(path, name)) for name in self.manifest["segments"]]
+        self.inspectors = self._read_inspectors()
+        self.inspector_ids = {name: i for i, name in enumerate(self.inspectors)}
+        self._notes = open(os.path.join(path, "notes.dat"), "a+b")
+        self._tail = {}        # farm_id -> list of (t_us, value, inspector_id, notes_off)
+        self._tail_rows = 0
+        self._log_pos = 0      # bytes of the current log generation already in _tail
+        self._torn = False     # the log ends in a partial record, cut off before the next append
+        self._replay_log()
+        self._log = open(self._log_path(), "ab")
+        self._inspectors_fh = open(os.path.join(path, "inspectors.txt"), "a", encoding="utf-8")
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.path, "manifest.json"), encoding="utf-8") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {"segments": [], "log": 0, "next_segment": 1}
+
+    def _write_manifest(self, manifest):
+        tmp = os.path.join(self.path, "manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, os.path.join(self.path, "manifest.json"))
+        self.manifest = manifest
+
+    def _log_path(self, generation=None):
+        gen = self.manifest["log"] if generation is None else generation
+        return os.path.join(self.path, f"samples-{gen:06d}.log")
+
+    def _read_inspectors(self):
+        try:
+            with open(os.path.join(self.path, "inspectors.txt"), encoding="utf-8") as fh:
+                return [line.rstrip("\n") for line in fh]
+        except FileNotFoundError:
+            return []
+
+    def _replay_log(self):
+        try:
+            with open(self._log_path(), "rb") as fh:
+                fh.seek(self._log_pos)
+                data = fh.read()
+        except FileNotFoundError:
+            return
+        usable = len(data) - len(data) % LOG_RECORD.size  # drop a torn trailing record
+        self._torn = usable < len(data)
+        for fid, t_us, value, insp, note in LOG_RECORD.iter_unpack(memoryview(data)[:usable]):
+            self._tail.setdefault(fid, []).append((t_us, value, insp, note))
+            self._tail_rows += 1
+        self._log_pos += usable
+
+    def refresh(self):
+        """Pick up samples, inspectors and compactions written by other processes"""
+        with self.lock:
+            manifest = self._read_manifest()
+            if manifest != self.manifest:
+                try:
+                    segments = [Segment(os.path.join(self.path, name)) for name in manifest["segments"]]
+                except FileNotFoundError:
+                    return  # a merge is swapping segments right now; the next refresh sees the result
+                for seg in self.segments:
+                    seg.close()
+                self.segments = segments
+                self.manifest = manifest
+                self._log.close()
+                self._log = open(self._log_path(), "ab")
+                self._tail = {}
+                self._tail_rows = 0
+                self._log_pos = 0
+            with open(os.path.join(self.path, "inspectors.txt"), encoding="utf-8") as fh:
+                for line in islice(fh, len(self.inspectors), None):
+                    if not line.endswith("\n"):
+                        break  # still being written
+                    self.inspector_ids[line[:-1]] = len(self.inspectors)
+                    self.inspectors.append(line[:-1])
+            self._replay_log()
+
+    def _inspector_id(self, name):
+        name = (name or "").replace("\n", " ")
+        iid = self.inspector_ids.get(name)
+        if iid is None:
+            iid = len(self.inspectors)
+            self.inspectors.append(name)
+            self.inspector_ids[name] = iid
+            self._inspectors_fh.write(name + "\n")
+        return iid
+
+    def _cut_torn_tail(self):
+        """
+        Truncate a partial record left by a crashed writer, so the next append starts on a
+        record boundary; writers are serialized, so nobody is still writing it.
+        """
+        if self._torn:
+            self._log.flush()
+            os.truncate(self._log_path(), self._log_pos)
+            self._torn = False
+
+    def _note_offset(self, notes):
+        if not notes:
+            return -1
+        data = notes.encode("utf-8")
+        self._notes.seek(0, os.SEEK_END)
+        offset = self._notes.tell()
+        self._notes.write(NOTE_LEN.pack(len(data)) + data)
+        return offset
+
+    def append(self, farm_id, time_iso, value, inspector, notes):
+        """Buffer one sample; call commit() to make the batch durable"""
+        with self.lock:
+            self._cut_torn_tail()
+            # the tail holds the value as the log stores it (float32), so reads agree before and after reopen
+            row = (iso_to_us(time_iso), float(np.float32(value)), self._inspector_id(inspector),
+                   self._note_offset(notes))
+            self._log.write(LOG_RECORD.pack(farm_id, *row))
+            self._log_pos += LOG_RECORD.size
+            self._tail.setdefault(farm_id, []).append(row)
+            self._tail_rows += 1
+
+    def append_many(self, farm_ids, time_iso, values, inspector, notes):
+        """append() of one sample per farm sharing time, inspector and notes, written as one block"""
+        with self.lock:
+            self._cut_torn_tail()
+            t_us = iso_to_us(time_iso)
+            iid = self._inspector_id(inspector)
+            note = self._note_offset(notes)
+            rows = np.empty(len(farm_ids), LOG_DTYPE)
+            rows["farm_id"] = farm_ids
+            rows["t_us"] = t_us
+            rows["value"] = values
+            rows["inspector"] = iid
+            rows["notes"] = note
+            self._log.write(rows.tobytes())
+            self._log_pos += rows.nbytes
+            tail = self._tail
+            for fid, value in zip(farm_ids, rows["value"].tolist()):
+                tail.setdefault(fid, []).append((t_us, value, iid, note))
+            self._tail_rows += len(rows)
+
+    def _flush(self, fsync):
+        # notes and inspectors first, so a durable log row never points at missing data
+        for fh in (self._notes, self._inspectors_fh, self._log):
+            fh.flush()
+            if fsync:
+                os.fsync(fh.fileno())
+
+    def commit(self, fsync=True):
+        """Make buffered samples durable; compacts once the log tail is large enough"""
+        with self.lock:
+            self._flush(fsync)
+            if self._tail_rows >= self.compact_threshold:
+                self.compact()
+
+    def _write_segment(self, name, farm_chunks):
+        """farm_chunks: sorted iterable of (farm_id, [columns...]) with equal-length columns"""
+        seg_path = os.path.join(self.path, name)
+        os.makedirs(seg_path, exist_ok=True)
+        files = {col: open(os.path.join(seg_path, col + ".col"), "wb") for col, _ in COLUMNS}
+        index = bytearray()
+        start = 0
+        try:
+            for fid, cols in farm_chunks:
+                count = len(cols[0])
+                if not count:
+                    continue
+                for (col, code), data in zip(COLUMNS, cols):
+                    files[col].write(memoryview(data).cast("B") if isinstance(data, memoryview) else _pack(code, data))
+                index += INDEX_RECORD.pack(fid, start, count)
+                start += count
+        finally:
+            for fh in files.values():
+                fh.flush()
+                os.fsync(fh.fileno())
+                fh.close()
+        with open(os.path.join(seg_path, "index.bin"), "wb") as fh:
+            fh.write(index)
+            fh.flush()
+            os.fsync(fh.fileno())
+        return Segment(seg_path)
+
+    def compact(self):
+        """Move the log tail into a new segment and start a fresh log generation"""
+        with self.lock:
+            if not self._tail_rows:
+                return
+            self._flush(fsync=True)
+            name = f"seg-{self.manifest['next_segment']:06d}"
+            chunks = ((fid, list(zip(*rows))) for fid, rows in sorted(self._tail.items()))
+            segment = self._write_segment(name, chunks)
+            old_log = self._log_path()
+            self._log.close()
+            manifest = {
+                "segments": self.manifest["segments"] + [name],
+                "log": self.manifest["log"] + 1,
+                "next_segment": self.manifest["next_segment"] + 1
+            }
+            self._write_manifest(manifest)
+            self._log = open(self._log_path(), "ab")
+            os.remove(old_log)
+            self.segments.append(segment)
+            self._tail = {}
+            self._tail_rows = 0
+            self._log_pos = 0
+            if len(self.segments) > self.max_segments:
+                self._merge_segments()
+
+    def _merge_segments(self):
+        """Fold all segments into one so per-farm reads stay a single slice"""
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        farm_ids = sorted(set().union(*(seg.index for seg in self.segments)))
+
+        def chunks():
+            for fid in farm_ids:
+                parts = [c for c in (seg.chunk(fid) for seg in self.segments) if c is not None]
+                yield fid, [[x for part in parts for x in part[i]] for i in range(len(COLUMNS))]
+
+        merged = self._write_segment(name, chunks())
+        old = self.segments
+        self._write_manifest({
+            "segments": [name],
+            "log": self.manifest["log"],
+            "next_segment": self.manifest["next_segment"] + 1
+        })
+        self.segments = [merged]
+        for seg in old:
+            seg.close()
+            _remove_tree(seg.path)
+
+    def farm_ids(self):
+        with self.lock:
+            ids = set(self._tail)
+            for seg in self.segments:
+                ids.update(seg.index)
+            return ids
+
+    def chunks(self, farm_id):
+        """Oldest-first list of (times, values, inspectors, notes) chunks; segment chunks are zero-copy"""
+        with self.lock:
+            out = [c for c in (seg.chunk(farm_id) for seg in self.segments) if c is not None]
+            tail = self._tail.get(farm_id)
+            if tail:
+                out.append(tuple(list(col) for col in zip(*tail)))
+            return out
+
+    def note(self, offset):
+        if offset < 0:
+            return ""
+        with self.lock:
+            self._notes.flush()
+            (length,) = NOTE_LEN.unpack(os.pread(self._notes.fileno(), NOTE_LEN.size, offset))
+            return os.pread(self._notes.fileno(), length, offset + NOTE_LEN.size).decode("utf-8")
+
+    def rows(self, farm_id, since=None, limit=None):
+        """History as app-shaped dicts, newest `limit` rows at or after `since` (ISO)"""
+        since_us = iso_to_us(since) if since else None
+        picked = []
+        remaining = limit
+        for times, values, inspectors, notes in reversed(self.chunks(farm_id)):
+            start = bisect_left(times, since_us) if since_us is not None else 0
+            end = len(times)
+            lo = start if remaining is None else max(start, end - remaining)
+            picked.append((times[lo:end], values[lo:end], inspectors[lo:end], notes[lo:end]))
+            if remaining is not None:
+                remaining -= end - lo
+                if remaining <= 0:
+                    break
+            if start > 0:
+                break
+        out = []
+        for times, values, inspectors, notes in reversed(picked):
+            for t, v, i, n in zip(times, values, inspectors, notes):
+                out.append({
+                    "time": us_to_iso(t),
+                    "inspector": self.inspectors[i] if 0 <= i < len(self.inspectors) else "",
+                    "value": round(v, 4),
+                    "notes": self.note(n)
+                })
+        return out
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            for fh in (self._log, self._notes, self._inspectors_fh):
+                fh.close()
+            for seg in self.segments:
+                seg.close()
+
+
+def _pack(code, data):
+    return struct.pack(f"<{len(data)}{code}", *data)
+
+
+def _remove_tree(path):
+    for name in os.listdir(path):
+        os.remove(os.path.join(path, name))
+    os.rmdir(path)
@@ -0,0 +1,96 @@
+"""
+JSON encoding for responses.
+
+dumps() uses orjson when it is installed and the stdlib encoder otherwise;
+both produce compact UTF-8 bytes and understand NumPy scalars/arrays and
+whatever Flask's own encoder handles (dates, UUIDs, dataclasses).
+JSONProvider plugs dumps() into Flask so every jsonify() uses it.
+
+FragmentCache keeps the encoded JSON of individual farms so list responses
+are assembled by joining bytes; a farm's fragments are reused until that
+farm's record is replaced.
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+ENCODER = "orjson" if orjson else "json"
+
+_flask_default = DefaultJSONProvider.default
+
+
+def _default(o):
+    if hasattr(o, "tolist"):  # NumPy scalars and arrays
+        return o.tolist()
+    return _flask_default(o)
+
+
+if orjson:
+    _OPTS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(obj, sort_keys=False, indent=False):
+        opts = _OPTS
+        if sort_keys:
+            opts |= orjson.OPT_SORT_KEYS
+        if indent:
+            opts |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=opts)
+else:
+    def dumps(obj, sort_keys=False, indent=False):
+        return json.dumps(obj, default=_default, sort_keys=sort_keys, indent=2 if indent else None,
+                          separators=None if indent else (",", ":")).encode()
+
+
+def join_array(fragments):
+    """JSON array from already-encoded elements"""
+    return b"[" + b",".join(fragments) + b"]"
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by dumps()"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, sort_keys=kwargs.get("sort_keys", self.sort_keys),
+                     indent=bool(kwargs.get("indent"))).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(dumps(obj, sort_keys=self.sort_keys, indent=indent) + b"\n",
+                                        mimetype=self.mimetype)
+
+
+class FragmentCache:
+    """
+    Encoded JSON per (farm record, variant). Entries remember the record they
+    were built from and miss for any other, so a reader holding an older
+    record (copy-on-write) never gets, or leaves, bytes of the wrong version;
+    invalidate(fid) just frees them early.
+    """
+
+    def __init__(self):
+        self._frags = {}  # farm id -> (record, {variant: bytes})
+
+    def __len__(self):
+        return sum(len(v[1]) for v in list(self._frags.values()))
+
+    def get(self, farm, variant, build):
+        """Cached bytes for this farm record and variant, encoding build() on a miss"""
+        entry = self._frags.get(farm.id)
+        if entry is None or entry[0] is not farm:
+            entry = self._frags[farm.id] = (farm, {})
+        data = entry[1].get(variant)
+        if data is None:
+            data = entry[1][variant] = dumps(build(), sort_keys=True)
+        return data
+
+    def invalidate(self, fid):
+        self._frags.pop(fid, None)
+
+    def clear(self):
+        self._frags.clear()
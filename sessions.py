@@ -0,0 +1,97 @@
+"""
+Stateless login sessions.
+
+A session is an HS256 JWT carrying the username, role, issue/expiry times
+and a random id (jti). Verifying one is a signature check plus a lookup in
+the revocation set, with no store round trip, so any worker process can
+authenticate any request. Logout revokes the jti until the token would have
+expired anyway; expired revocations are evicted in expiry order, so the set
+only ever holds tokens that are still live. Recently verified tokens are
+remembered in a bounded map so repeat requests skip the HMAC as well.
+"""
+import heapq
+import threading
+import time
+from uuid import uuid4
+
+import bcrypt
+import jwt
+
+ALGORITHM = "HS256"
+DEFAULT_TTL = 12 * 3600
+VERIFIED_CACHE = 4096  # recently verified tokens kept per process
+
+
+def hash_password(password, rounds=12):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def check_password(password, password_hash):
+    return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+
+class SessionManager:
+    """secret: the signing key, or a callable returning it, resolved on first use"""
+
+    def __init__(self, secret, ttl=DEFAULT_TTL):
+        self._secret = secret
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.revoked = {}    # jti -> exp
+        self._expiry = []    # heap of (exp, jti) over revoked
+        self._verified = {}  # token -> claims, at most VERIFIED_CACHE entries
+
+    @property
+    def secret(self):
+        if callable(self._secret):
+            self._secret = self._secret()
+        return self._secret
+
+    def issue(self, username, role, now=None):
+        now = int(now or time.time())
+        claims = {"sub": username, "role": role, "iat": now, "exp": now + self.ttl, "jti": uuid4().hex}
+        return jwt.encode(claims, self.secret, algorithm=ALGORITHM)
+
+    def verify(self, token):
+        """Claims of a valid, unexpired, unrevoked token, else None"""
+        claims = self._verified.get(token)
+        if claims is None:
+            try:
+                claims = jwt.decode(token, self.secret, algorithms=[ALGORITHM],
+                                    options={"require": ["sub", "exp", "iat", "jti"]})
+            except jwt.InvalidTokenError:
+                return None
+            if len(self._verified) >= VERIFIED_CACHE:
+                self._verified.clear()
+            self._verified[token] = claims
+        elif claims["exp"] <= time.time():
+            return None
+        if claims["jti"] in self.revoked:
+            return None
+        return claims
+
+    def revoke(self, jti, exp, now=None):
+        """Reject jti from now on; forgotten once exp has passed"""
+        with self._lock:
+            self._evict(now or time.time())
+            if exp > (now or time.time()) and jti not in self.revoked:
+                self.revoked[jti] = exp
+                heapq.heappush(self._expiry, (exp, jti))
+
+    def _evict(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, jti = heapq.heappop(self._expiry)
+            self.revoked.pop(jti, None)
+
+    def revocations(self):
+        """[[jti, exp], ...] of the live revocations, for snapshots"""
+        with self._lock:
+            self._evict(time.time())
+            return [[jti, exp] for jti, exp in self.revoked.items()]
+
+    def load_revocations(self, rows):
+        with self._lock:
+            self.revoked = {}
+            self._expiry = []
+        for jti, exp in rows:
+            self.revoke(jti, exp)
@@ -0,0 +1,391 @@
+"""
+State shared by several worker processes.
+
+Every change to farm data is an event appended to a SQLite (WAL) log inside
+BEGIN IMMEDIATE, which serializes writers across processes. Each process
+keeps its registry, aggregates and caches as an in-memory replica and
+applies the log in seq order, so all workers converge on the same state.
+Request readers never query the log; they only take the process-local read
+lock so they never observe a half-applied event. Shared settings (such as
+the session signing key) and job records live in the same database so any
+worker can answer for them.
+
+Every `snapshot_every` events a snapshot of the full state is appended and
+older events are deleted; a process that falls behind the deleted range
+reloads from the newest snapshot.
+
+Replaying a large snapshot rebuilds every index from JSON, so a process can
+also keep a checkpoint file: a pickled image of its replica tagged with the
+log it came from and the seq it reflects. start() restores the checkpoint
+when it is still on the current log and replays only the events after it.
+The file is rewritten after a slow replay and after every compaction. It is
+loaded with pickle, so it must live in a directory only the app can write.
+"""
+import gc
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    doc TEXT NOT NULL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class RWLock:
+    """
+    Many readers or one writer, writer-preferring.
+    The writing thread may re-enter write() and may read(); nested read()
+    calls never block. A reader cannot upgrade to a writer.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        depth = getattr(self._local, "reads", 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.reads = depth + 1
+            try:
+                yield
+            finally:
+                self._local.reads = depth
+            return
+        with self._cond:
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        self._local.reads = 1
+        try:
+            yield
+        finally:
+            self._local.reads = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+            else:
+                if getattr(self._local, "reads", 0):
+                    raise RuntimeError("cannot take the write lock while holding a read lock")
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+                self._write_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+class SharedState:
+    """
+    Replicated event log plus settings and job tables in one SQLite file.
+    apply(kind, payload) updates this process's replica; persist(kind, payload)
+    runs once, in the writing process, after every apply of its write succeeded
+    and before the write commits;
+    snapshot() returns a "load" payload reproducing the current replica.
+    image() returns a picklable replica and restore(image) installs one (or
+    raises to refuse it); with a checkpoint path they back the checkpoint file.
+    The database is opened on first use; path None means a private temporary file.
+    """
+
+    def __init__(self, path, apply, persist=None, snapshot=None, snapshot_every=10000, lock=None,
+                 image=None, restore=None, checkpoint=None, checkpoint_after=0.25):
+        self.path = path
+        self.apply = apply
+        self.persist = persist
+        self.snapshot = snapshot
+        self.snapshot_every = snapshot_every
+        self.lock = lock or RWLock()
+        self.image = image
+        self.restore = restore
+        self.checkpoint = checkpoint
+        self.checkpoint_after = checkpoint_after  # seconds of replay that warrant a new checkpoint
+        self.seq = 0            # last event applied to this replica
+        self.replaying = False  # True while start() replays the existing log
+        self._since_snapshot = 0
+        self._diverged = False  # a failed apply may have half-changed the replica
+        self._log_id = None
+        self._local = threading.local()
+        self._open_lock = threading.Lock()
+        self._opened = False
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with self._open_lock:
+                if self.path is None:
+                    self.path = os.path.join(tempfile.mkdtemp(prefix="cesium-state-"), "state.db")
+                conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+                if not self._opened:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(SCHEMA)
+                    self._opened = True
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # -- event log -----------------------------------------------------------
+
+    def start(self, poll_interval=0.5):
+        """
+        Restore the checkpoint if it is usable and replay the rest of the log,
+        then keep the replica current from a background thread.
+        """
+        started = time.perf_counter()
+        self.replaying = True
+        try:
+            with self.lock.write():
+                conn = self._conn()
+                if self.seq == 0 and self.checkpoint and self.restore:
+                    self._restore_checkpoint(conn)
+                replayed = self._catch_up(conn)
+        finally:
+            self.replaying = False
+        if replayed and self.checkpoint and time.perf_counter() - started >= self.checkpoint_after:
+            self.save_checkpoint()
+
+        def poll():
+            while True:
+                time.sleep(poll_interval)
+                try:
+                    self.sync()
+                except sqlite3.Error:
+                    logger.exception("shared state sync failed")
+
+        threading.Thread(target=poll, name="shared-state-sync", daemon=True).start()
+
+    def sync(self):
+        """Apply events committed by other processes since this thread last looked"""
+        conn = self._conn()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == getattr(self._local, "data_version", None):
+            return  # no other connection has committed since
+        with self.lock.write():
+            self._catch_up(conn)
+        self._local.data_version = version
+
+    def current(self):
+        """True if this replica holds every committed event; one read of the log's last seq, no lock"""
+        (last,) = self._conn().execute("SELECT max(seq) FROM events").fetchone()
+        return not self._diverged and (last or 0) <= self.seq
+
+    def _catch_up(self, conn):
+        """Apply the events after self.seq; returns how many were read"""
+        cur = conn.execute("SELECT seq, kind, payload FROM events WHERE seq > ? ORDER BY seq", (self.seq,))
+        first = cur.fetchone()
+        if first is None and not self._diverged:
+            return 0
+        if self._diverged or first[0] != self.seq + 1:
+            # the events we still needed were compacted away, or a failed write left the
+            # replica half-changed: restart from the newest snapshot
+            (start,) = conn.execute(
+                "SELECT max(seq) FROM events WHERE kind IN ('load', 'snapshot')").fetchone()
+            if start is None:
+                return 0
+            cur = conn.execute("SELECT seq, kind, payload FROM events WHERE seq >= ? ORDER BY seq", (start,))
+            first = cur.fetchone()
+            first = (first[0], "load", first[2])
+            self._diverged = False
+        count = 0
+        for seq, kind, payload in _chain(first, cur):
+            if kind == "snapshot":
+                self._since_snapshot = 0  # replicas that applied every event already hold this state
+            else:
+                self.apply(kind, json.loads(payload))
+                self._since_snapshot += 1
+            self.seq = seq
+            count += 1
+        return count
+
+    @contextmanager
+    def writing(self):
+        """
+        Exclusive write section across all processes.
+        Catches the replica up, yields a list for (kind, payload) events, then
+        logs and applies them in order, persists them and commits. An event
+        whose apply raises is rolled back with the rest of the batch, so it
+        never reaches the log (where every later catch-up would fail on it
+        again) or the persist side effects; the replica is then reloaded from
+        the log's newest snapshot.
+        """
+        conn = self._conn()
+        with self.lock.write():
+            conn.execute("BEGIN IMMEDIATE")
+            events = []
+            try:
+                self._catch_up(conn)
+                yield events
+                logged = []
+                for kind, payload in events:
+                    cur = conn.execute(
+                        "INSERT INTO events (kind, payload, created_at) VALUES (?, ?, ?)",
+                        (kind, json.dumps(payload, separators=(",", ":")), time.time()))
+                    logged.append((cur.lastrowid, kind, payload))
+                seq = self.seq
+                try:
+                    for seq, kind, payload in logged:
+                        self.apply(kind, payload)
+                    if self.persist:
+                        for _, kind, payload in logged:
+                            self.persist(kind, payload)
+                except BaseException:
+                    self._diverged = True
+                    raise
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                if self._diverged:
+                    self._catch_up(conn)  # readers never see the half-applied event
+                raise
+            self.seq = seq
+            self._since_snapshot += len(logged)
+            if self.snapshot and self._since_snapshot >= self.snapshot_every:
+                self._write_snapshot(conn)
+
+    def _write_snapshot(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._catch_up(conn)
+            cur = conn.execute(
+                "INSERT INTO events (kind, payload, created_at) VALUES ('snapshot', ?, ?)",
+                (json.dumps(self.snapshot(), separators=(",", ":")), time.time()))
+            conn.execute("DELETE FROM events WHERE seq < ?", (cur.lastrowid,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.seq = cur.lastrowid
+        self._since_snapshot = 0
+        if self.checkpoint:
+            self.save_checkpoint()
+
+    # -- checkpoint ----------------------------------------------------------
+
+    def log_id(self):
+        """Random id of this log, so a checkpoint is never applied to a different database"""
+        if self._log_id is None:
+            self._log_id = self.setting("log_id", lambda: uuid4().hex)
+        return self._log_id
+
+    def save_checkpoint(self):
+        """Write (log id, seq, image()) to the checkpoint file atomically; returns the seq"""
+        with self.lock.read():
+            seq = self.seq
+            data = pickle.dumps((self.log_id(), seq, self.image()), protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = f"{self.checkpoint}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, self.checkpoint)
+        return seq
+
+    def _restore_checkpoint(self, conn):
+        try:
+            with open(self.checkpoint, "rb") as fh:
+                data = fh.read()
+            gc.disable()  # millions of fresh objects; collecting them mid-load only costs time
+            try:
+                log_id, seq, image = pickle.loads(data)
+                del data
+                gc.freeze()  # and they live as long as the process, so keep them out of later collections
+            finally:
+                gc.enable()
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning("unreadable replica checkpoint, replaying the log: %s", e)
+            return False
+        base, last = conn.execute(
+            "SELECT max(CASE WHEN kind IN ('load', 'snapshot') THEN seq END), max(seq) FROM events").fetchone()
+        if log_id != self.log_id() or base is None or not base <= seq <= last:
+            return False  # another log, or compacted past it
+        try:
+            self.restore(image)
+        except Exception as e:
+            logger.warning("replica checkpoint rejected, replaying the log: %s", e)
+            return False
+        self.seq = seq
+        return True
+
+    # -- settings ------------------------------------------------------------
+
+    def setting(self, name, default):
+        """Value of a shared setting; the first process to ask stores default() for everyone"""
+        conn = self._conn()
+        conn.execute("INSERT OR IGNORE INTO settings VALUES (?, ?)", (name, default()))
+        return conn.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()[0]
+
+    # -- jobs ----------------------------------------------------------------
+
+    def save_job(self, job_id, doc):
+        self._conn().execute(
+            "INSERT INTO jobs (id, doc, created_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET doc = excluded.doc",
+            (job_id, json.dumps(doc), time.time()))
+
+    def load_job(self, job_id):
+        """(doc, cancel requested) or None"""
+        row = self._conn().execute("SELECT doc, cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return (json.loads(row[0]), bool(row[1])) if row else None
+
+    def list_jobs(self, limit=200):
+        rows = self._conn().execute(
+            "SELECT doc FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [json.loads(doc) for (doc,) in rows]
+
+    def request_cancel(self, job_id):
+        return self._conn().execute("UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,)).rowcount > 0
+
+    def cancel_requested(self, job_id):
+        row = self._conn().execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def delete_jobs(self, job_ids):
+        self._conn().executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in job_ids])
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
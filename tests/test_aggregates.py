@@ -0,0 +1,317 @@
+"""Incremental dashboard aggregates against the original full scans of the live farms"""
+import random
+from datetime import datetime, timedelta
+from fractions import Fraction
+
+import pytest
+
+import app
+from aggregates import AggregateStore
+from bench.synthetic import make_farms
+from registry import FarmRecord
+
+
+# -----------------------
+# Oracle: the full scans agg_stats, compute_zone_aggregation and compute_intel
+# ran before the aggregates, over FarmRecords instead of farm dicts
+# -----------------------
+def mean(vals):
+    """Correctly rounded mean, as the store's exact sums give (a float sum may round a .xx5 mean the other way)"""
+    return float(sum(map(Fraction, vals)) / len(vals))
+
+
+def scan_zone_aggregation(farms):
+    farms = sorted(farms, key=lambda f: f.id)
+    zone_values = {k: [] for k in app.ZONES_META.keys()}
+    zone_farms = {k: [] for k in app.ZONES_META.keys()}
+    for f in farms:
+        zid = app.closest_zone_id(f.lat, f.lng)
+        if not zid:
+            continue
+        zone_values[zid].append(f.value)
+        zone_farms[zid].append(f)
+    zones_out = []
+    for zid, meta in app.ZONES_META.items():
+        vals = zone_values[zid]
+        avg_val = round(mean(vals), 2) if vals else 0
+        severity = app.get_status(avg_val)
+        radius_map = {"Critical": 140000, "High": 80000, "Medium": 50000, "Safe": 30000}
+        radius = radius_map.get(severity, 30000)
+        top_farm = None
+        export_ready_count = 0
+        if zone_farms[zid]:
+            top_farm = max(zone_farms[zid], key=lambda x: x.value)
+            export_ready_count = sum(1 for f in zone_farms[zid] if f.export_ready)
+        zones_out.append({
+            "id": zid,
+            "name": meta["name"],
+            "center": meta.get("display_center", meta["center"]),
+            "avg": avg_val,
+            "avg_bq": app.ppb_to_bq(avg_val),
+            "severity": severity,
+            "radius_m": radius,
+            "top_farm": {
+                "id": top_farm.id,
+                "name": top_farm.name,
+                "value": top_farm.value,
+                "value_bq": top_farm.value_bq
+            } if top_farm else None,
+            "count_farms": len(zone_farms[zid]),
+            "export_ready": export_ready_count
+        })
+    return sorted(zones_out, key=lambda x: x["avg"], reverse=True)
+
+
+def scan_stats(farms):
+    """The scan's stats; its timeseries is the mean of every farm's i-th daily sample"""
+    farms = sorted(farms, key=lambda f: f.id)
+    vals = [f.value for f in farms]
+    if not vals:
+        return {"total": 0, "avg": 0, "max": 0, "min": 0}
+    now = datetime.utcnow()
+    total = len(farms)
+    avgv = round(mean(vals), 2)
+    critical = sum(1 for v in vals if v >= app.THRESHOLD_CRITICAL)
+    high = sum(1 for v in vals if app.THRESHOLD_HIGH <= v < app.THRESHOLD_CRITICAL)
+    medium = sum(1 for v in vals if app.THRESHOLD_MEDIUM <= v < app.THRESHOLD_HIGH)
+    safe = sum(1 for v in vals if v < app.THRESHOLD_MEDIUM)
+    top_hotspots = sorted([
+        {
+            "id": f.id,
+            "name": f.name,
+            "location": f.location,
+            "value": f.value,
+            "value_bq": f.value_bq,
+            "status": f.status
+        } for f in farms
+    ], key=lambda x: x["value"], reverse=True)[:5]
+    days = len(farms[0].history) if farms else 0
+    timeseries = []
+    for i in range(days):
+        vals_day = [f.history.values[i] if i < len(f.history) else f.value for f in farms]
+        date_obj = now - timedelta(days=days-i-1)
+        timeseries.append({
+            "t": date_obj.date().isoformat(),
+            "v": round(mean(vals_day), 2),
+            "label": date_obj.strftime("%d %b")
+        })
+    export_ready = sum(1 for f in farms if f.export_ready)
+    fda_compliant = sum(1 for f in farms if f.value_bq < app.FDA_INTERVENTION_LEVEL)
+    return {
+        "total": total,
+        "avg": avgv,
+        "avg_bq": app.ppb_to_bq(avgv),
+        "max": max(vals),
+        "min": min(vals),
+        "critical": critical,
+        "high": high,
+        "medium": medium,
+        "safe": safe,
+        "export_ready": export_ready,
+        "fda_compliant": fda_compliant,
+        "top_hotspots": top_hotspots,
+        "timeseries": timeseries
+    }
+
+
+def scan_intel(farms):
+    """The scan's intel fields that still mean the same; sampling_queue holds every overdue id"""
+    now_utc = datetime.utcnow()
+    stats = scan_stats(farms)
+    zones = scan_zone_aggregation(farms)
+
+    overdue = 0
+    for f in farms:
+        last_dt = datetime.fromisoformat(f.last_update)
+        if now_utc - last_dt > timedelta(hours=app.SAMPLING_SLA_HOURS):
+            overdue += 1
+
+    high_alert_zones = [z for z in zones if z["severity"] in ("High", "Critical")]
+    priority_zones = []
+    for z in high_alert_zones[:3]:
+        action = "Deploy task force & lock exports" if z["severity"] == "Critical" else "Schedule intensified sampling"
+        priority_zones.append({
+            "name": z["name"],
+            "severity": z["severity"],
+            "avg": z["avg"],
+            "count": z["count_farms"],
+            "action": action
+        })
+
+    export_gateways = [
+        {
+            "name": "Tanjung Priok",
+            "status": "Surveillance" if stats["critical"] else "Normal",
+            "risk": "High" if stats["critical"] > 2 else ("Medium" if stats["high"] > 1 else "Low"),
+            "throughput": "52 shipments / week"
+        },
+        {
+            "name": "Belawan Medan",
+            "status": "Heightened sampling" if stats["high"] else "Normal",
+            "risk": "Medium" if stats["high"] else "Low",
+            "throughput": "31 shipments / week"
+        },
+        {
+            "name": "Makassar Port",
+            "status": "Normal",
+            "risk": "Low",
+            "throughput": "18 shipments / week"
+        }
+    ]
+
+    sampling_queue = sorted(
+        f.id for f in farms
+        if (now_utc - datetime.fromisoformat(f.last_update)).total_seconds() / 3600 > app.SAMPLING_SLA_HOURS)
+
+    return {
+        "sampling_backlog": overdue,
+        "pending_samples": stats["high"] + stats["critical"],
+        "sla_pressure": round((overdue / stats["total"]) * 100, 1) if stats["total"] else 0,
+        "priority_zones": priority_zones,
+        "export_gateways": export_gateways,
+        "sampling_queue": sampling_queue
+    }
+
+
+def without_timeseries(stats):
+    return {k: v for k, v in stats.items() if k != "timeseries"}
+
+
+def make_farm(rnd, fid):
+    farm = FarmRecord(fid, f"Farm {fid}", "Test", rnd.uniform(-9, 6), rnd.uniform(95, 141))
+    set_reading(rnd, farm)
+    return farm
+
+
+def set_reading(rnd, farm):
+    farm.history.append(1_700_000_000_000_000 + rnd.randrange(10 ** 9), round(rnd.uniform(0, 160), 2), "t", "")
+    app.init_farm(farm)
+
+
+@pytest.fixture
+def aggregates(monkeypatch):
+    store = AggregateStore(app.ZONES_META.keys(), app.FDA_INTERVENTION_LEVEL)
+    monkeypatch.setattr(app, "AGGREGATES", store)
+    return store
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_add_move_delete_matches_scan(aggregates, seed):
+    rnd = random.Random(seed)
+    live = {}
+    next_id = 1
+    for step in range(600):
+        op = rnd.random()
+        if op < 0.4 or not live:
+            farm = make_farm(rnd, next_id)
+            next_id += 1
+        elif op < 0.8:
+            farm = live[rnd.choice(list(live))].copy()
+            if rnd.random() < 0.5:
+                farm.lat, farm.lng = rnd.uniform(-9, 6), rnd.uniform(95, 141)  # move, possibly across zones
+            set_reading(rnd, farm)
+        else:
+            fid = rnd.choice(list(live))
+            del live[fid]
+            aggregates.discard(fid)
+            continue
+        live[farm.id] = farm
+        aggregates.upsert(farm)
+
+        if step % 50 == 0 or step == 599:
+            assert app.compute_zone_aggregation() == scan_zone_aggregation(live.values())
+            assert without_timeseries(app.agg_stats()) == without_timeseries(scan_stats(live.values()))
+
+
+def test_matches_brute_force(aggregates):
+    rnd = random.Random(7)
+    live = {}
+    for fid in range(1, 400):
+        live[fid] = make_farm(rnd, fid)
+        aggregates.upsert(live[fid])
+    for fid in rnd.sample(sorted(live), 100):
+        aggregates.discard(live.pop(fid).id)
+    for fid in rnd.sample(sorted(live), 100):
+        live[fid] = live[fid].copy()
+        set_reading(rnd, live[fid])
+        aggregates.upsert(live[fid])
+
+    assert aggregates.total == len(live)
+    assert aggregates.all.value_sum == pytest.approx(sum(f.value for f in live.values()))
+    for zid, group in aggregates.zones.items():
+        members = [f for f in live.values() if f.zone == zid]
+        assert group.count == len(members)
+        assert group.export_ready == sum(f.export_ready for f in members)
+        if members:
+            assert group.mean() == pytest.approx(sum(f.value for f in members) / len(members))
+            top = max(members, key=lambda f: (f.value, -f.id))
+            assert aggregates.top(1, zone=zid)[0].id == top.id
+    for status in ("Safe", "Medium", "High", "Critical"):
+        assert aggregates.count(status) == sum(f.status == status for f in live.values())
+    assert aggregates.fda_compliant == sum(f.value_bq < app.FDA_INTERVENTION_LEVEL for f in live.values())
+    assert aggregates.max_value() == max(f.value for f in live.values())
+    assert aggregates.min_value() == min(f.value for f in live.values())
+
+
+def test_rejects_non_finite_values(aggregates):
+    farm = make_farm(random.Random(0), 1)
+    aggregates.upsert(farm)
+    bad = farm.copy()
+    bad.value = float("nan")
+    with pytest.raises(ValueError):
+        aggregates.upsert(bad)
+    assert aggregates.max_value() == farm.value
+
+
+def write(fids, values, time_iso):
+    with app.SHARED.writing() as events:
+        events.append(app.readings_event([(fid, [(v, "t", "")]) for fid, v in zip(fids, values)], time_iso))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_loaded_registry_and_writes_match_scan(seed):
+    rnd = random.Random(seed)
+    # one sample per farm per day up to today: the scan's i-th-sample timeseries is then a per-day mean
+    app.load_farms(make_farms(300, history_points=app.TIMESERIES_DAYS, seed=seed))
+    farms = list(app.FARMS)
+    stats = app.agg_stats()
+    expected = scan_stats(farms)
+    assert [(p["t"], p["label"]) for p in stats["timeseries"]] == [(p["t"], p["label"]) for p in expected["timeseries"]]
+    for got, want in zip(stats["timeseries"], expected["timeseries"]):
+        assert got["v"] == pytest.approx(want["v"], abs=0.01 + 1e-9)  # rollups sum in another order
+    assert without_timeseries(stats) == without_timeseries(expected)
+    assert app.compute_zone_aggregation() == scan_zone_aggregation(farms)
+
+    stale = datetime.utcnow() - timedelta(hours=40)  # past the 36 h SLA until a write refreshes the farm
+    app.load_farms(make_farms(300, history_points=app.TIMESERIES_DAYS, seed=seed, now=stale))
+    app.DISPATCH.advance(app.iso_to_us(datetime.utcnow().isoformat()))
+    ids = [f.id for f in farms]
+    for hours_ago in (12, 1):
+        fids = rnd.sample(ids, 100)
+        write(fids, [round(rnd.uniform(0, 120), 2) for _ in fids],
+              (datetime.utcnow() - timedelta(hours=hours_ago)).isoformat())
+    write(ids[:5], [float(v) for v in range(5)], (stale - timedelta(hours=10)).isoformat())  # late, out of order
+
+    farms = list(app.FARMS)
+    assert without_timeseries(app.agg_stats()) == without_timeseries(scan_stats(farms))
+    assert app.compute_zone_aggregation() == scan_zone_aggregation(farms)
+    intel = app.compute_intel()
+    expected = scan_intel(farms)
+    queue = expected.pop("sampling_queue")
+    assert {k: intel[k] for k in expected} == expected
+    overdue, entries = app.DISPATCH.page(app.iso_to_us(datetime.utcnow().isoformat()), limit=len(farms))
+    assert 0 < overdue == len(queue) < len(farms)
+    assert sorted(e["farm_id"] for e in entries) == queue
+
+    # the timeseries holds the mean of every sample taken on each of the last TIMESERIES_DAYS days
+    by_day = {}
+    for f in farms:
+        for t_us, value in zip(f.history.times, f.history.values):
+            by_day.setdefault(app.us_to_iso(t_us)[:10], []).append(value)
+    today = datetime.utcnow().date()
+    days = [(today - timedelta(days=d)).isoformat() for d in range(app.TIMESERIES_DAYS - 1, -1, -1)]
+    timeseries = app.agg_stats()["timeseries"]
+    assert [p["t"] for p in timeseries] == [d for d in days if d in by_day]
+    for point in timeseries:
+        vals = by_day[point["t"]]
+        assert point["v"] == pytest.approx(round(mean(vals), 2), abs=0.01 + 1e-9)
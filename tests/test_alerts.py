@@ -0,0 +1,127 @@
+"""Alert engine: hysteresis around the thresholds, rate alerts, acks and change cursors"""
+import random
+
+import pytest
+
+import app
+from alerts import CLEARED, CRITICAL, LEVEL, OPEN, RATE, WARNING, AlertEngine
+from bench.synthetic import make_farms
+
+
+def feed(engine, values, farm_id=1):
+    """(change, severity, trigger) after each reading of one farm"""
+    out = []
+    prev = None
+    for i, value in enumerate(values):
+        alert, change = engine.evaluate(farm_id, value, prev, "t%d" % i)
+        out.append((change, alert.severity, alert.trigger) if alert else None)
+        prev = value
+    return out
+
+
+def test_level_alert_holds_until_the_value_leaves_the_band():
+    engine = AlertEngine(60, 45, band=5, rate_jump=15)
+    assert feed(engine, [40, 46, 41, 40, 39.9, 44, 45]) == [
+        None,
+        ("opened", WARNING, LEVEL),
+        ("updated", WARNING, LEVEL),
+        ("updated", WARNING, LEVEL),  # exactly high - band still holds
+        ("cleared", WARNING, LEVEL),
+        None,                         # below high with no alert open: the band does not apply
+        ("opened", WARNING, LEVEL),
+    ]
+
+
+def test_critical_hysteresis_and_escalation():
+    engine = AlertEngine(60, 45, band=5, rate_jump=15)
+    assert feed(engine, [61, 56, 55, 54.9, 59.9, 60, 60, 39]) == [
+        ("opened", CRITICAL, LEVEL),
+        ("updated", CRITICAL, LEVEL),
+        ("updated", CRITICAL, LEVEL),
+        ("deescalated", WARNING, LEVEL),
+        ("updated", WARNING, LEVEL),  # back under critical: a warning does not re-escalate early
+        ("escalated", CRITICAL, LEVEL),
+        None,                         # same value, nothing to report
+        ("cleared", CRITICAL, LEVEL),
+    ]
+    assert len(engine.by_id) == 1 and not engine.open
+
+
+def test_rate_alert_clears_at_its_baseline_or_turns_into_a_level_alert():
+    engine = AlertEngine(60, 45, band=5, rate_jump=15)
+    assert feed(engine, [10, 25, 30, 11, 10]) == [
+        None, ("opened", WARNING, RATE), ("updated", WARNING, RATE), ("updated", WARNING, RATE),
+        ("cleared", WARNING, RATE)]
+    assert feed(engine, [10, 26, 46], farm_id=2) == [None, ("opened", WARNING, RATE), ("escalated", WARNING, LEVEL)]
+    assert engine.open[2].baseline == 10
+
+
+def test_ack_once_kept_on_deescalation_reset_on_escalation():
+    engine = AlertEngine(60, 45, band=5, rate_jump=15)
+    alert, _ = engine.evaluate(1, 62, None, "t0")
+    assert engine.ack(alert.id, "ana", "t1") is alert and alert.acked_by == "ana"
+    assert engine.ack(alert.id, "budi", "t2") is None and alert.acked_by == "ana"
+    engine.evaluate(1, 50, 62, "t3")
+    assert (alert.severity, alert.acked_by) == (WARNING, "ana")
+    engine.evaluate(1, 65, 50, "t4")
+    assert (alert.severity, alert.acked_by, alert.acked_at) == (CRITICAL, None, None)
+    assert engine.ack(alert.id, "budi", "t5") is alert
+    engine.evaluate(1, 10, 65, "t6")
+    assert alert.status == CLEARED and engine.ack(alert.id, "citra", "t7") is None
+    assert engine.ack(999, "citra", "t8") is None
+
+
+def test_since_returns_changes_in_order_until_history_is_evicted():
+    engine = AlertEngine(60, 45, band=5, rate_jump=15, keep_cleared=3)
+    a1, _ = engine.evaluate(1, 50, None, "t")
+    cursor = engine.seq
+    a2, _ = engine.evaluate(2, 70, None, "t")
+    engine.ack(a1.id, "ana", "t")
+    assert [(a.id, a.seq) for a in engine.since(cursor)] == [(a2.id, cursor + 1), (a1.id, cursor + 2)]
+    assert engine.since(engine.seq) == []
+    for fid in range(3, 8):  # open and clear five alerts; only three cleared ones are kept
+        engine.evaluate(fid, 50, None, "t")
+        engine.evaluate(fid, 0, 50, "t")
+    assert engine.since(cursor) is None
+    assert engine.since(engine.floor) is not None
+    assert {a.farm_id for a in engine.since(engine.floor)} >= {6, 7}
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_evaluate_many_and_state_round_trip_match_sequential_evaluate(seed):
+    rnd = random.Random(seed)
+    bulk, single = AlertEngine(60, 45), AlertEngine(60, 45)
+    values = {fid: rnd.uniform(0, 70) for fid in range(1, 301)}
+    for step in range(25):
+        fids = sorted(rnd.sample(list(values), 200))
+        new = [max(0.0, values[f] + rnd.gauss(0, 12)) for f in fids]
+        prev = [values[f] for f in fids]
+        changes = bulk.evaluate_many(fids, new, prev, "t%d" % step)
+        expected = [single.evaluate(f, v, p, "t%d" % step) for f, v, p in zip(fids, new, prev)]
+        assert [(a.id, c) for a, c in changes] == [(a.id, c) for a, c in expected if a]
+        values.update(zip(fids, new))
+        if step % 8 == 7:
+            restored = AlertEngine(60, 45)
+            restored.load_state(bulk.to_state())
+            bulk = restored
+    assert bulk.to_state() == single.to_state()
+
+
+def test_ack_endpoint():
+    app.load_farms(make_farms(20, history_points=2))
+    client = app.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer " + app.generate_token("inspector")
+    farm = next(iter(app.FARMS))
+    with app.SHARED.writing() as events:
+        events.append(app.readings_event([(farm.id, [(80.0, "Ana", "")])]))
+    alert = app.ALERTS.open[farm.id]
+    cursor = client.get("/api/alerts").get_json()["cursor"]
+    first = client.post(f"/api/alerts/{alert.id}/ack")
+    assert first.status_code == 200 and first.get_json()["alert"]["status"] == OPEN
+    again = client.post(f"/api/alerts/{alert.id}/ack")
+    assert again.status_code == 409
+    changed = client.get("/api/alerts", query_string={"since": cursor}).get_json()
+    assert [a["id"] for a in changed["alerts"]] == [alert.id] and not changed["reset"]
+    with app.SHARED.writing() as events:
+        events.append(app.readings_event([(farm.id, [(1.0, "Ana", "")])]))
+    assert client.post(f"/api/alerts/{alert.id}/ack").status_code == 404
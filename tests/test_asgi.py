@@ -0,0 +1,72 @@
+"""WSGIBridge answers RESPONSE_CACHE hits and 304s on the event loop and sends the rest to Flask"""
+import asyncio
+
+import pytest
+
+import app
+import asgi
+from bench.synthetic import make_farms
+
+
+@pytest.fixture
+def bridge():
+    bridge = asgi.create_app()
+    app.load_farms(make_farms(100))
+    handled = []
+    wsgi_app = bridge.wsgi_app
+
+    def counting(environ, start_response):
+        handled.append(environ["PATH_INFO"])
+        return wsgi_app(environ, start_response)
+    bridge.wsgi_app = counting
+    bridge.handled = handled
+    yield bridge
+    bridge.executor.shutdown()
+
+
+def get(bridge, path, headers=()):
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "http_version": "1.1",
+             "headers": [(k.encode(), v.encode()) for k, v in headers], "client": ("127.0.0.1", 1)}
+    sent = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.sleep(3600)  # the client stays connected
+
+    async def send(message):
+        sent.append(message)
+    asyncio.run(bridge.http(scope, receive, send))
+    return sent[0]["status"], dict(sent[0]["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_hits_and_304s_skip_the_app(bridge):
+    status, headers, body = get(bridge, "/api/zones")
+    assert status == 200 and bridge.handled == ["/api/zones"]
+    status, hit, again = get(bridge, "/api/zones")
+    assert (status, hit[b"etag"], again) == (200, headers[b"etag"], body)
+    status, _, body = get(bridge, "/api/zones", [("If-None-Match", headers[b"etag"].decode())])
+    assert (status, body) == (304, b"")
+    assert bridge.handled == ["/api/zones"]
+
+
+def test_query_args_in_any_order_share_an_entry(bridge):
+    first = get(bridge, "/api/heatmap?bbox=-9,104,-5,115&zoom=7")[2]
+    assert get(bridge, "/api/heatmap?zoom=7&bbox=-9,104,-5,115")[2] == first
+    assert bridge.handled == ["/api/heatmap"]
+
+
+def test_writes_login_cors_and_a_stale_replica_go_to_the_app(bridge, monkeypatch):
+    _, headers, _ = get(bridge, "/api/stats")
+    with app.SHARED.writing() as events:
+        events.append(app.readings_event([(1, [(99.0, "t", "")])]))
+    status, _, _ = get(bridge, "/api/stats", [("If-None-Match", headers[b"etag"].decode())])
+    assert status == 200 and bridge.handled == ["/api/stats"] * 2
+    _, cors, _ = get(bridge, "/api/stats", [("Origin", "http://example.org")])
+    assert cors[b"access-control-allow-origin"] == b"http://example.org"
+    assert get(bridge, "/api/dispatch")[0] == get(bridge, "/api/dispatch")[0] == 401
+    monkeypatch.setattr(app.SHARED, "current", lambda: False)
+    get(bridge, "/api/stats")
+    assert bridge.handled == ["/api/stats"] * 3 + ["/api/dispatch"] * 2 + ["/api/stats"]
@@ -0,0 +1,80 @@
+"""A committed simulation's "batch" event leaves every store as the per-farm "readings" path does"""
+import random
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import app
+from bench.synthetic import make_farms
+
+FARMS = 400
+
+
+def state():
+    """Everything the stores expose, rounded where the two paths may sum floats in a different order"""
+    farms = {f.id: f.to_dict() for f in app.FARMS}
+    zones = sorted(app.ZONES_META)
+    forecast = app.FORECASTS.forecast(3)
+    return {
+        "farms": farms,
+        "sorted": {name: list(keys) for name, keys in app.FARMS.sorted.items()},
+        "by_status": {code: sorted(ids) for code, ids in app.FARMS.by_status.items()},
+        "aggregates": (app.AGGREGATES.total, app.AGGREGATES.all.value_sum, app.AGGREGATES.all.ranked,
+                       app.AGGREGATES.status_counts, app.AGGREGATES.fda_compliant,
+                       [(z, app.AGGREGATES.zones[z].count, app.AGGREGATES.zones[z].mean(),
+                         app.AGGREGATES.zones[z].ranked) for z in zones]),
+        "heat": [app.HEAT_GRID.query(-11, 94, 6, 142, zoom) for zoom in range(0, 12)],
+        "rollups": {(scope, key, step): [tuple(round(x, 9) for x in row)
+                                         for row in app.ROLLUPS.query(scope, key, step)]
+                    for scope, key in app.ROLLUPS.series for step in ("hour", "day", "week")},
+        "farm_stats": {fid: tuple(round(x, 9) for x in app.ROLLUPS.stats("farm", fid, "day")) for fid in farms},
+        "forecast": {fid: tuple(np.round(part, 9).tolist() for part in forecast.series(fid)[1:]) for fid in farms},
+        "dispatch": (list(app.DISPATCH.queue), dict(app.DISPATCH.deadline), dict(app.DISPATCH.zone_level)),
+        "alerts": app.ALERTS.to_state()
+    }
+
+
+def run(records, writes, event):
+    app.load_farms(records)
+    app.DISPATCH.advance(app.iso_to_us(datetime.utcnow().isoformat()))  # as a stream summary may, mid-run
+    for fids, values, time_iso in writes:
+        with app.SHARED.writing() as events:
+            events.append(event(fids, values, time_iso))
+    return state()
+
+
+def as_readings(fids, values, time_iso):
+    batches = [(fid, [(v, "auto-sim", "Simulated data")]) for fid, v in zip(fids, values)]
+    return app.readings_event(batches, time_iso, trim=app.HISTORY_WINDOW)
+
+
+def as_batch(fids, values, time_iso):
+    return app.batch_event(fids, values, "auto-sim", "Simulated data", time_iso, trim=app.HISTORY_WINDOW)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_batch_matches_per_farm_readings(seed):
+    rnd = random.Random(seed)
+    records = make_farms(FARMS, history_points=14)
+    ids = [f["id"] for f in records]
+    writes = []
+    for step in range(6):
+        # whole-registry writes take the bulk paths, small ones fall back to per-farm updates
+        fids = ids if step % 2 == 0 else rnd.sample(ids, 20)
+        values = [round(rnd.uniform(0, 90), 3) for _ in fids]
+        time_iso = datetime(2026, 1, 1 + step, rnd.randrange(24)).isoformat()
+        if step == 4:
+            time_iso = datetime.utcnow().isoformat()  # inside the SLA: farms wait on the dispatch timer wheel
+        writes.append((fids, values, time_iso))
+    assert run(records, writes, as_batch) == run(records, writes, as_readings)
+
+
+def test_batch_rejects_non_finite_values_before_changing_anything():
+    app.load_farms(make_farms(50, history_points=3))
+    before = state()
+    fids = [f.id for f in app.FARMS]
+    with pytest.raises(ValueError):
+        with app.SHARED.writing() as events:
+            events.append(as_batch(fids, [1.0] * (len(fids) - 1) + [float("nan")], datetime(2026, 1, 1).isoformat()))
+    assert state() == before
@@ -0,0 +1,95 @@
+"""Sampling dispatcher: overdue order at and around the SLA boundary against a brute-force ranking"""
+import random
+
+import pytest
+
+from dispatch import HOUR_US, Dispatcher
+
+SLA = 36 * HOUR_US
+ZONES = ["aceh_strait", "bali_ntt", "east_java"]
+INSPECTORS = ["Ana", "Budi"]
+
+
+def brute(d, farms, levels, now_us, zone=None, inspector=None):
+    """(farm id, priority) of every overdue farm, highest priority first (ties on id)"""
+    rows = []
+    for fid, (value, updated_us, z, insp, lat, lng) in farms.items():
+        if updated_us + SLA > now_us or (zone and z != zone) or (inspector and insp != inspector):
+            continue
+        static = value + d.w_zone * levels.get(z, 0) - d.w_hour * updated_us / HOUR_US
+        rows.append((-round(static, 6), fid, static + d.w_hour * now_us / HOUR_US))
+    return [(fid, priority) for _, fid, priority in sorted(rows)]
+
+
+def check(d, farms, levels, now_us):
+    for zone, inspector in [(None, None), (ZONES[0], None), (None, INSPECTORS[1]), (ZONES[1], INSPECTORS[0])]:
+        expected = brute(d, farms, levels, now_us, zone, inspector)
+        total, entries = d.page(now_us, limit=10**6, zone=zone, inspector=inspector)
+        assert total == len(expected)
+        assert [e["farm_id"] for e in entries] == [fid for fid, _ in expected]
+        assert [e["priority"] for e in entries] == pytest.approx([p for _, p in expected], abs=0.01)
+    assert len(d) == len(brute(d, farms, levels, now_us))
+
+
+def test_a_farm_becomes_overdue_exactly_at_its_deadline():
+    d = Dispatcher()
+    now = 1000 * HOUR_US + 17  # mid-hour, so the deadline bucket is only partly due
+    d.advance(now)
+    d.upsert(1, 10.0, now - SLA, ZONES[0], "Ana", -6.0, 106.0)      # due this very microsecond
+    d.upsert(2, 50.0, now - SLA + 1, ZONES[0], "Ana", -6.0, 106.1)  # one microsecond short
+    d.upsert(3, 50.0, now - SLA + HOUR_US, ZONES[0], "Ana", -6.0, 106.2)
+    assert [e["farm_id"] for e in d.page(now)[1]] == [1]
+    assert [e["farm_id"] for e in d.page(now + 1)[1]] == [2, 1]
+    assert d.page(now + HOUR_US - 1)[0] == 2
+    assert [e["farm_id"] for e in d.page(now + HOUR_US)[1]] == [2, 3, 1]  # same value: the older sample first
+    # a fresh sample moves a farm back inside the SLA
+    d.upsert(2, 50.0, now + HOUR_US, ZONES[0], "Ana", -6.0, 106.1)
+    assert [e["farm_id"] for e in d.page(now + HOUR_US)[1]] == [3, 1]
+
+
+def test_equal_priorities_tie_break_on_id():
+    d = Dispatcher()
+    now = 500 * HOUR_US
+    for fid in (5, 3, 9, 1):
+        d.upsert(fid, 20.0, now - SLA - HOUR_US, ZONES[0], "Ana", -6.0, 106.0)
+    assert [e["farm_id"] for e in d.page(now)[1]] == [1, 3, 5, 9]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_order_matches_brute_force_through_writes_and_time(seed):
+    rnd = random.Random(seed)
+    d = Dispatcher()
+    farms, levels = {}, {}
+    now = 10_000 * HOUR_US
+
+    def row(fid):
+        # updates clustered around the SLA boundary so farms cross it as time moves
+        updated = now - SLA + rnd.choice([0, 1, -1, rnd.randrange(-3 * HOUR_US, 3 * HOUR_US)])
+        return (fid, float(rnd.choice([10, 20, rnd.uniform(0, 90)])), updated, rnd.choice(ZONES),
+                rnd.choice(INSPECTORS), rnd.uniform(-8, -6), rnd.uniform(106, 112))
+
+    d.advance(now)
+    for fid in range(1, 201):
+        farms[fid] = row(fid)[1:]
+        d.upsert(fid, *farms[fid])
+    check(d, farms, levels, now)
+    for step in range(30):
+        op = step % 5
+        if op == 0:  # a write touching most farms: the bulk path
+            rows = [row(fid) for fid in farms if rnd.random() < 0.7]
+            d.upsert_many(rows)
+            farms.update((r[0], r[1:]) for r in rows)
+        elif op == 1:
+            for fid in rnd.sample(list(farms), 15):
+                farms[fid] = row(fid)[1:]
+                d.upsert(fid, *farms[fid])
+        elif op == 2:
+            zone, level = rnd.choice(ZONES), rnd.randrange(4)
+            levels[zone] = level
+            d.set_zone_level(zone, level)
+        elif op == 3:
+            fid = rnd.choice(list(farms))
+            del farms[fid]
+            d.discard(fid)
+        now += rnd.choice([1, HOUR_US - 1, HOUR_US, rnd.randrange(2 * HOUR_US)])
+        check(d, farms, levels, now)
@@ -0,0 +1,112 @@
+"""Compliance export: every format carries the same rows, filtered as a scan of the farm records would"""
+import csv
+import io
+import json
+
+import pytest
+
+import app
+import export
+from bench.synthetic import make_farms
+
+
+@pytest.fixture(scope="module")
+def client():
+    app.load_farms(make_farms(300, history_points=6))
+    client = app.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer " + app.generate_token("admin")
+    return client
+
+
+def expected_rows(since=None, zone=None, status=None):
+    rows = []
+    for farm in sorted((f.to_dict() for f in app.FARMS), key=lambda d: d["id"]):
+        if (zone and farm["zone"] != zone) or (status and farm["status"].lower() != status.lower()):
+            continue
+        for h in farm["history"]:
+            if since and h["time"] < since:
+                continue
+            rows.append({"farm_id": farm["id"], "farm_name": farm["name"], "location": farm["location"],
+                         "zone": farm["zone"], "status": app.get_status(h["value"]), "time": h["time"],
+                         "value": h["value"], "value_bq": app.ppb_to_bq(h["value"]),
+                         "inspector": h["inspector"], "notes": h["notes"]})
+    return rows
+
+
+def filters():
+    farms = sorted(app.FARMS, key=lambda f: f.id)
+    times = sorted(h["time"] for f in farms for h in f.history.to_dicts())
+    return [{}, {"zone": farms[0].zone}, {"status": "CRITICAL"}, {"status": "safe", "zone": farms[-1].zone},
+            {"since": times[len(times) // 2]}, {"since": times[-1] + "1"}]
+
+
+def get(client, **args):
+    resp = client.get("/api/export", query_string=args)
+    assert resp.status_code == 200, resp.get_json()
+    assert resp.is_streamed
+    assert resp.mimetype == export.FORMATS[args["format"]][0]
+    return resp.get_data()
+
+
+def test_ndjson_csv_and_json_match_a_scan(client):
+    for params in filters():
+        rows = expected_rows(**params)
+        ndjson = [json.loads(line) for line in get(client, format="ndjson", **params).splitlines()]
+        assert ndjson == rows
+
+        table = list(csv.DictReader(io.StringIO(get(client, format="csv", **params).decode())))
+        assert [r["farm_id"] for r in table] == [str(r["farm_id"]) for r in rows]
+        assert [float(r["value"]) for r in table] == [r["value"] for r in rows]
+        assert [r["notes"] for r in table] == [r["notes"] for r in rows]
+
+        doc = json.loads(get(client, format="json", **params))
+        assert set(doc) == {"generated_at", "summary", "zones", "farms", "thresholds"}
+        flat = [(f["id"], h["time"], h["value"]) for f in doc["farms"] for h in f["history"]]
+        assert flat == [(r["farm_id"], r["time"], r["value"]) for r in rows]
+        # the document lists every farm the zone/status filters keep, even one with no samples since
+        kept = expected_rows(zone=params.get("zone"), status=params.get("status"))
+        assert [f["id"] for f in doc["farms"]] == sorted({r["farm_id"] for r in kept})
+
+
+def test_csv_quotes_awkward_text(client):
+    farm = next(iter(app.FARMS))
+    with app.SHARED.writing() as events:
+        events.append(app.readings_event([(farm.id, [(1.5, 'Rina, "QA"', "line one\nline two")])],
+                                         "2099-01-01T00:00:00"))
+    table = list(csv.DictReader(io.StringIO(get(client, format="csv", since="2099-01-01").decode())))
+    assert [(r["inspector"], r["notes"]) for r in table] == [('Rina, "QA"', "line one\nline two")]
+
+
+@pytest.mark.parametrize("args, error", [
+    ({"format": "xml"}, "Unknown format"),
+    ({"format": "csv", "zone": "atlantis"}, "Unknown zone"),
+    ({"format": "csv", "status": "radioactive"}, "Unknown status"),
+    ({"format": "csv", "since": "yesterday"}, "Invalid since timestamp"),
+])
+def test_bad_filters_are_rejected(client, args, error):
+    resp = client.get("/api/export", query_string=args)
+    assert resp.status_code == 400 and resp.get_json()["error"].startswith(error)
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_columnar_formats(client, fmt):
+    if export.pa is None:
+        resp = client.get("/api/export", query_string={"format": fmt})
+        assert resp.status_code == 400 and "pyarrow" in resp.get_json()["error"]
+        return
+    data = get(client, format=fmt, zone=next(iter(app.FARMS)).zone)
+    reader = export.pq.read_table if fmt == "parquet" else lambda buf: export.pa.ipc.open_stream(buf).read_all()
+    table = reader(export.pa.BufferReader(data) if fmt == "parquet" else data)
+    assert table.to_pylist() == expected_rows(zone=next(iter(app.FARMS)).zone)
+
+
+def test_export_job_result_matches_the_stream(client):
+    params = {"format": "ndjson", "status": "high"}
+    resp = client.post("/api/jobs", json={"type": "export", "params": params})
+    assert resp.status_code == 202
+    job = app.JOBS.get(resp.get_json()["job"]["id"])
+    assert job.wait(30)
+    result = client.get(f"/api/jobs/{job.id}/result")
+    assert result.status_code == 200 and result.mimetype == "application/x-ndjson"
+    assert result.get_data() == get(client, **params)
+    result.close()
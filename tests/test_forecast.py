@@ -0,0 +1,30 @@
+"""ForecastEngine.next_mean's running sums against forecast(1).group()"""
+import pickle
+import random
+
+import pytest
+
+from forecast import ForecastEngine
+
+
+def group_next(engine):
+    return tuple(float(a[0]) for a in engine.forecast(1).group())
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_next_mean_tracks_full_group_forecast(seed):
+    rnd = random.Random(seed)
+    engine = ForecastEngine()
+    engine.load({k: [rnd.uniform(0, 100) for _ in range(rnd.randrange(1, 20))] for k in range(500)})
+    for step in range(400):
+        for _ in range(rnd.choice([1, 1, 3, 200])):
+            engine.add(rnd.randrange(550), rnd.uniform(0, 100))  # new series too
+        if step % 20 == 0:
+            assert engine.next_mean() == pytest.approx(group_next(engine), rel=1e-9)
+    restored = pickle.loads(pickle.dumps(engine))
+    restored.add(3, 42.0)
+    assert restored.next_mean() == pytest.approx(group_next(restored), rel=1e-9)
+
+
+def test_next_mean_empty():
+    assert ForecastEngine().next_mean() is None
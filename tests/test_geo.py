@@ -0,0 +1,92 @@
+"""Radius, bounding-box and k-nearest queries against a haversine scan of every point"""
+import random
+
+import pytest
+
+import app
+from bench.synthetic import make_farms
+from geo import GridIndex, haversine_km
+
+
+def scan(points, lat, lng):
+    return sorted((haversine_km(lat, lng, plat, plng), key) for key, (plat, plng) in points.items())
+
+
+def in_box(points, south, west, north, east):
+    return sorted(key for key, (lat, lng) in points.items()
+                  if south <= lat <= north and (west <= lng <= east if west <= east else lng >= west or lng <= east))
+
+
+def check(index, points, rnd, queries=40):
+    for _ in range(queries):
+        lat, lng = rnd.uniform(-90, 90), rnd.uniform(-180, 180)
+        if rnd.random() < 0.5 and points:  # right next to a point, often on a cell edge
+            lat, lng = rnd.choice(list(points.values()))
+            lat, lng = min(90, max(-90, lat + rnd.choice([0, 1e-9, -0.3]))), lng
+        ranked = scan(points, lat, lng)
+        km = rnd.choice([0, 1, 25, 300, 3000])
+        hits = sorted((d, key) for key, d in index.within(lat, lng, km))
+        assert [key for _, key in hits] == [key for d, key in ranked if d <= km]
+        k = rnd.choice([1, 3, 20])
+        nearest = index.nearest_k(lat, lng, k)
+        assert [d for _, d in nearest] == [d for d, _ in ranked[:k]]
+        assert [key for key, _ in nearest] == [key for _, key in ranked[:k]]
+        if ranked:
+            assert index.nearest(lat, lng)[1] == ranked[0][0]
+        south, north = sorted(rnd.uniform(-90, 90) for _ in range(2))
+        west, east = rnd.uniform(-180, 180), rnd.uniform(-180, 180)  # west > east crosses the antimeridian
+        assert sorted(index.in_bbox(south, west, north, east)) == in_box(points, south, west, north, east)
+
+
+def place(rnd):
+    kind = rnd.random()
+    if kind < 0.3:  # around the antimeridian
+        return rnd.uniform(-60, 60), rnd.choice([rnd.uniform(178, 180), rnd.uniform(-180, -178)])
+    if kind < 0.4:  # near the poles, where a degree of longitude is short
+        return rnd.choice([rnd.uniform(85, 90), rnd.uniform(-90, -85)]), rnd.uniform(-180, 180)
+    if kind < 0.5:  # on cell edges and the extremes
+        return float(rnd.randrange(-90, 91)), float(rnd.choice([-180, 180, rnd.randrange(-180, 181)]))
+    return rnd.gauss(-2, 5), rnd.gauss(118, 12)
+
+
+@pytest.mark.parametrize("cell_deg", [0.5, 1.0, 2.0, 7.0])
+def test_queries_match_a_scan_through_moves_and_removals(cell_deg):
+    rnd = random.Random(int(cell_deg * 10))
+    index = GridIndex(cell_deg=cell_deg)
+    points = {}
+    check(index, points, rnd, queries=3)
+    for key in range(400):
+        points[key] = place(rnd)
+        index.insert(key, *points[key])
+    check(index, points, rnd)
+    for key in rnd.sample(list(points), 150):
+        if rnd.random() < 0.5:
+            del points[key]
+            index.remove(key)
+        else:
+            points[key] = place(rnd)
+            index.insert(key, *points[key])
+    assert len(index) == len(points)
+    check(index, points, rnd)
+
+
+def test_near_endpoint_matches_a_scan():
+    app.load_farms(make_farms(800, history_points=2))
+    client = app.app.test_client()
+    points = {f.id: (f.lat, f.lng) for f in app.FARMS}
+    lat, lng = points[min(points)]
+    ranked = scan(points, lat, lng)
+
+    body = client.get("/api/farms/near", query_string={"lat": lat, "lng": lng, "radius_km": 80, "limit": 5}).get_json()
+    within = [(d, key) for d, key in ranked if d <= 80]
+    assert body["total"] == len(within)
+    assert [f["id"] for f in body["farms"]] == [key for _, key in within[:5]]
+    assert [f["distance_km"] for f in body["farms"]] == [round(d, 3) for d, _ in within[:5]]
+
+    body = client.get("/api/farms/near", query_string={"lat": lat, "lng": lng, "k": 7, "fields": "id"}).get_json()
+    assert [f["id"] for f in body["farms"]] == [key for _, key in ranked[:7]]
+
+    body = client.get("/api/farms/near", query_string={"bbox": "-8,105,-5,115", "limit": 1000}).get_json()
+    assert [f["id"] for f in body["farms"]] == in_box(points, -8, 105, -5, 115) and body["count"] == body["total"]
+    assert client.get("/api/farms/near", query_string={"bbox": "5,105,-5,115"}).status_code == 400
+    assert client.get("/api/farms/near", query_string={"lat": 1, "lng": 200, "k": 3}).status_code == 400
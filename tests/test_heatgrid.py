@@ -0,0 +1,130 @@
+"""Heatmap cells against a brute-force binning of every farm, through per-farm, bulk and moving writes"""
+import random
+from collections import namedtuple
+
+import pytest
+
+import app
+from bench.synthetic import make_farms
+from heatgrid import CELL_SHIFT, MAX_QUERY_CELLS, HeatGrid, cell_center, mercator
+
+Farm = namedtuple("Farm", "id lat lng value")
+
+
+def brute(farms, level, south, west, north, east):
+    x0, y0 = mercator(north, max(west, -180.0), level)
+    x1, y1 = mercator(south, min(east, 180.0), level)
+    xs = [(x0, x1)] if x0 <= x1 else [(x0, (1 << level) - 1), (0, x1)]
+    groups = {}
+    for f in farms.values():
+        x, y = mercator(f.lat, f.lng, level)
+        if y0 <= y <= y1 and any(a <= x <= b for a, b in xs):
+            groups.setdefault((x, y), []).append(f.value)
+    cells = []
+    for (x, y), values in sorted(groups.items()):
+        lat, lng = cell_center(x, y, level)
+        cells.append([round(lat, 5), round(lng, 5), len(values), sum(values) / len(values), max(values)])
+    return cells
+
+
+def same(cells, expected):
+    assert [c[:3] + c[4:] for c in cells] == [c[:3] + c[4:] for c in expected]
+    assert [c[3] for c in cells] == pytest.approx([c[3] for c in expected], abs=0.005 + 1e-9)
+
+
+def span(level, south, west, north, east):
+    x0, y0 = mercator(north, west, level)
+    x1, y1 = mercator(south, east, level)
+    width = x1 - x0 + 1 if x0 <= x1 else (1 << level) - x0 + x1 + 1
+    return width * (abs(y1 - y0) + 1)
+
+
+def check(grid, farms, rnd):
+    assert len(grid) == len(farms)
+    for _ in range(12):
+        zoom = rnd.randrange(0, 14)
+        lat, lng = rnd.uniform(-12, 8), rnd.uniform(90, 145)
+        size = rnd.choice([0.05, 0.5, 4, 40]) / (1 << max(0, zoom - 4))
+        box = (lat - size, lng - size, lat + size, lng + size)
+        level, cells = grid.query(*box, zoom)
+        same(cells, brute(farms, level, *box))
+        # the finest level the view allows
+        assert level <= max(zoom + CELL_SHIFT, CELL_SHIFT)
+        assert span(level, *box) <= MAX_QUERY_CELLS or level == CELL_SHIFT
+        if level < zoom + CELL_SHIFT:
+            assert span(level + 1, *box) > MAX_QUERY_CELLS
+    box = (-60, 170, 60, -170)  # across the antimeridian
+    level, cells = grid.query(*box, 2)
+    same(cells, brute(farms, level, *box))
+    for z in (0, 3, 9, 13, 16):  # 13 and 16 are finer than the stored levels
+        f = rnd.choice(list(farms.values()))
+        x, y = mercator(f.lat, f.lng, z)
+        level = z + CELL_SHIFT
+        lo_x, lo_y = x << CELL_SHIFT, y << CELL_SHIFT
+        hi_x, hi_y = lo_x + (1 << CELL_SHIFT) - 1, lo_y + (1 << CELL_SHIFT) - 1
+        expected = [c for c in brute(farms, level, -90, -180, 90, 180)
+                    if lo_x <= mercator(c[0], c[1], level)[0] <= hi_x and lo_y <= mercator(c[0], c[1], level)[1] <= hi_y]
+        assert expected
+        same(grid.tile(z, x, y), expected)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_cells_match_brute_force(seed):
+    rnd = random.Random(seed)
+    farms = {}
+    grid = HeatGrid()
+
+    def place(fid):
+        # clustered, so many farms share cells (and a few share an exact position)
+        if farms and rnd.random() < 0.1:
+            other = rnd.choice(list(farms.values()))
+            return Farm(fid, other.lat, other.lng, round(rnd.uniform(0, 200), 3))
+        cx, cy = rnd.choice([(-6.2, 106.8), (-8.4, 115.2), (0.5, 117.1), (-2.9, 140.7)])
+        return Farm(fid, cx + rnd.gauss(0, 0.4), cy + rnd.gauss(0, 0.4), round(rnd.uniform(0, 200), 3))
+
+    for fid in range(1, 801):
+        farms[fid] = place(fid)
+        grid.upsert(farms[fid])
+    check(grid, farms, rnd)
+    for step in range(8):
+        if step % 3 == 0:  # a write revaluing most farms, some of them moved: the bulk path
+            changed = [fid for fid in farms if rnd.random() < 0.8]
+            for fid in changed:
+                f = farms[fid]
+                farms[fid] = place(fid) if rnd.random() < 0.05 else f._replace(value=round(rnd.uniform(0, 200), 3))
+            grid.upsert_many([farms[fid] for fid in changed])
+        else:
+            for _ in range(60):
+                op = rnd.random()
+                fid = rnd.choice(list(farms))
+                if op < 0.6:  # often lower, so a cell's max must come from its other farms
+                    farms[fid] = farms[fid]._replace(value=round(farms[fid].value * rnd.uniform(0, 1.2), 3))
+                elif op < 0.8:
+                    farms[fid] = place(fid)
+                elif op < 0.9:
+                    del farms[fid]
+                    grid.discard(fid)
+                    continue
+                else:
+                    fid = max(farms) + 1
+                    farms[fid] = place(fid)
+                grid.upsert(farms[fid])
+        check(grid, farms, rnd)
+
+
+def test_heatmap_endpoint_follows_writes():
+    app.load_farms(make_farms(500, history_points=2))
+    client = app.app.test_client()
+    token = app.generate_token("admin")
+    fids = [f.id for f in app.FARMS]
+    with app.SHARED.writing() as events:
+        events.append(app.batch_event(fids, [float(i % 97) for i in range(len(fids))], "t", "", None))
+    resp = client.patch(f"/api/farm/{fids[0]}", json={"lat": -7.25, "lng": 112.75},
+                        headers={"Authorization": "Bearer " + token})
+    assert resp.status_code == 200
+    farms = {f.id: Farm(f.id, f.lat, f.lng, f.value) for f in app.FARMS}
+    box = (-11, 94, 6, 142)
+    for zoom in (0, 4, 8):
+        body = client.get("/api/heatmap", query_string={"bbox": ",".join(map(str, box)), "zoom": zoom}).get_json()
+        assert body["farms"] == len(farms)
+        same(body["cells"], brute(farms, body["level"], *box))
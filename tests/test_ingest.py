@@ -0,0 +1,95 @@
+"""Bulk sample ingest: body framing, per-row errors and sample_id idempotency"""
+import io
+
+import numpy as np
+import pytest
+
+import app
+from bench.synthetic import make_farms
+from ingest import RS, ROW_ERRORS, BulkFormatError, iter_rows, validate_batch
+
+
+def rows_of(body, content_type):
+    return list(iter_rows(io.BytesIO(body.encode()), content_type))
+
+
+def test_json_seq_records_are_framed_by_rs():
+    body = (RS + '{"farm_id": 1, "value": 2}\n' + RS + '{"farm_id": 2,\n "value": 3}\n'
+            + RS + '{"farm_id": 3, "val\n' + RS + "\n" + RS + '[1]\n')
+    assert rows_of(body, "application/json-seq") == [
+        {"farm_id": 1, "value": 2}, {"farm_id": 2, "value": 3}, {"_malformed": True}, {"_malformed": True}]
+
+
+def test_ndjson_and_csv_rows():
+    assert rows_of('{"farm_id": 1, "value": 2}\n\nnot json\n', "application/x-ndjson") == [
+        {"farm_id": 1, "value": 2}, {"_malformed": True}]
+    assert rows_of(" farm_id ,value\n1,2\n", "text/csv") == [{"farm_id": "1", "value": "2"}]
+    with pytest.raises(BulkFormatError):
+        rows_of("a,b\n1,2\n", "text/csv")
+    with pytest.raises(BulkFormatError):
+        rows_of("{}", "application/json")
+
+
+def test_every_row_gets_its_first_error():
+    rows = [
+        {"farm_id": 1, "value": 10, "sample_id": "a"},
+        {"_malformed": True},
+        {"farm_id": " ", "value": 1},
+        {"farm_id": 1.0, "value": 1},
+        {"farm_id": True, "value": 1},
+        {"farm_id": "x1", "value": 1},
+        {"farm_id": 2 ** 70, "value": 1},
+        {"farm_id": 99, "value": 1},
+        {"farm_id": "2", "value": "abc"},
+        {"farm_id": 2, "value": "nan"},
+        {"farm_id": 2, "value": -1},
+        {"farm_id": 2, "value": 1e7},
+        {"farm_id": " 3 ", "value": " 4.5 ", "sample_id": " a "},
+        {"farm_id": 3, "value": 1, "sample_id": 7},
+        {"farm_id": 3, "value": 1, "sample_id": "7"},
+    ]
+    ids, vals, sample_ids, codes = validate_batch(rows, np.array([1, 2, 3]))
+    assert [ROW_ERRORS[c] for c in codes] == [
+        None, "Malformed row", "Missing required fields: farm_id and value", "Invalid farm_id", "Invalid farm_id",
+        "Invalid farm_id", "Invalid farm_id", "Farm not found", "Invalid value format", "Invalid value format",
+        "Value cannot be negative", "Value cannot exceed 1,000,000", "Duplicate sample_id in batch", None,
+        "Duplicate sample_id in batch"]
+    assert ids[12] == 3 and vals[12] == 4.5
+    assert sample_ids[:3] == ["a", None, None] and sample_ids[12:] == ["a", "7", "7"]
+
+
+def test_bad_rows_in_a_large_batch_do_not_affect_the_rest():
+    rows = [{"farm_id": str(i % 3 + 1), "value": str(i % 50)} for i in range(5000)]
+    for i in range(0, 5000, 777):
+        rows[i] = {"farm_id": "1", "value": "bad"}
+    ids, vals, _, codes = validate_batch(rows, np.array([1, 2, 3]))
+    bad = np.zeros(5000, dtype=bool)
+    bad[::777] = True
+    assert (codes[bad] == ROW_ERRORS.index("Invalid value format")).all() and (codes[~bad] == 0).all()
+    assert vals[~bad].tolist() == [float(i % 50) for i in np.flatnonzero(~bad)]
+    assert ids.tolist() == [i % 3 + 1 for i in range(5000)]
+
+
+@pytest.fixture
+def client():
+    app.load_farms(make_farms(5, history_points=2))
+    client = app.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer " + app.generate_token("admin")
+    return client
+
+
+def post(client, body, content_type="application/x-ndjson"):
+    return client.post("/api/samples/bulk", data=body, content_type=content_type).get_json()
+
+
+def test_bulk_upload_is_idempotent_per_sample_id(client):
+    body = "".join('{"farm_id": %d, "value": %d, "sample_id": "s%d"}\n' % (i % 5 + 1, i, i) for i in range(8))
+    history = {f.id: len(f.history) for f in app.FARMS}
+    first = post(client, body + '{"farm_id": 9, "value": 1}\n')
+    assert (first["accepted"], first["duplicates"], first["rejected"]) == (8, 0, 1)
+    assert first["errors"] == [{"row": 9, "sample_id": None, "error": "Farm not found"}]
+    again = post(client, RS + body.replace("\n", "\n" + RS), "application/json-seq")
+    assert (again["received"], again["accepted"], again["duplicates"]) == (8, 0, 8)
+    assert {f.id: len(f.history) for f in app.FARMS} == {fid: n + (2 if fid <= 3 else 1) for fid, n in history.items()}
+    csv = post(client, "farm_id,value,sample_id\n1,5,s0\n1,6,new\n", "text/csv")
+    assert (csv["accepted"], csv["duplicates"]) == (1, 1)
@@ -0,0 +1,120 @@
+"""Job queue: cancellation (local and through the shared store), store write throttling and backpressure"""
+import threading
+
+import pytest
+
+import app
+import jobs
+from jobs import CANCELLED, SUCCEEDED, JobCancelled, JobQueue, QueueFull
+from shared_state import SharedState
+
+
+class CountingStore(SharedState):
+    def __init__(self, path):
+        super().__init__(path, lambda kind, payload: None)
+        self.saves = self.cancel_checks = 0
+
+    def save_job(self, job_id, doc):
+        self.saves += 1
+        super().save_job(job_id, doc)
+
+    def cancel_requested(self, job_id):
+        self.cancel_checks += 1
+        return super().cancel_requested(job_id)
+
+
+def looping(steps, started=None):
+    def fn(job):
+        if started:
+            started.set()
+        for i in range(steps):
+            job.report(i / steps, "step")
+        return {"steps": steps}
+    return fn
+
+
+def test_report_throttles_store_writes_and_cancel_checks(tmp_path):
+    store = CountingStore(str(tmp_path / "state.db"))
+    queue = JobQueue(str(tmp_path / "jobs"), workers=1, store=store)
+    queue.register("loop", looping(20000))
+    job = queue.submit("loop")
+    assert job.wait(30) and job.status == SUCCEEDED
+    # one write per SYNC_PROGRESS step (plus the first), not one per report()
+    assert store.saves <= 1 / jobs.SYNC_PROGRESS + 5
+    assert store.cancel_checks <= 1 / jobs.SYNC_PROGRESS + 5
+    assert store.load_job(job.id)[0]["status"] == SUCCEEDED
+
+
+def test_cancel_stops_a_running_job_at_its_next_report(tmp_path):
+    started, release = threading.Event(), threading.Event()
+
+    def fn(job):
+        started.set()
+        release.wait(10)
+        job.report(0.5)
+        return "unreachable"
+
+    queue = JobQueue(str(tmp_path), workers=1)
+    queue.register("wait", fn)
+    queue.register("loop", looping(10))
+    running = queue.submit("wait")
+    assert started.wait(10)
+    queued = queue.submit("loop")
+    queue.cancel(running.id)
+    queue.cancel(queued.id)
+    release.set()
+    assert running.wait(10) and queued.wait(10)
+    assert (running.status, queued.status) == (CANCELLED, CANCELLED)
+    assert queued.started_at is None and running.result_path is None
+
+
+def test_cancel_requested_through_another_process_reaches_the_runner(tmp_path):
+    path = str(tmp_path / "state.db")
+    started = threading.Event()
+    runner = JobQueue(str(tmp_path / "a"), workers=1, store=SharedState(path, lambda kind, payload: None))
+    other = JobQueue(str(tmp_path / "b"), store=SharedState(path, lambda kind, payload: None))
+
+    def spin(job):
+        started.set()
+        while True:
+            job.report(0.0)
+
+    runner.register("loop", spin)
+    job = runner.submit("loop")
+    assert started.wait(10)
+    assert other.cancel(job.id).status not in (CANCELLED, SUCCEEDED)
+    # progress never moves, so the runner sees the request on its next SYNC_SECONDS check
+    assert job.wait(jobs.SYNC_SECONDS * 10) and job.status == CANCELLED
+    assert other.get(job.id).status == CANCELLED
+
+
+def test_local_cancel_raises_without_a_store_sync():
+    job = jobs.Job("loop", {}, None)
+    job.report(0.1)
+    job._cancel.set()
+    with pytest.raises(JobCancelled):
+        job.report(0.1)
+
+
+def test_full_queue_answers_429_with_retry_after(tmp_path, monkeypatch):
+    release = threading.Event()
+    queue = JobQueue(str(tmp_path), workers=1, max_queued=2)
+    queue.register("simulate", lambda job, **params: release.wait(10))
+    queue.register("export", lambda job, **params: None)
+    monkeypatch.setattr(app, "JOBS", queue)
+    client = app.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer " + app.generate_token("admin")
+    try:
+        queue.submit("simulate")  # taken by the worker, which then blocks
+        while queue.depth:
+            threading.Event().wait(0.01)
+        accepted = [client.post("/api/jobs", json={"type": "export", "params": {"format": "json"}})
+                    for _ in range(2)]
+        busy = client.post("/api/jobs", json={"type": "export", "params": {"format": "json"}})
+        assert [r.status_code for r in accepted] == [202] * 2
+        assert busy.status_code == 429 and busy.headers["Retry-After"] == "5"
+        assert busy.get_json()["queue_depth"] == 2
+        with pytest.raises(QueueFull):
+            queue.submit("export")
+    finally:
+        release.set()
@@ -0,0 +1,104 @@
+"""/metrics: well-formed Prometheus text exposition, consistent histograms, counts that follow requests"""
+import math
+import re
+
+import app
+from bench.synthetic import make_farms
+from metrics import LATENCY_BUCKETS, Metrics
+
+NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"'
+SAMPLE = re.compile(rf"({NAME})(?:\{{((?:{LABEL})(?:,{LABEL})*)?\}})? (\S+)")
+VALUE = re.compile(r"[+-]?(?:Inf|NaN|\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)")
+
+
+def parse(text):
+    """{family: (type, [(sample name, labels dict, value), ...])}, asserting the text is well formed"""
+    assert text.endswith("\n")
+    families, helped, seen = {}, set(), set()
+    for line in text[:-1].split("\n"):
+        if line.startswith("# HELP "):
+            name = line.split(" ")[2]
+            assert name not in helped
+            helped.add(name)
+            continue
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert name not in families and kind in ("counter", "gauge", "histogram", "summary", "untyped")
+            families[name] = (kind, [])
+            continue
+        match = SAMPLE.fullmatch(line)
+        assert match, line
+        name, labels, value = match.groups()
+        assert VALUE.fullmatch(value), line
+        labels = dict(re.findall(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"', labels or ""))
+        key = (name, tuple(sorted(labels.items())))
+        assert key not in seen, line
+        seen.add(key)
+        family = re.sub(r"_(bucket|sum|count)$", "", name) if name not in families else name
+        assert family in families, line  # TYPE comes before its samples
+        families[family][1].append((name, labels, float(value.replace("Inf", "inf"))))
+    assert helped == set(families)
+    return families
+
+
+def check_histograms(families):
+    for family, (kind, samples) in families.items():
+        if kind != "histogram":
+            continue
+        series = {}
+        for name, labels, value in samples:
+            base = tuple(sorted((k, v) for k, v in labels.items() if k != "le"))
+            series.setdefault(base, {"buckets": []})
+            if name.endswith("_bucket"):
+                series[base]["buckets"].append((float(labels["le"].replace("Inf", "inf")), value))
+            else:
+                series[base][name.rsplit("_", 1)[1]] = value
+        for parts in series.values():
+            bounds = [b for b, _ in parts["buckets"]]
+            counts = [c for _, c in parts["buckets"]]
+            assert bounds == sorted(bounds) and bounds[-1] == math.inf
+            assert counts == sorted(counts) and counts[-1] == parts["count"]
+            assert set(parts) == {"buckets", "sum", "count"}
+
+
+def test_render_is_well_formed_with_awkward_labels():
+    m = Metrics()
+    for seconds in (0.0005, 0.003, 0.003, 0.7, 42.0):
+        m.observe_request('/api/x/<path:"odd\\name">', "GET", 200, seconds, size=300)
+    m.observe_request("/api/y", "POST", 429, 0.01)
+    m.observe_span("line\nbreak", 0.02)
+    m.gauge("nothing_yet", "A gauge with no value", lambda: float("nan"))
+    m.gauge("floor", "A gauge below every bound", lambda: float("-inf"))
+    families = parse(m.render())
+    check_histograms(families)
+    latency = [s for s in families["cesium_http_request_duration_seconds"][1]
+               if s[0].endswith("_bucket") and s[1]["method"] == "GET"]
+    assert [s[2] for s in latency] == [1, 1, 3, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 5]
+    assert [s[1]["le"] for s in latency][-1] == "+Inf" and len(latency) == len(LATENCY_BUCKETS) + 1
+    requests = {(s[1]["endpoint"], s[1]["status"]): s[2] for s in families["cesium_http_requests_total"][1]}
+    assert requests == {('/api/x/<path:\\"odd\\\\name\\">', "200"): 5, ("/api/y", "429"): 1}
+    assert [s[1]["span"] for s in families["cesium_span_duration_seconds"][1]][0] == "line\\nbreak"
+    assert math.isnan(families["cesium_nothing_yet"][1][0][2])
+
+
+def test_metrics_endpoint_counts_requests():
+    app.load_farms(make_farms(25, history_points=2))
+    client = app.app.test_client()
+
+    def count(families, endpoint, status):
+        return sum(v for _, labels, v in families["cesium_http_requests_total"][1]
+                   if labels["endpoint"] == endpoint and labels["status"] == status)
+
+    before = parse(client.get("/metrics").get_data(as_text=True))
+    client.get("/api/version")
+    client.get("/api/version")
+    client.get("/api/farm/999999")
+    resp = client.get("/metrics")
+    assert resp.mimetype == "text/plain" and "version=0.0.4" in resp.headers["Content-Type"]
+    after = parse(resp.get_data(as_text=True))
+    check_histograms(after)
+    assert count(after, "/api/version", "200") - count(before, "/api/version", "200") == 2
+    assert count(after, "/api/farm/<int:farm_id>", "404") - count(before, "/api/farm/<int:farm_id>", "404") == 1
+    assert after["cesium_farms"][1][0][2] == 25
+    assert after["cesium_shared_seq"][1][0][2] == app.SHARED.seq
@@ -0,0 +1,121 @@
+"""Copy-on-write farm records and lock-free FarmRegistry snapshots under concurrent writes"""
+import pickle
+import sys
+import threading
+
+import pytest
+
+from registry import FarmRecord, FarmRegistry
+
+FARMS = 300
+BASE_US = 1_700_000_000_000_000
+
+
+def make_registry():
+    registry = FarmRegistry()
+    farms = []
+    for fid in range(1, FARMS + 1):
+        farm = FarmRecord(fid, f"Farm {fid}", "Test", -6 + fid * 0.01, 106 + fid * 0.01)
+        farm.history.append(BASE_US, 10.0, "t", "")
+        farm.value, farm.updated_us = 10.0, BASE_US
+        farms.append(farm)
+    registry.load(farms)
+    return registry
+
+
+def write(registry, stamp):
+    """One write that moves every farm to the same reading, the way a committed simulation does"""
+    with registry.writing():
+        for farm in list(registry):
+            farm = farm.copy()
+            farm.history.append(BASE_US + stamp, float(stamp % 500), "t", "")
+            farm.value, farm.updated_us = float(stamp % 500), BASE_US + stamp
+            farm.status_code = stamp % 4
+            registry.index(farm)
+
+
+def contents(view):
+    return [(f.id, f.value, f.updated_us, f.status_code, len(f.history), f.history.values[-1]) for f in view]
+
+
+@pytest.fixture
+def fast_switching():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)  # interleave readers with the writer mid-write
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_snapshots_are_consistent_and_immutable_under_writes(fast_switching):
+    registry = make_registry()
+    stop = threading.Event()
+    problems = []
+    checked = [0]
+
+    def writer():
+        stamp = 1
+        while not stop.is_set():
+            write(registry, stamp)
+            stamp += 1
+
+    def reader():
+        taken = []
+        last_version = -1
+        while not stop.is_set() or len(taken) < 3:
+            view = registry.snapshot()
+            seen = contents(view)
+            if view.version % 2 or view.version < last_version:
+                problems.append(f"view version {view.version} after {last_version}")
+            last_version = view.version
+            if len(seen) != FARMS or [s[0] for s in seen] != list(range(1, FARMS + 1)):
+                problems.append(f"view {view.version} lists {len(seen)} farms")
+            stamps = {s[2] for s in seen}
+            if len(stamps) != 1:
+                problems.append(f"view {view.version} mixes {len(stamps)} writes")
+            if len({s[1:] for s in seen}) != 1:
+                problems.append(f"view {view.version} records disagree")
+            taken.append((view, seen))
+            for old, old_seen in taken[-5:]:
+                if contents(old) != old_seen:
+                    problems.append(f"view {old.version} changed after it was taken")
+            checked[0] += 1
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    stop.wait(2.0)
+    stop.set()
+    for t in threads:
+        t.join()
+    assert not problems, problems[:5]
+    assert checked[0] > 20
+    assert registry.version > 20
+
+
+def test_held_record_is_not_changed_by_writers():
+    registry = make_registry()
+    farm = registry.get(7)
+    before = (farm.value, farm.updated_us, list(farm.history.values))
+    write(registry, 1)
+    assert registry.get(7) is not farm
+    assert (farm.value, farm.updated_us, list(farm.history.values)) == before
+    assert registry.get(7).updated_us == BASE_US + 1
+
+
+def test_snapshot_during_write_is_the_previous_one():
+    registry = make_registry()
+    write(registry, 1)
+    done = registry.snapshot()
+    with registry.writing():
+        farm = registry.get(1).copy()
+        farm.updated_us = BASE_US + 99
+        registry.index(farm)
+        assert registry.snapshot() is done
+    assert registry.snapshot().version == registry.version
+    assert registry.snapshot().farms[0].updated_us == BASE_US + 99
+
+
+def test_first_snapshot_mid_write_after_load_or_restore():
+    for registry in (make_registry(), pickle.loads(pickle.dumps(make_registry()))):
+        with registry.writing():
+            assert len(registry.snapshot()) == FARMS
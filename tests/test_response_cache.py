@@ -0,0 +1,58 @@
+"""Response cache ETags: If-None-Match matching and invalidation on writes"""
+import pytest
+
+import app
+from bench.synthetic import make_farms
+
+ETAG = '"0123456789abcdef01234567"'
+
+
+@pytest.mark.parametrize("header, match", [
+    (ETAG, True),
+    ("W/" + ETAG, True),
+    ('"other", ' + ETAG, True),
+    ('"other" ,W/' + ETAG + ' , "more"', True),
+    ("*", True),
+    (None, False),
+    ("", False),
+    ('"other"', False),
+    ('"x' + ETAG[1:-1] + 'x"', False),  # contains the tag's characters, but is another tag
+    (ETAG[1:-1], False),  # unquoted
+    ("w/" + ETAG, False),
+])
+def test_if_none_match(header, match):
+    assert app.etag_matches(header, ETAG) is match
+
+
+@pytest.fixture
+def client():
+    app.load_farms(make_farms(50, history_points=3))
+    client = app.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer " + app.generate_token("admin")
+    return client
+
+
+def test_304_until_a_write_changes_the_body(client):
+    first = client.get("/api/farm/1")
+    etag = first.headers["ETag"]
+    other = client.get("/api/farm/2").headers["ETag"]
+    assert client.get("/api/farm/1", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/farm/1", headers={"If-None-Match": "W/" + etag}).status_code == 304
+
+    assert client.post("/api/samples", json={"farm_id": 1, "value": 88.8, "inspector": "t"}).status_code < 300
+    fresh = client.get("/api/farm/1", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200 and fresh.headers["ETag"] != etag
+    assert fresh.get_data() != first.get_data()
+    assert client.get("/api/farm/1", headers={"If-None-Match": fresh.headers["ETag"]}).status_code == 304
+    # the write dropped every entry, but an unchanged body is rebuilt under the same strong ETag
+    assert client.get("/api/farm/2", headers={"If-None-Match": other}).status_code == 304
+
+
+def test_stats_etag_follows_every_write_path(client):
+    etag = client.get("/api/stats").headers["ETag"]
+    client.get("/api/simulate?seed=1&commit=true")
+    after_simulate = client.get("/api/stats", headers={"If-None-Match": etag})
+    assert after_simulate.status_code == 200
+    etag = after_simulate.headers["ETag"]
+    assert client.post("/api/samples", json={"farm_id": 3, "value": 150.0, "inspector": "t"}).status_code < 300
+    assert client.get("/api/stats", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,102 @@
+"""Sample store durability: reopen, compaction, segment merges, torn logs and interrupted compactions"""
+import os
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from samplestore import SampleStore
+
+FARMS = 30
+
+
+def fill(store, rnd, writes, start=datetime(2026, 1, 1)):
+    """Random single and whole-registry appends with rising times; returns the expected rows per farm"""
+    expected = {}
+    for step in range(writes):
+        time_iso = (start + timedelta(minutes=step)).isoformat()
+        if step % 3 == 0:
+            fids = list(range(1, FARMS + 1))
+            values = [rnd.uniform(0, 500) for _ in fids]
+            store.append_many(fids, time_iso, values, "auto-sim", "batch %d" % step if step % 2 else "")
+            rows = [(fid, v, "auto-sim", "batch %d" % step if step % 2 else "") for fid, v in zip(fids, values)]
+        else:
+            fid = rnd.randrange(1, FARMS + 1)
+            row = (fid, rnd.uniform(0, 500), rnd.choice(["Ana", "Budi", "Citra\nDewi"]), rnd.choice(["", "ulang ✓"]))
+            store.append(row[0], time_iso, row[1], row[2], row[3])
+            rows = [row]
+        for fid, value, inspector, notes in rows:
+            expected.setdefault(fid, []).append({
+                "time": time_iso, "inspector": inspector.replace("\n", " "),
+                "value": round(float(np.float32(value)), 4), "notes": notes})
+        if rnd.random() < 0.3:
+            store.commit(fsync=False)
+    store.commit(fsync=False)
+    return expected
+
+
+def check(store, expected):
+    assert store.farm_ids() == set(expected)
+    for fid, rows in expected.items():
+        assert store.rows(fid) == rows
+        assert store.rows(fid, limit=5) == rows[-5:]
+        since = rows[len(rows) // 2]["time"]
+        assert store.rows(fid, since=since) == [r for r in rows if r["time"] >= since]
+        assert store.rows(fid, since=since, limit=2) == [r for r in rows if r["time"] >= since][-2:]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_history_survives_reopen_compaction_and_merges(tmp_path, seed):
+    store = SampleStore(str(tmp_path), compact_threshold=97, max_segments=3)
+    expected = fill(store, random.Random(seed), 300)
+    assert len(store.manifest["segments"]) <= 4  # merged at least once along the way
+    check(store, expected)
+    store.close()
+    reopened = SampleStore(str(tmp_path), compact_threshold=97, max_segments=3)
+    check(reopened, expected)
+    # live segment directories and the current log are all that is left on disk
+    assert sorted(n for n in os.listdir(tmp_path) if n.startswith(("seg-", "samples-"))) == sorted(
+        reopened.manifest["segments"] + ["samples-%06d.log" % reopened.manifest["log"]])
+    reopened.close()
+
+
+def test_torn_trailing_log_record_is_dropped(tmp_path):
+    store = SampleStore(str(tmp_path))
+    expected = fill(store, random.Random(7), 20)
+    store.close()
+    with open(os.path.join(tmp_path, "samples-000000.log"), "ab") as fh:
+        fh.write(b"\x01\x02\x03")  # a crash mid-write
+    reopened = SampleStore(str(tmp_path))
+    check(reopened, expected)
+    more = fill(reopened, random.Random(8), 4, start=datetime(2026, 2, 1))
+    reopened.close()
+    for fid, rows in more.items():
+        expected.setdefault(fid, []).extend(rows)
+    check(SampleStore(str(tmp_path)), expected)
+
+
+def test_interrupted_compaction_keeps_the_previous_state(tmp_path, monkeypatch):
+    store = SampleStore(str(tmp_path), compact_threshold=10**9)
+    expected = fill(store, random.Random(3), 40)
+
+    def crash(manifest):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_write_manifest", crash)
+    with pytest.raises(OSError):
+        store.compact()  # the new segment is written, the manifest never names it
+    check(SampleStore(str(tmp_path)), expected)
+
+
+def test_refresh_sees_appends_and_compactions_of_another_process(tmp_path):
+    writer = SampleStore(str(tmp_path), compact_threshold=50, max_segments=2)
+    reader = SampleStore(str(tmp_path))
+    expected = fill(writer, random.Random(5), 10)
+    reader.refresh()
+    check(reader, expected)
+    for fid, rows in fill(writer, random.Random(6), 120, start=datetime(2026, 3, 1)).items():
+        expected.setdefault(fid, []).extend(rows)
+    assert writer.manifest != reader.manifest
+    reader.refresh()
+    check(reader, expected)
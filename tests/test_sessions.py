@@ -0,0 +1,84 @@
+"""Session tokens: expiry (also of cached verifications), revocation and its eviction, logout across replicas"""
+import time
+
+import jwt
+
+import app
+import sessions
+from bench.synthetic import make_farms
+from sessions import SessionManager
+
+
+def claims_of(token):
+    return jwt.decode(token, options={"verify_signature": False})
+
+
+def test_valid_tampered_and_foreign_tokens():
+    manager = SessionManager("s3cret", ttl=60)
+    token = manager.issue("admin", "admin")
+    claims = manager.verify(token)
+    assert (claims["sub"], claims["role"], claims["exp"] - claims["iat"]) == ("admin", "admin", 60)
+    head, body, sig = token.split(".")
+    assert manager.verify(f"{head}.{body}.{sig[::-1]}") is None
+    assert SessionManager("other", ttl=60).verify(token) is None
+    assert manager.verify("not a token") is None
+    unsigned = jwt.encode({**claims}, "s3cret", algorithm="HS512")
+    assert manager.verify(unsigned) is None
+
+
+def test_expired_tokens_are_rejected_even_once_cached(monkeypatch):
+    manager = SessionManager("s3cret", ttl=60)
+    assert manager.verify(manager.issue("admin", "admin", now=time.time() - 61)) is None
+    token = manager.issue("admin", "admin")
+    assert manager.verify(token) is not None  # now cached
+    real = time.time
+    monkeypatch.setattr(sessions.time, "time", lambda: real() + 61)
+    assert manager.verify(token) is None
+
+
+def test_revocation_rejects_the_token_until_it_would_have_expired():
+    manager = SessionManager("s3cret", ttl=60)
+    token, other = manager.issue("admin", "admin"), manager.issue("admin", "admin")
+    claims = manager.verify(token)
+    manager.revoke(claims["jti"], claims["exp"])
+    assert manager.verify(token) is None and manager.verify(other) is not None
+    now = time.time()
+    manager.revoke("stale", now - 1)  # already expired: nothing to remember
+    manager.revoke("soon", now + 5)
+    manager.revoke("late", now + 500)
+    assert set(manager.revoked) == {claims["jti"], "soon", "late"}
+    manager.revoke("later", now + 600, now=now + 100)  # the first two have expired by then
+    assert set(manager.revoked) == {"late", "later"}
+    restored = SessionManager("s3cret", ttl=60)
+    restored.load_revocations(manager.revocations())
+    assert restored.revoked == manager.revoked
+
+
+def test_verified_cache_stays_bounded(monkeypatch):
+    monkeypatch.setattr(sessions, "VERIFIED_CACHE", 8)
+    manager = SessionManager("s3cret", ttl=60)
+    tokens = [manager.issue("admin", "admin") for _ in range(30)]
+    for token in tokens:
+        assert manager.verify(token) is not None
+        assert len(manager._verified) <= 8
+    manager.revoke(claims_of(tokens[-1])["jti"], claims_of(tokens[-1])["exp"])
+    assert manager.verify(tokens[-1]) is None  # a cached verification still checks revocation
+
+
+def test_logout_revokes_in_every_replica():
+    app.load_farms(make_farms(10, history_points=2))
+    client = app.app.test_client()
+    token, other = app.generate_token("admin"), app.generate_token("admin")
+    auth = {"Authorization": "Bearer " + token}
+    assert client.get("/api/me", headers=auth).status_code == 200
+    assert client.post("/api/logout", headers=auth).status_code == 200
+    assert client.get("/api/me", headers=auth).status_code == 401
+    assert client.get("/api/jobs", headers=auth).status_code == 401
+    assert client.get("/api/me", headers={"Authorization": "Bearer " + other}).status_code == 200
+    # a worker rebuilding from a compacted log (a "load" snapshot) still rejects the token
+    snapshot = app.snapshot_state()
+    assert claims_of(token)["jti"] in dict(snapshot["revocations"])
+    app.SESSIONS.load_revocations([])
+    assert client.get("/api/me", headers=auth).status_code == 200
+    app.apply_event("load", snapshot)
+    assert client.get("/api/me", headers=auth).status_code == 401
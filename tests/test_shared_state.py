@@ -0,0 +1,135 @@
+"""SharedState: failed writes leave no durable trace; replicas in other processes converge on the same log"""
+import logging
+import multiprocessing
+from datetime import datetime
+
+import pytest
+
+import app
+from bench.synthetic import make_farms
+from samplestore import SampleStore
+from shared_state import SharedState
+
+
+def test_failed_apply_skips_persist_and_log():
+    applied, persisted = [], []
+
+    def apply(kind, payload):
+        if payload.get("fail"):
+            raise ValueError("bad event")
+        applied.append(payload)
+
+    shared = SharedState(None, apply, persist=lambda kind, payload: persisted.append(payload))
+    with shared.writing() as events:
+        events.append(("readings", {"n": 1}))
+    with pytest.raises(ValueError):
+        with shared.writing() as events:
+            events.append(("readings", {"n": 2}))
+            events.append(("readings", {"n": 3, "fail": True}))
+    assert persisted == [{"n": 1}]
+    with shared.writing() as events:
+        events.append(("readings", {"n": 4}))
+    assert persisted == [{"n": 1}, {"n": 4}]
+
+
+def test_failed_apply_leaves_the_sample_store_untouched(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "SAMPLE_STORE", SampleStore(str(tmp_path)))
+    app.load_farms(make_farms(20, history_points=2))
+    fids = [f.id for f in app.FARMS]
+    counts = {fid: len(app.SAMPLE_STORE.rows(fid)) for fid in fids}
+    time_iso = datetime(2026, 1, 1).isoformat()
+    with pytest.raises(ValueError):
+        with app.SHARED.writing() as events:
+            events.append(app.batch_event(fids, [1.0] * (len(fids) - 1) + [float("nan")], "t", "", time_iso))
+    reopened = SampleStore(str(tmp_path))
+    assert {fid: len(reopened.rows(fid)) for fid in fids} == counts
+    with app.SHARED.writing() as events:
+        events.append(app.batch_event(fids, [2.0] * len(fids), "t", "", time_iso))
+    reopened = SampleStore(str(tmp_path))
+    assert {fid: len(reopened.rows(fid)) for fid in fids} == {fid: n + 1 for fid, n in counts.items()}
+
+
+class Replica:
+    """A replica that remembers every event it applied, in order"""
+
+    def __init__(self, path, snapshot_every=10000, checkpoint=None):
+        self.events = []
+        self.shared = SharedState(path, self.apply, snapshot=lambda: {"events": list(self.events)},
+                                  snapshot_every=snapshot_every, image=lambda: list(self.events),
+                                  restore=self.restore, checkpoint=checkpoint)
+
+    def apply(self, kind, payload):
+        if kind == "load":
+            self.events = list(payload["events"])
+        else:
+            self.events.append([payload["writer"], payload["n"]])
+
+    def restore(self, image):
+        self.events = image
+
+
+def write_events(path, writer, count, snapshot_every=10000):
+    replica = Replica(path, snapshot_every)
+    for n in range(count):
+        with replica.shared.writing() as events:
+            events.append(("mark", {"writer": writer, "n": n}))
+
+
+def test_concurrent_writers_in_other_processes_converge(tmp_path):
+    path = str(tmp_path / "state.db")
+    ctx = multiprocessing.get_context("fork")
+    writers = [ctx.Process(target=write_events, args=(path, w, 200)) for w in range(3)]
+    for p in writers:
+        p.start()
+    watcher = Replica(path)
+    watcher.shared.sync()  # possibly mid-run
+    for p in writers:
+        p.join(60)
+        assert p.exitcode == 0
+    watcher.shared.sync()
+    assert watcher.shared.current()
+    fresh = Replica(path)
+    fresh.shared.sync()
+    assert watcher.events == fresh.events
+    # every write landed exactly once, and each writer's own writes stay in order
+    for w in range(3):
+        assert [n for writer, n in fresh.events if writer == w] == list(range(200))
+    assert len(fresh.events) == 600
+
+
+def test_lagging_replica_catches_up_past_compaction(tmp_path):
+    path = str(tmp_path / "state.db")
+    lagging = Replica(path)
+    write_events(path, 0, 5)
+    lagging.shared.sync()
+    assert lagging.events == [[0, n] for n in range(5)]
+    ctx = multiprocessing.get_context("fork")
+    p = ctx.Process(target=write_events, args=(path, 1, 50, 7))  # compacts the log every 7 writes
+    p.start()
+    p.join(60)
+    assert p.exitcode == 0
+    assert not lagging.shared.current()
+    (first,) = lagging.shared._conn().execute("SELECT min(seq) FROM events").fetchone()
+    assert first > lagging.shared.seq + 1  # the events it still needs were compacted away
+    lagging.shared.sync()
+    assert lagging.shared.current()
+    assert lagging.events == [[0, n] for n in range(5)] + [[1, n] for n in range(50)]
+
+
+def test_checkpoint_of_another_log_is_ignored(tmp_path, caplog):
+    checkpoint = str(tmp_path / "replica.ckpt")
+    first = Replica(str(tmp_path / "a.db"), checkpoint=checkpoint)
+    write_events(first.shared.path, 0, 3)
+    first.shared.start(poll_interval=3600)
+    first.shared.save_checkpoint()
+    other = Replica(str(tmp_path / "b.db"), checkpoint=checkpoint)
+    write_events(other.shared.path, 1, 2)
+    other.shared.start(poll_interval=3600)
+    assert other.events == [[1, 0], [1, 1]]
+    with open(checkpoint, "wb") as fh:
+        fh.write(b"not a pickle")
+    with caplog.at_level(logging.WARNING, logger="shared_state"):
+        again = Replica(first.shared.path, checkpoint=checkpoint)
+        again.shared.start(poll_interval=3600)
+    assert again.events == [[0, n] for n in range(3)]
+    assert "unreadable replica checkpoint" in caplog.text